@@ -4,14 +4,14 @@ import os
 import logging
 from contextlib import closing
 from argparse import ArgumentParser
-from json import loads, load
+from json import load
 from msgbus.client import MsgbusSubClient
 import pyircbot
 import traceback
 from pyircbot.pyircbot import PrimitiveBot
 from pyircbot.irccore import IRCEvent, UserPrefix
 from pyircbot.common import TouchReload
-from json import dumps
+from pyircbot.codec import JSON
 
 
 class PyIRCBotSub(PrimitiveBot):
@@ -50,11 +50,11 @@ class PyIRCBotSub(PrimitiveBot):
         command = channel.split("_", 1)[1]
 
         if command == "meta_update":
-            self.meta.update(loads(rest))
+            self.meta.update(JSON.loads(rest))
             print(self.meta)
             return
 
-        args, sender, trailing, extras = loads(rest)
+        args, sender, trailing, extras = JSON.loads(rest)
         nick, username, hostname = extras["prefix"]
 
         msg = IRCEvent(command.upper(),
@@ -101,7 +101,7 @@ class PyIRCBotSub(PrimitiveBot):
         :param message: the message to send
         :type message: str"""
         # self.sendRaw("PRIVMSG %s :%s" % (towho, message))
-        self.client.pub("pyircbot_send", "{} {} {}".format(self.name, "privmsg", dumps([towho, message])))
+        self.client.pub("pyircbot_send", "{} {} {}".format(self.name, "privmsg", JSON.dumps([towho, message])))
 
     def getBestModuleForService(self, service):
         if service == "services":
@@ -0,0 +1,119 @@
+"""
+.. module:: codec
+    :synopsis: Serializers shared by the RPC server and the message bus
+
+.. moduleauthor:: Dave Pedu <dave@davepedu.com>
+
+Faster backends are used when they're installed: orjson or ujson for JSON, msgpack for the binary encoding. The
+stdlib json module is always available as a fallback. The JSON codecs all write orjson's compact form, without spaces
+and with non-ascii characters left unescaped, so the encoded text doesn't depend on which backend is installed.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Codec(object):
+    """
+    A pair of functions converting between python objects and their encoded form.
+
+    :param name: name of the codec
+    :type name: str
+    :param dumps: function encoding an object. Returns str, or bytes for binary codecs. Raises TypeError if the object
+                  can't be encoded
+    :param loads: function decoding str or bytes. Raises ValueError on malformed input
+    :param binary: True if the encoded form is bytes
+    :type binary: bool
+    """
+    def __init__(self, name, dumps, loads, binary=False):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+        self.binary = binary
+
+    def __repr__(self):
+        return "<Codec %s>" % self.name
+
+
+def _stdjson_dumps(obj):
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def _ujson_dumps(obj):
+    return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+
+
+def _orjson_default(obj):
+    if isinstance(obj, tuple):  # namedtuples, such as UserPrefix
+        return list(obj)
+    raise TypeError("Type is not JSON serializable: {}".format(type(obj).__name__))
+
+
+def _orjson_dumps(obj):
+    try:
+        return orjson.dumps(obj, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS).decode("UTF-8")
+    except TypeError:  # orjson refuses some things the stdlib handles, such as integers beyond 64 bits
+        return _stdjson_dumps(obj)
+
+
+def _msgpack_loads(data):
+    try:
+        return msgpack.unpackb(data, raw=False)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(str(e))
+
+
+codecs = {}
+"""Available codecs, by name"""
+
+
+def register(codec):
+    """
+    Make a codec available through :py:func:`get`
+
+    :param codec: the codec to add
+    :type codec: Codec
+    """
+    codecs[codec.name] = codec
+
+
+def get(name="json"):
+    """
+    Return a codec by name. "json" is the fastest JSON codec available.
+
+    :param name: name of the codec, such as "json", "stdjson", "orjson", "ujson" or "msgpack"
+    :type name: str
+    :raises: ValueError if the codec is unknown or its backend isn't installed
+    """
+    if name not in codecs:
+        raise ValueError("Codec {} is not available. Available: {}".format(name, ", ".join(sorted(codecs))))
+    return codecs[name]
+
+
+register(Codec("stdjson", _stdjson_dumps, json.loads))
+if ujson:
+    register(Codec("ujson", _ujson_dumps, ujson.loads))
+if orjson:
+    register(Codec("orjson", _orjson_dumps, orjson.loads))
+if msgpack:
+    register(Codec("msgpack", lambda obj: msgpack.packb(obj, use_bin_type=True), _msgpack_loads, binary=True))
+
+JSON = codecs.get("orjson") or codecs.get("ujson") or codecs["stdjson"]
+"""The fastest JSON codec available"""
+codecs["json"] = JSON
@@ -82,7 +82,7 @@ Currently, JSON-RPC 2.0 and JSON-RPC 1.0 are implemented
 
 :note:      all exceptions derived from RPCFault are propagated to the client.
             other exceptions are logged and result in a sent-back "empty" INTERNAL_ERROR.
-:uses:      logging, sys, json, codecs, time, socket, select
+:uses:      logging, sys, pyircbot.codec, codecs, time, socket, selectors, threading, concurrent.futures
 :seealso:   JSON-RPC 2.0 proposal, 1.0 specification
 :warning:
     .. Warning::
@@ -93,14 +93,11 @@ Currently, JSON-RPC 2.0 and JSON-RPC 1.0 are implemented
     - 2017-12-03-RELEASE    Modern python 3.0 rewrite
 
 :todo:
-    - server: multithreading rpc-server
-    - client: multicall (send several requests)
     - transport: SSL sockets, maybe HTTP, HTTPS
     - types: support for date/time (ISO 8601)
     - errors: maybe customizable error-codes/exceptions
     - mixed 1.0/2.0 server ?
     - system description etc. ?
-    - maybe test other json-serializers, like cjson?
 """
 
 __version__ = "2017-12-03-RELEASE"
@@ -112,11 +109,15 @@ __author__ = "Dave Pedu (dave(at)davepedu.com)"
 
 import logging
 import sys
-import json  #TODO faster implementation
+import types
 import codecs
 import time
 import socket
-import select
+import selectors
+from threading import Lock, Thread
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pyircbot.codec import JSON
 
 
 # =========================================
@@ -134,6 +135,7 @@ PROCEDURE_EXCEPTION    = -32000
 AUTHENTIFICATION_ERROR = -32001
 PERMISSION_DENIED      = -32002
 INVALID_PARAM_VALUES   = -32003
+SERVER_BUSY = -32004
 
 # human-readable messages
 ERROR_MESSAGE = {
@@ -145,7 +147,8 @@ ERROR_MESSAGE = {
     PROCEDURE_EXCEPTION:    "Procedure exception.",
     AUTHENTIFICATION_ERROR: "Authentification error.",
     PERMISSION_DENIED:      "Permission denied.",
-    INVALID_PARAM_VALUES:   "Invalid parameter values."
+    INVALID_PARAM_VALUES:   "Invalid parameter values.",
+    SERVER_BUSY:            "Server busy."
 }
 
 
@@ -245,6 +248,12 @@ class RPCInvalidParamValues(RPCFault):
         RPCFault.__init__(self, INVALID_PARAM_VALUES, ERROR_MESSAGE[INVALID_PARAM_VALUES], error_data)
 
 
+class RPCServerBusy(RPCFault):
+    """SERVER_BUSY"""
+    def __init__(self, error_data=None):
+        RPCFault.__init__(self, SERVER_BUSY, ERROR_MESSAGE[SERVER_BUSY], error_data)
+
+
 ERROR_CODE_EXCEPTIONS = {PARSE_ERROR: RPCParseError,
                          INVALID_REQUEST: RPCInvalidRPC,
                          METHOD_NOT_FOUND: RPCMethodNotFound,
@@ -253,7 +262,8 @@ ERROR_CODE_EXCEPTIONS = {PARSE_ERROR: RPCParseError,
                          PROCEDURE_EXCEPTION: RPCProcedureException,
                          AUTHENTIFICATION_ERROR: RPCAuthentificationError,
                          PERMISSION_DENIED: RPCPermissionDenied,
-                         INVALID_PARAM_VALUES: RPCInvalidParamValues}
+                         INVALID_PARAM_VALUES: RPCInvalidParamValues,
+                         SERVER_BUSY: RPCServerBusy}
 
 
 class JsonRpc10:
@@ -267,11 +277,11 @@ class JsonRpc10:
     :seealso: JSON-RPC 1.0 specification
     :todo: catch json.dumps not-serializable-exceptions
     """
-    def __init__(self, dumps=json.dumps, loads=json.loads):
+    def __init__(self, dumps=JSON.dumps, loads=JSON.loads):
         """
         init: set serializer to use
 
-        :param dumps: json-encoder-function
+        :param dumps: json-encoder-function. Defaults to the fastest one available, see :py:mod:`pyircbot.codec`
         :param loads: json-decoder-function
         :note: The dumps_* functions of this class already directly create the invariant parts of the resulting
                json-object themselves, without using the given json-encoder-function.
@@ -438,11 +448,11 @@ class JsonRpc20(object):
     :todo: catch simplejson.dumps not-serializable-exceptions
     :todo: rewrite serializer as modern java encoder subclass? support for more types this way?
     """
-    def __init__(self, dumps=json.dumps, loads=json.loads):
+    def __init__(self, dumps=JSON.dumps, loads=JSON.loads):
         """
         init: set serializer to use
 
-        :param dumps: json-encoder-function
+        :param dumps: json-encoder-function. Defaults to the fastest one available, see :py:mod:`pyircbot.codec`
         :param loads: json-decoder-function
         :note: The dumps_* functions of this class already directly create the invariant parts of the resulting
                json-object themselves, without using the given json-encoder-function.
@@ -539,6 +549,46 @@ class JsonRpc20(object):
             data = self.loads(string)
         except ValueError as err:
             raise RPCParseError("No valid JSON. ({})".format(err))
+        return self._request(data)
+
+    def loads_batch(self, string):
+        """
+        de-serialize a JSON-RPC batch of Requests and Notifications
+
+        :return: list with an entry per batch member: like the return value of loads_request, or the RPCFault
+                 describing why that member is invalid
+        :raises: RPCParseError, RPCInvalidRPC if the batch is not a non-empty array
+        """
+        try:
+            data = self.loads(string)
+        except ValueError as err:
+            raise RPCParseError("No valid JSON. ({})".format(err))
+        if not isinstance(data, list) or not data:
+            raise RPCInvalidRPC("Invalid Request, batch must be a non-empty array.")
+        requests = []
+        for item in data:
+            try:
+                requests.append(self._request(item))
+            except RPCFault as err:
+                requests.append(err)
+        return requests
+
+    def dumps_batch(self, messages):
+        """
+        serialize a JSON-RPC batch
+
+        :param messages: serialized requests/notifications or responses, as returned by the dumps_* methods
+        :type messages: list
+        :return: str like `[..., ...]`
+        """
+        return "[{}]".format(", ".join(messages))
+
+    def _request(self, data):
+        """
+        validate a de-serialized Request or Notification
+
+        :see: loads_request
+        """
         if not isinstance(data, dict):
             raise RPCInvalidRPC("No valid RPC-package.")
         if "jsonrpc" not in data:
@@ -553,7 +603,7 @@ class JsonRpc20(object):
             raise RPCInvalidRPC('Invalid Request, "method" must be a string.')
         if "params" not in data:
             data["params"] = ()
-        elif not isinstance(data["params"], (list, tuple)):
+        elif not isinstance(data["params"], (list, tuple, dict)):
             raise RPCInvalidRPC('Invalid Request, "params" must be an array or object.')
         if not(len(data) == 3 or ("id" in data and len(data) == 4)):
             raise RPCInvalidRPC('Invalid Request, additional fields found.')
@@ -574,6 +624,35 @@ class JsonRpc20(object):
             data = self.loads(string)
         except ValueError as err:
             raise RPCParseError("No valid JSON. ({})".format(err))
+        return self._response(data)
+
+    def loads_response_batch(self, string):
+        """
+        de-serialize the Responses to a JSON-RPC batch
+
+        :return: list of `[result, id]`, one per Response. For error-responses, result is the RPCFault.
+        :raises: RPCParseError, RPCInvalidRPC, RPCFault+derivates if the server answered the whole batch with an error
+        """
+        try:
+            data = self.loads(string)
+        except ValueError as err:
+            raise RPCParseError("No valid JSON. ({})".format(err))
+        if not isinstance(data, list):
+            return [self._response(data)]  # raises for the error the server rejected the batch with
+        responses = []
+        for item in data:
+            try:
+                responses.append(self._response(item))
+            except RPCFault as err:
+                responses.append((err, item.get("id") if isinstance(item, dict) else None))
+        return responses
+
+    def _response(self, data):
+        """
+        validate a de-serialized Response/error
+
+        :see: loads_response
+        """
         if not isinstance(data, dict):
             raise RPCInvalidRPC("No valid RPC-package.")
         if "jsonrpc" not in data:
@@ -673,7 +752,7 @@ class Transport(object):
         self.send(string)
         return self.recv()
 
-    def serve(self, handler, n=None):
+    def serve(self, handler, n=None, faulthandler=None):
         """
         serve (forever or for n communicaions).
 
@@ -681,6 +760,9 @@ class Transport(object):
         - call result = handler(data)
         - send back result if not None
 
+        If the transport rejects a request itself (e.g. because it is too large), faulthandler(RPCFault) is called
+        instead of handler and its result is sent back.
+
         The serving can be stopped by SIGINT.
 
         :TODO:
@@ -716,10 +798,27 @@ class TransportSTDINOUT(Transport):
         return sys.stdin.read()
 
 
+class _connection(object):
+    """
+    Server-side state of a client connection.
+    """
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.buffer = bytearray()
+        self.deadline = None
+
+
 class TransportSocket(Transport):
     """
     Transport via socket.
 
+    Messages are newline-terminated, so a connection stays open and carries any number of requests. Clients that
+    instead shut down their sending side after an unterminated request are answered once and disconnected. An
+    unterminated request the client doesn't follow up on is answered once it parses as a complete JSON object or array,
+    for older clients that wait for the reply without shutting down their side. The serializer must not put raw
+    newlines into its messages (json.dumps without indent doesn't).
+
     :TODO:
         - documentation
         - improve this (e.g. make sure that connections are closed, socket-files are deleted etc.)
@@ -727,11 +826,18 @@ class TransportSocket(Transport):
     """
     def __init__(self, addr, limit=4096,
                  sock_type=socket.AF_INET, sock_prot=socket.SOCK_STREAM, timeout=1.0,
-                 logfunc=log_dummy):
+                 logfunc=log_dummy, threads=1, max_connections=64, max_request=1048576, conn_timeout=10.0):
         """
         :param addr: socket-address
+        :param limit: size of the chunks read from the socket
         :param timeout: connect timeout in seconds
         :param logfunc: function for logging, logfunc(message)
+        :param threads: number of requests the server handles concurrently
+        :param max_connections: number of client connections the server holds open at once. Further clients wait in
+                                the listen backlog.
+        :param max_request: largest request in bytes the server accepts
+        :param conn_timeout: seconds the server keeps an idle connection open, and gives a client to send the whole
+                             of a request
         :Raises: socket.timeout after timeout
         """
         self.limit = limit
@@ -741,6 +847,17 @@ class TransportSocket(Transport):
         self.s = None
         self.timeout = timeout
         self.log = logfunc
+        self.threads = max(1, threads)
+        self.max_connections = max_connections
+        self.max_request = max_request
+        self.conn_timeout = conn_timeout
+        self._rbuf = bytearray()
+        self._wake = None
+        self._returned = deque()
+
+    def _nodelay(self, sock):
+        if self.s_type in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
     def _send(self, conn, result):
         """
@@ -749,7 +866,22 @@ class TransportSocket(Transport):
         :param result: text result to send
         :type result str:
         """
-        conn.send(result.encode("UTF-8"))
+        conn.sendall(result.encode("UTF-8") + b"\n")
+
+    def _discard(self, conn):
+        """
+        Read and drop whatever else the client sends, so that closing the connection does not reset it before the
+        client has read our reply. Gives up after another max_request bytes.
+        """
+        size = 0
+        try:
+            while size <= self.max_request:
+                chunk = conn.recv(self.limit)
+                if not chunk:
+                    break
+                size += len(chunk)
+        except OSError:
+            pass
 
     def connect(self):
         self.close()
@@ -758,12 +890,19 @@ class TransportSocket(Transport):
         self.s.settimeout(self.timeout)
         self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.s.connect(self.addr)
+        self._nodelay(self.s)
+        self._rbuf = bytearray()
 
     def close(self):
         if self.s:
             self.log("close %s" % repr(self.addr))
             self.s.close()
             self.s = None
+        if self._wake:  # stop a running serve()
+            try:
+                self._wake.send(b"\0")
+            except OSError:
+                pass
 
     def __repr__(self):
         return "<TransportSocket, %s>" % repr(self.addr)
@@ -772,70 +911,304 @@ class TransportSocket(Transport):
         if not self.s:
             self.connect()
         self.log("--> {}".format(repr(string)))
-        self.s.sendall(string.encode("UTF-8"))
+        self.s.sendall(string.encode("UTF-8") + b"\n")
 
     def recv(self):
+        """
+        receive one message. A server closing the connection also ends a message.
+
+        :raises: RPCTransportError if the connection was closed before anything was received
+        """
         if not self.s:
             self.connect()
-        data = self.s.recv(self.limit)
-        #TODO: this select is probably not necessary, because server closes this socket
-        while select.select((self.s,), (), (), 0.1)[0]:
-            d = self.s.recv(self.limit)
-            if len(d) == 0:
+        while True:
+            pos = self._rbuf.find(b"\n")
+            if pos != -1:
+                data = bytes(self._rbuf[:pos])
+                del self._rbuf[:pos + 1]
                 break
-            data += d
+            chunk = self.s.recv(self.limit)
+            if not chunk:
+                data = bytes(self._rbuf)
+                self.close()
+                if not data:
+                    raise RPCTransportError("Connection closed by server")
+                break
+            self._rbuf += chunk
         self.log("<-- {}".format(repr(data)))
         return data.decode("UTF-8")
 
     def sendrecv(self, string):
-        """send data + receive data + close"""
+        """send data + receive data, over the open connection if there is one
+
+        A connection the server has closed in the meantime (e.g. after it idled out) is replaced and the request is
+        sent again, unless part of a reply had come back, which means the server got the request.
+        """
+        reused = self.s is not None
         try:
             self.send(string)
             return self.recv()
-        finally:
+        except (RPCTransportError, ConnectionError):
+            partial = bool(self._rbuf)
+            self.close()
+            if not reused or partial:  # the server may have run the request already
+                raise
+        except Exception:
             self.close()
+            raise
+        try:
+            self.send(string)
+            return self.recv()
+        except Exception:
+            self.close()
+            raise
 
-    def serve(self, handler, n=None):
+    def serve(self, handler, n=None, faulthandler=None):
         """open socket, wait for incoming connections and handle them.
 
+        Idle connections are watched by a selector. Connections with pending requests are served by a pool of worker
+        threads if threads > 1, so a slow request or a stalled client doesn't block the others. A streaming reply takes
+        its connection over to a thread of its own, leaving the pool to other requests, and hands it back once the
+        stream ends.
+
         :Parameters:
-            - n: serve n requests, None=forever
+            - n: serve n connections, None=forever
         """
         self.close()
-        self.s = socket.socket(self.s_type, self.s_prot)
+        listen = self.s = socket.socket(self.s_type, self.s_prot)
         self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="RPCConn") if self.threads > 1 else None
+        selector = selectors.DefaultSelector()
+        wake, self._wake = socket.socketpair()
+        conns = set()
+        parked = set()
+        n_current = 0
+        accepting = True
+
+        def park(conn):
+            conn.deadline = time.time() + self.conn_timeout
+            parked.add(conn)
+            selector.register(conn.sock, selectors.EVENT_READ, conn)
+
+        def finish(conn):
+            nonlocal accepting
+            self.log("%s close" % repr(conn.addr))
+            conn.sock.close()
+            conns.discard(conn)
+            if not accepting and len(conns) < self.max_connections and (n is None or n_current < n):
+                selector.register(listen, selectors.EVENT_READ)
+                accepting = True
+
         try:
             self.log("listen {}".format(repr(self.addr)))
-            self.s.bind(self.addr)
-            self.s.listen(1)
-            n_current = 0
-            while 1:
-                if n is not None and n_current >= n:
+            listen.bind(self.addr)
+            listen.listen(max(self.max_connections, 5))
+            selector.register(listen, selectors.EVENT_READ)
+            selector.register(wake, selectors.EVENT_READ)
+            while self.s is listen:
+                if n is not None and n_current >= n and not conns:
                     break
-                try:
-                    conn, addr = self.s.accept()
-                except OSError:  # Socket likely shut down
-                    break
-                self.log("%s connected" % repr(addr))
-                data = conn.recv(self.limit)
-                self.log("%s --> %s" % (repr(addr), repr(data)))
-                result = handler(data)
-                if data:
-                    self.log("%s <-- %s" % (repr(addr), repr(result)))
-                    self._send(conn, result)
-                self.log("%s close" % repr(addr))
-                conn.close()
-                n_current += 1
+                now = time.time()
+                for conn in [c for c in parked if c.deadline <= now]:
+                    self.log("%s idle" % repr(conn.addr))
+                    parked.discard(conn)
+                    selector.unregister(conn.sock)
+                    finish(conn)
+                timeout = min([c.deadline for c in parked], default=now + self.conn_timeout) - now
+                for key, _ in selector.select(max(timeout, 0)):
+                    if key.fileobj is listen:
+                        try:
+                            sock, addr = listen.accept()
+                        except OSError:  # Socket likely shut down
+                            break
+                        self.log("%s connected" % repr(addr))
+                        self._nodelay(sock)
+                        conn = _connection(sock, addr)
+                        conns.add(conn)
+                        n_current += 1
+                        park(conn)
+                        if len(conns) >= self.max_connections or (n is not None and n_current >= n):
+                            selector.unregister(listen)
+                            accepting = False
+                    elif key.fileobj is wake:
+                        wake.recv(4096)
+                        while self._returned:
+                            conn, keep = self._returned.popleft()
+                            if keep:
+                                park(conn)
+                            else:
+                                finish(conn)
+                    else:
+                        conn = key.data
+                        parked.discard(conn)
+                        selector.unregister(conn.sock)
+                        if pool:
+                            pool.submit(self._handle_async, conn, handler, faulthandler)
+                            continue
+                        keep = self._handle(conn, handler, faulthandler)
+                        if keep:
+                            park(conn)
+                        elif keep is not None:
+                            finish(conn)
         finally:
+            if pool:
+                pool.shutdown(wait=False)
+            for conn in conns:
+                conn.sock.close()
+            selector.close()
+            self._wake.close()
+            self._wake = None
+            wake.close()
             self.close()
 
+    def _handle_async(self, conn, handler, faulthandler):
+        """
+        Run _handle on a worker thread and hand the connection back to the serve() loop.
+        """
+        self._hand_back(conn, self._handle(conn, handler, faulthandler))
+
+    def _hand_back(self, conn, keep):
+        """
+        Return a connection to the serve() loop, to be kept open or closed. Nothing is done for a connection a stream
+        has taken over.
+        """
+        if keep is None:
+            return
+        self._returned.append((conn, keep))
+        try:
+            self._wake.send(b"\0")
+        except (OSError, AttributeError):  # server shut down
+            conn.sock.close()
+
+    def _stream_async(self, conn, stream, handler, faulthandler):
+        """
+        Send a streaming reply on a thread of its own, then go on answering the connection's requests.
+        """
+        try:
+            self._reply(conn, stream)
+        except OSError as err:
+            self.log("%s error: %s" % (repr(conn.addr), err))
+            keep = False
+        except Exception:
+            logging.getLogger('RPCLib').exception("Error streaming to RPC connection from %s" % repr(conn.addr))
+            keep = False
+        else:
+            keep = self._handle(conn, handler, faulthandler, receive=False)
+        self._hand_back(conn, keep)
+
+    def _answer(self, conn, request, handler, faulthandler):
+        """
+        Answer one request. A streaming reply is started on its own thread, which takes the connection over.
+
+        :return: True if a stream took the connection over
+        """
+        result = handler(request)
+        if result is None or isinstance(result, str):
+            self._reply(conn, result)
+            return False
+        Thread(target=self._stream_async, args=(conn, result, handler, faulthandler), name="RPCStream",
+               daemon=True).start()
+        return True
+
+    def _handle(self, conn, handler, faulthandler, receive=True):
+        """
+        Read and answer the requests waiting on a readable connection.
+
+        Each request must arrive within conn_timeout of the first read for it, however slowly the client trickles it
+        in.
+
+        :param receive: False to answer the requests already buffered before reading more
+        :return: True if the connection should be kept open, False if it should be closed, None if a stream took it
+                 over
+        """
+        try:
+            deadline = time.time() + self.conn_timeout
+            while True:
+                chunk = None
+                if receive:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise socket.timeout("request not received within %ss" % self.conn_timeout)
+                    conn.sock.settimeout(remaining)
+                    chunk = conn.sock.recv(self.limit)
+                    conn.buffer += chunk
+                receive = True
+                while True:
+                    pos = conn.buffer.find(b"\n")
+                    if pos == -1:
+                        break
+                    line = bytes(conn.buffer[:pos])
+                    del conn.buffer[:pos + 1]
+                    if line.strip():
+                        if self._answer(conn, line, handler, faulthandler):
+                            return None
+                        deadline = time.time() + self.conn_timeout
+                if chunk and self._unframed(conn.buffer):  # a client that waits for a reply without a newline
+                    request = bytes(conn.buffer)
+                    conn.buffer.clear()
+                    if self._answer(conn, request, handler, faulthandler):
+                        return None
+                    deadline = time.time() + self.conn_timeout
+                if chunk == b"":  # client is done, answer an unterminated request it may have left
+                    request = bytes(conn.buffer)
+                    conn.buffer.clear()
+                    if request.strip() and self._answer(conn, request, handler, faulthandler):
+                        return None
+                    return False
+                if len(conn.buffer) > self.max_request:
+                    fault = RPCInvalidRPC("Request exceeds {} bytes".format(self.max_request))
+                    self._reply(conn, faulthandler(fault) if faulthandler else None)
+                    conn.sock.shutdown(socket.SHUT_WR)
+                    self._discard(conn.sock)
+                    return False
+                if not conn.buffer:
+                    return True
+        except socket.timeout:
+            self.log("%s timed out" % repr(conn.addr))
+        except OSError as err:
+            self.log("%s error: %s" % (repr(conn.addr), err))
+        except Exception:
+            logging.getLogger('RPCLib').exception("Error handling RPC connection from %s" % repr(conn.addr))
+        return False
+
+    def _unframed(self, buffer):
+        """
+        Check if an unterminated request is complete, for clients that send one request without a newline and wait
+        for the reply without shutting down their sending side. Only buffers ending like a JSON object or array are
+        parsed, so requests still arriving aren't parsed over and over.
+        """
+        if b"\n" in buffer or not buffer.rstrip().endswith((b"}", b"]")):
+            return False
+        try:
+            JSON.loads(bytes(buffer))
+        except Exception:
+            return False
+        return True
+
+    def _reply(self, conn, result):
+        if result is None:
+            return
+        if isinstance(result, str):
+            self.log("%s <-- %s" % (repr(conn.addr), repr(result)))
+            self._send(conn.sock, result)
+            return
+        # streaming reply, sent until it ends or the client goes away
+        try:
+            for message in result:
+                self.log("%s <-- %s" % (repr(conn.addr), repr(message)))
+                self._send(conn.sock, message)
+                if self._wake is None:  # server shut down
+                    break
+        finally:
+            result.close()
+
 
 if hasattr(socket, 'AF_UNIX'):
     class TransportUnixSocket(TransportSocket):
         """
         Transport via Unix Domain Socket.
         """
-        def __init__(self, addr=None, limit=4096, timeout=1.0, logfunc=log_dummy):
+        def __init__(self, addr=None, limit=4096, timeout=1.0, logfunc=log_dummy, **kwargs):
             """
             :param addr: path to socket file
             :type addr: str
@@ -843,20 +1216,65 @@ if hasattr(socket, 'AF_UNIX'):
                    and no socket-file is created.
             :see:   TransportSocket
             """
-            TransportSocket.__init__(self, addr, limit, socket.AF_UNIX, socket.SOCK_STREAM, timeout, logfunc)
+            TransportSocket.__init__(self, addr, limit, socket.AF_UNIX, socket.SOCK_STREAM, timeout, logfunc, **kwargs)
 
 
 class TransportTcpIp(TransportSocket):
     """
     Transport via TCP/IP.
     """
-    def __init__(self, addr=None, limit=4096, timeout=1.0, logfunc=log_dummy):
+    def __init__(self, addr=None, limit=4096, timeout=1.0, logfunc=log_dummy, **kwargs):
         """
         :param addr: ("host", port)
         :type param: tuple
         :see: TransportSocket
         """
-        TransportSocket.__init__(self, addr, limit, socket.AF_INET, socket.SOCK_STREAM, timeout, logfunc)
+        TransportSocket.__init__(self, addr, limit, socket.AF_INET, socket.SOCK_STREAM, timeout, logfunc, **kwargs)
+
+
+class TransportPool(Transport):
+    """
+    Thread-safe pool of persistent transports.
+
+    Each call checks out an idle transport, or creates one with factory() if there is none, and returns it
+    afterwards. Up to `size` idle transports are kept open for reuse.
+    """
+    def __init__(self, factory, size=4):
+        """
+        :param factory: callable returning a new Transport instance
+        :param size: number of idle transports to keep
+        """
+        self.factory = factory
+        self.size = size
+        self.idle = []
+        self.lock = Lock()
+
+    def __repr__(self):
+        return "<TransportPool of %s>" % self.size
+
+    def sendrecv(self, string):
+        with self.lock:
+            transport = self.idle.pop() if self.idle else None
+        if transport is None:
+            transport = self.factory()
+        try:
+            result = transport.sendrecv(string)
+        except Exception:
+            transport.close()
+            raise
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(transport)
+                transport = None
+        if transport:
+            transport.close()
+        return result
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for transport in idle:
+            transport.close()
 
 
 class ServerProxy(object):
@@ -866,7 +1284,7 @@ class ServerProxy(object):
 
     It works with different data/serializers and different transports.
 
-    Notifications and id-handling/multicall are not yet implemented.
+    Notifications are not yet implemented. Several calls can be sent at once using multicall().
 
     :example: see module-docstring
     :todo: verbose/logging?
@@ -906,6 +1324,36 @@ class ServerProxy(object):
         resp = self.__data_serializer.loads_response(resp_str)
         return resp[0]
 
+    def __batch(self, calls):
+        if not calls:
+            return []
+        requests = []
+        for id, (methodname, args, kwargs) in enumerate(calls):
+            if args and kwargs:
+                raise ValueError("Only positional or named parameters are allowed!")
+            requests.append(self.__data_serializer.dumps_request(methodname, kwargs or args, id))
+
+        try:
+            resp_str = self.__transport.sendrecv(self.__data_serializer.dumps_batch(requests))
+        except Exception as err:
+            raise RPCTransportError(err)
+        results = [RPCInvalidRPC("Missing response.")] * len(calls)
+        for result, id in self.__data_serializer.loads_response_batch(resp_str):
+            if isinstance(id, int) and 0 <= id < len(calls):
+                results[id] = result
+        return results
+
+    def multicall(self):
+        """
+        Collect calls and send them to the server in one round trip.
+
+        :returns: MultiCall
+        :raises: ValueError if the serializer doesn't support batches (JSON-RPC 1.0)
+        """
+        if not hasattr(self.__data_serializer, "dumps_batch"):
+            raise ValueError("Batches are only supported by JSON-RPC 2.0")
+        return MultiCall(self.__batch)
+
     def __getattr__(self, name):
         # magic method dispatcher
         #  note: to call a remote object with an non-standard name, use
@@ -913,6 +1361,70 @@ class ServerProxy(object):
         return _method(self.__req, name)
 
 
+class MultiCall(object):
+    """RPC-client: batch of calls
+
+    Calls made on a MultiCall are collected and sent as one JSON-RPC 2.0 batch when the `with` block ends, or when
+    the MultiCall is called. Results are then available in call order by iterating over or indexing the MultiCall.
+    Accessing the result of a call that failed raises its RPCFault.
+
+    :example:
+        >>> with proxy.multicall() as batch:
+        ...     batch.setPluginVar("Calc", "timeWindow", 60)
+        ...     batch.getLoadedModules()
+        >>> list(batch)
+        [[True, 'Var set'], ['Calc']]
+    """
+    def __init__(self, batch):
+        """
+        :param batch: callable sending a list of (methodname, args, kwargs) and returning the results
+        """
+        self.__batch = batch
+        self.__calls = []
+        self.__results = None
+
+    def __repr__(self):
+        return "<MultiCall of %s calls>" % len(self.__calls)
+
+    def __add(self, methodname, args, kwargs):
+        if self.__results is not None:
+            raise RPCError("MultiCall was already sent")
+        self.__calls.append((methodname, args, kwargs))
+
+    def __getattr__(self, name):
+        return _method(self.__add, name)
+
+    def __call__(self):
+        """
+        Send the collected calls.
+
+        :returns: self
+        """
+        if self.__results is None:
+            self.__results = self.__batch(self.__calls)
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self()
+
+    def __len__(self):
+        return len(self.__calls)
+
+    def __getitem__(self, index):
+        result = self().__results[index]
+        if isinstance(result, RPCFault):
+            raise result
+        return result
+
+    def __iter__(self):
+        for index in range(len(self.__calls)):
+            yield self[index]
+
+
 class _method(object):
     """
     Some "magic" to bind an RPC method to an RPC server. A request dispatcher.
@@ -950,11 +1462,14 @@ class Server(object):
         - mixed JSON-RPC 1.0/2.0 server?
         - logging/loglevels?
     """
-    def __init__(self, data_serializer, transport, logfile=None):
+    def __init__(self, data_serializer, transport, logfile=None, batch_threads=None, max_streams=None):
         """
         :param data_serializer: a data_structure+serializer-instance
         :param transport: a Transport instance
         :param logfile: file to log ("unexpected") errors to
+        :param batch_threads: if set, the calls of a batch are executed in parallel, by a pool of this many threads
+        :param max_streams: if set, calls to streaming methods are refused with RPCServerBusy while this many streams
+                            are open
         """
         #TODO: check all parameters
         self.__data_serializer = data_serializer
@@ -966,6 +1481,11 @@ class Server(object):
             with open(self.logfile, 'a'):  # create logfile (or raise exception)
                 pass
         self.funcs = {}
+        self.batch_pool = ThreadPoolExecutor(max_workers=batch_threads, thread_name_prefix="RPCBatch") \
+            if batch_threads else None
+        self.max_streams = max_streams
+        self.streams = 0
+        self.streams_lock = Lock()
 
     def __repr__(self):
         return "<Server for %s, with serializer %s>" % (self.__transport, self.__data_serializer)
@@ -1006,6 +1526,11 @@ class Server(object):
         """
         Add a function to the RPC-services.
 
+        A function returning a generator is a streaming method: its first item is sent as the response, and each
+        following (method, params) item is sent to the client as a notification on the same connection. Socket
+        transports run each stream on a thread of its own until it ends or the client disconnects. Streaming methods
+        can't be called in a batch.
+
         :param function: callable to add
         :param name: RPC-name for the function. If omitted/None, the original name of the function is used.
         :type name: str
@@ -1014,27 +1539,69 @@ class Server(object):
 
     def handle(self, rpcstr):
         """
-        Handle a RPC Request.
+        Handle a RPC Request or batch of Requests.
 
         :param rpcstr: the received rpc message
         :type rpcstr: str
         :Returns: the data to send back or None if nothing should be sent back
         :Raises:  RPCFault (and maybe others)
         """
-        #TODO: id
-        notification = False
+        if hasattr(self.__data_serializer, "loads_batch") and rpcstr.lstrip()[:1] in ("[", b"["):
+            return self.handle_batch(rpcstr)
         try:
             req = self.__data_serializer.loads_request(rpcstr)
-            if len(req) == 2:  # notification
-                method, params = req
-                notification = True
-            else:  # request
-                method, params, id = req
         except RPCFault as err:
             return self.__data_serializer.dumps_error(err, id=None)
         except Exception as err:
             self.log("%d (%s): %s" % (INTERNAL_ERROR, ERROR_MESSAGE[INTERNAL_ERROR], str(err)))
             return self.__data_serializer.dumps_error(RPCFault(INTERNAL_ERROR, ERROR_MESSAGE[INTERNAL_ERROR]), id=None)
+        return self.__dispatch(req)
+
+    def handle_batch(self, rpcstr):
+        """
+        Handle a batch of RPC Requests. The calls are executed in parallel if the server has a batch_pool.
+
+        :param rpcstr: the received rpc message
+        :type rpcstr: str
+        :Returns: the data to send back or None if the batch only contained Notifications
+        """
+        try:
+            reqs = self.__data_serializer.loads_batch(rpcstr)
+        except RPCFault as err:
+            return self.__data_serializer.dumps_error(err, id=None)
+        except Exception as err:
+            self.log("%d (%s): %s" % (INTERNAL_ERROR, ERROR_MESSAGE[INTERNAL_ERROR], str(err)))
+            return self.__data_serializer.dumps_error(RPCFault(INTERNAL_ERROR, ERROR_MESSAGE[INTERNAL_ERROR]), id=None)
+
+        def run(req):
+            if isinstance(req, RPCFault):
+                return self.__data_serializer.dumps_error(req, id=None)
+            return self.__dispatch(req, batch=True)
+
+        if self.batch_pool:
+            results = list(self.batch_pool.map(run, reqs))
+        else:
+            results = [run(req) for req in reqs]
+        results = [result for result in results if result is not None]
+        if not results:
+            return None
+        return self.__data_serializer.dumps_batch(results)
+
+    def __dispatch(self, req, batch=False):
+        """
+        Execute a parsed Request/Notification.
+
+        :param req: request as returned by the serializer's loads_request
+        :param batch: True if the request is part of a batch
+        :Returns: the data to send back or None if nothing should be sent back
+        """
+        #TODO: id
+        notification = False
+        if len(req) == 2:  # notification
+            method, params = req
+            notification = True
+        else:  # request
+            method, params, id = req
 
         if method not in self.funcs:
             if notification:
@@ -1049,7 +1616,7 @@ class Server(object):
         except RPCFault as err:
             if notification:
                 return None
-            return self.__data_serializer.dumps_error(err, id=None)
+            return self.__data_serializer.dumps_error(err, id)
         except Exception as err:
             logging.getLogger('RPCLib').error("Error executing RPC: %s" % str(err))
             if notification:
@@ -1061,16 +1628,68 @@ class Server(object):
         if notification:
             return None
 
+        if isinstance(result, types.GeneratorType):
+            if batch:
+                result.close()
+                return self.__data_serializer.dumps_error(
+                    RPCInvalidRPC("Streaming method {} can't be called in a batch".format(method)), id)
+            return self.__stream(result, id)
+
         try:
             return self.__data_serializer.dumps_response(result, id)
         except Exception as err:
             self.log("%d (%s): %s" % (INTERNAL_ERROR, ERROR_MESSAGE[INTERNAL_ERROR], str(err)))
             return self.__data_serializer.dumps_error(RPCFault(INTERNAL_ERROR, ERROR_MESSAGE[INTERNAL_ERROR]), id)
 
+    def __stream(self, stream, id):
+        """
+        Serialize the result of a streaming method. The first item the method yields is sent as the response, the
+        following items are (method, params) pairs sent as notifications. The stream is only counted against
+        max_streams once it starts, so one dropped before it's iterated is never counted.
+
+        :param stream: generator returned by the method
+        :param id: request id
+        """
+        with self.streams_lock:
+            busy = self.max_streams is not None and self.streams >= self.max_streams
+            if not busy:
+                self.streams += 1
+        if busy:
+            stream.close()
+            fault = RPCServerBusy("{} streams are already open".format(self.max_streams))
+            yield self.__data_serializer.dumps_error(fault, id)
+            return
+        try:
+            try:
+                result = next(stream)
+            except StopIteration:
+                result = None
+            except RPCFault as err:
+                yield self.__data_serializer.dumps_error(err, id)
+                return
+            yield self.__data_serializer.dumps_response(result, id)
+            for method, params in stream:
+                yield self.__data_serializer.dumps_notification(method, params)
+        finally:
+            stream.close()
+            with self.streams_lock:
+                self.streams -= 1
+
+    def handle_fault(self, err):
+        """
+        Build the reply to a request the transport rejected before it could be parsed.
+
+        :param err: reason the request was rejected
+        :type err: RPCFault
+        :Returns: the data to send back
+        """
+        self.log("%d (%s): %s" % (err.error_code, err.error_message, err.error_data))
+        return self.__data_serializer.dumps_error(err, id=None)
+
     def serve(self, n=None):
         """
         Run the server (forever or for n communicaions).
 
         :see: Transport
         """
-        self.__transport.serve(self.handle, n)
+        self.__transport.serve(self.handle, n, self.handle_fault)
@@ -9,6 +9,8 @@
 import re
 import os
 import logging
+from threading import Event, Thread
+from time import time
 from .common import load as pload
 from .common import messageHasCommand
 
@@ -97,6 +99,84 @@ class ModuleBase(object):
         return os.path.join(self.bot.getDataPath(self.moduleName), (f if f else ''))
 
 
+class Poller(object):
+    """
+    Polls a periodic data source on a background thread and keeps the latest snapshot in memory, so commands can answer
+    from memory instead of fetching and parsing on the hook path. Example:
+
+    .. code-block:: python
+
+        self.poller = Poller(self.fetch_scores, 60, on_change=self.announce_scores, log=self.log)
+        self.poller.start()
+        ...
+        scores = self.poller.get()
+        ...
+        self.poller.stop()  # in ondisable
+
+    :param fetch: callable returning a new snapshot. Runs on the poller's thread.
+    :type fetch: callable
+    :param interval: seconds between polls
+    :type interval: float
+    :param on_change: optional callable passed ``(old, new)`` after each poll whose snapshot differs from the last.
+        Not called for the first snapshot.
+    :type on_change: callable
+    :param log: logger for polls that fail
+    :type log: logging.Logger
+    """
+    def __init__(self, fetch, interval, on_change=None, log=None):
+        self.fetch = fetch
+        self.interval = interval
+        self.on_change = on_change
+        self.log = log or logging.getLogger("Poller")
+        self.snapshot = None
+        self.updated = 0
+        """Time the snapshot was last fetched"""
+        self.ready = Event()
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.ready.set()
+
+    def get(self, timeout=0):
+        """
+        Return the latest snapshot, or None if there is none yet. By default this doesn't wait, as hooks run on the
+        bot's event loop. With a ``timeout``, waits up to that many seconds for the first poll to finish, whether or not
+        it succeeded.
+        """
+        self.ready.wait(timeout)
+        return self.snapshot
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.poll()
+            self.stopped.wait(self.interval)
+
+    def poll(self):
+        """
+        Fetch a new snapshot now. A failed fetch is logged and the old snapshot kept.
+        """
+        try:
+            new = self.fetch()
+        except Exception:
+            self.log.exception("poll failed")
+            self.ready.set()
+            return
+        old = self.snapshot
+        self.snapshot = new
+        self.updated = time()
+        self.ready.set()
+        if self.on_change and old is not None and new != old:
+            try:
+                self.on_change(old, new)
+            except Exception:
+                self.log.exception("change handler failed")
+
+
 class ModuleHook:
     def __init__(self, hook, method):
         self.hook = hook
@@ -8,6 +8,17 @@
 """
 
 from pyircbot.modulebase import ModuleBase
+from threading import Lock
+
+
+# Statements run for every lookup or change, written once with the ids already resolved
+GET_ITEM_ID = "SELECT `id` FROM `items` WHERE `item`=%s;"
+GET_VALUES = """SELECT `a`.`attribute`, `v`.`value`
+    FROM `values` `v` INNER JOIN `attribute` `a` ON `a`.`id`=`v`.`attributeid`
+    WHERE `v`.`itemid`=%s AND `a`.`attribute` IN %s;"""
+SET_VALUES = "INSERT INTO `values` (`itemid`, `attributeid`, `value`) VALUES (%s, %s, %s) " \
+             "ON DUPLICATE KEY UPDATE `value`=VALUES(`value`);"
+DELETE_VALUES = "DELETE FROM `values` WHERE `itemid`=%s AND `attributeid` IN %s;"
 
 
 class AttributeStorage(ModuleBase):
@@ -51,6 +62,13 @@ class AttributeStorage(ModuleBase):
             ) ENGINE=InnoDB DEFAULT CHARSET=latin1 ;""")
             c.close()
 
+        # name -> id of attributes and items. Ids never change once assigned, so these can't go stale.
+        c = self.db.connection.query("SELECT `id`, `attribute` FROM `attribute`;")
+        self.attributeIds = {row["attribute"]: row["id"] for row in c.fetchall()}
+        c.close()
+        self.itemIds = {}
+        self.idlock = Lock()
+
     def getItem(self, name):
         """Get all values for a item
 
@@ -94,27 +112,26 @@ class AttributeStorage(ModuleBase):
         :param key: they key who's value to return
         :type key: str
         :returns: str -- the item from the database or **None**"""
-        c = self.db.connection.query("""SELECT
-            `i`.`id`,
-            `i`.`item`,
-            `a`.`attribute`,
-            `v`.`value`
-        FROM
-            `items` `i`
-                INNER JOIN `values` `v`
-                    on `v`.`itemid`=`i`.`id`
-                INNER JOIN `attribute` `a`
-                    on `a`.`id`=`v`.`attributeid`
+        return self.getKeys(item, [key])[key.lower()]
 
-        WHERE
-            `i`.`item`=%s
-                AND
-            `a`.`attribute`=%s;""", (item, key))
-        row = c.fetchone()
+    def getKeys(self, item, keys):
+        """Get the values of several keys on an item
+
+        :param item: the item to fetch keys from
+        :type item: str
+        :param keys: the keys who's values to return
+        :type keys: list
+        :returns: dict -- lowercased key -> value, or **None** for keys that aren't set"""
+        keys = [key.lower() for key in keys]
+        values = dict.fromkeys(keys)
+        itemId = self._itemId(item.lower())
+        if itemId is None:
+            return values
+        c = self.db.connection.query(GET_VALUES, (itemId, keys))
+        for row in c.fetchall():
+            values[row["attribute"]] = row["value"]
         c.close()
-        if row is None:
-            return None
-        return row["value"]
+        return values
 
     def set(self, item, key, value):
         return self.setKey(item, key, value)
@@ -128,40 +145,59 @@ class AttributeStorage(ModuleBase):
         :type key: tuple
         :param value: the value to set
         :type value: str"""
-        item = item.lower()
-        attribute = key.lower()
-
-        # Check attribute exists
-        c = self.db.connection.query("SELECT `id` FROM `attribute` WHERE `attribute`=%s;", (attribute))
-        row = c.fetchone()
-        attributeId = -1
-        if row is None:
-            c = self.db.connection.query("INSERT INTO `attribute` (`attribute`) VALUES (%s);", (attribute))
-            attributeId = c.lastrowid
-        else:
-            attributeId = row["id"]
-        c.close()
+        self.setKeys(item, {key: value})
 
-        # check item exists
-        c = self.db.connection.query("SELECT `id` FROM `items` WHERE `item`=%s;", (item))
-        row = c.fetchone()
-        itemId = -1
-        if row is None:
-            c = self.db.connection.query("INSERT INTO `items` (`item`) VALUES (%s);", (item))
-            itemId = c.lastrowid
-        else:
-            itemId = row["id"]
-        c.close()
+    def setKeys(self, item, values):
+        """Set several keys on an item at once
 
-        if value is None:
-            # delete it
-            c = self.db.connection.query("DELETE FROM `values` WHERE `itemid`=%s AND `attributeid`=%s ;",
-                                         (itemId, attributeId))
-            self.log.info("AttributeStorage: Stored item %s attribute %s value: %s (Deleted)" %
-                          (itemId, attributeId, value))
-        else:
-            # add attribute
-            c = self.db.connection.query("REPLACE INTO `values` (`itemid`, `attributeid`, `value`) "
-                                         "VALUES (%s, %s, %s);", (itemId, attributeId, value))
-            self.log.info("AttributeStorage: Stored item %s attribute %s value: %s" % (itemId, attributeId, value))
-        c.close()
+        :param item: the item name to set the keys on
+        :type item: str
+        :param values: key -> value to set. A value of **None** deletes the key.
+        :type values: dict"""
+        itemId = self._itemId(item.lower(), create=True)
+        values = {self._attributeId(key.lower()): value for key, value in values.items()}
+
+        deletes = [attributeId for attributeId, value in values.items() if value is None]
+        if deletes:
+            self.db.connection.query(DELETE_VALUES, (itemId, deletes)).close()
+            self.log.info("AttributeStorage: Stored item %s attributes %s value: None (Deleted)" % (itemId, deletes))
+
+        upserts = [(itemId, attributeId, value) for attributeId, value in values.items() if value is not None]
+        if upserts:
+            self.db.connection.queryMany(SET_VALUES, upserts).close()
+            for _, attributeId, value in upserts:
+                self.log.info("AttributeStorage: Stored item %s attribute %s value: %s" % (itemId, attributeId, value))
+
+    def _itemId(self, item, create=False):
+        """
+        Return the id of an item, optionally creating it. Returns None if the item doesn't exist and create is False.
+        """
+        itemId = self.itemIds.get(item)
+        if itemId is None:
+            with self.idlock:
+                c = self.db.connection.query(GET_ITEM_ID, (item,))
+                row = c.fetchone()
+                c.close()
+                if row is not None:
+                    itemId = row["id"]
+                elif create:
+                    c = self.db.connection.query("INSERT INTO `items` (`item`) VALUES (%s);", (item,))
+                    itemId = c.lastrowid
+                    c.close()
+                if itemId is not None:
+                    self.itemIds[item] = itemId
+        return itemId
+
+    def _attributeId(self, attribute):
+        """
+        Return the id of an attribute, creating it if needed
+        """
+        attributeId = self.attributeIds.get(attribute)
+        if attributeId is None:
+            with self.idlock:
+                self.db.connection.query("INSERT IGNORE INTO `attribute` (`attribute`) VALUES (%s);",
+                                         (attribute,)).close()
+                c = self.db.connection.query("SELECT `id` FROM `attribute` WHERE `attribute`=%s;", (attribute,))
+                attributeId = self.attributeIds[attribute] = c.fetchone()["id"]
+                c.close()
+        return attributeId
@@ -8,6 +8,9 @@
 """
 
 from pyircbot.modulebase import ModuleBase
+from collections import OrderedDict
+from functools import partial
+from threading import Lock
 
 
 class AttributeStorageLite(ModuleBase):
@@ -49,12 +52,34 @@ class AttributeStorageLite(ModuleBase):
             ) ;""")
             c.close()
 
+        self.db.query("CREATE INDEX IF NOT EXISTS `items_item` ON `items` (`item`);").close()
+
+        # name -> id of attributes and items. Both are only ever added to.
+        c = self.db.query("SELECT `id`, `attribute` FROM `attribute`;")
+        self.attributeIds = {row["attribute"]: row["id"] for row in c.fetchall()}
+        c.close()
+        self.itemIds = {}
+        self.idlock = Lock()
+
+        # (item, key) -> value of recently used keys, None for keys that aren't set. Least recently used first.
+        self.cache = OrderedDict()
+        self.cache_size = self.config.get("cache_size", 4096)
+        # bumped by every change to the cache, so a database read that raced with a change isn't cached over it
+        self.generation = 0
+        # (item, key) -> [value, number of queued writes] of keys set but not committed yet, which the database doesn't
+        # show yet no matter what the cache has evicted
+        self.unwritten = {}
+        self.lock = Lock()
+
     def getItem(self, name):
         """Get all values for a item
 
         :param name: the item
         :type name: str
         :returns: dict -- the item's values expressed as a dict"""
+        name = name.lower()
+        with self.lock:
+            unwritten = {key: entry[0] for (item, key), entry in self.unwritten.items() if item == name}
         c = self.db.query("""SELECT
             `i`.`id`,
             `i`.`item`,
@@ -68,7 +93,7 @@ class AttributeStorageLite(ModuleBase):
                     on `a`.`id`=`v`.`attributeid`
 
         WHERE
-            `i`.`item`=?;""", (name.lower(),))
+            `i`.`item`=?;""", (name,))
         item = {}
         while True:
             row = c.fetchone()
@@ -76,6 +101,11 @@ class AttributeStorageLite(ModuleBase):
                 break
             item[row["attribute"]] = row["value"]
         c.close()
+        for key, value in unwritten.items():
+            if value is None:
+                item.pop(key, None)
+            else:
+                item[key] = value
 
         if not item:
             return {}
@@ -92,28 +122,49 @@ class AttributeStorageLite(ModuleBase):
         :param key: they key who's value to return
         :type key: str
         :returns: str -- the item from the database or **None**"""
-        c = self.db.query("""SELECT
-            `i`.`id`,
-            `i`.`item`,
-            `a`.`attribute`,
-            `v`.`value`
-        FROM
-            `items` `i`
-                INNER JOIN `values` `v`
-                    on `v`.`itemid`=`i`.`id`
-                INNER JOIN `attribute` `a`
-                    on `a`.`id`=`v`.`attributeid`
+        return self.getKeys(item, [key])[key.lower()]
 
-        WHERE
-            `i`.`item`=?
-                AND
-            `a`.`attribute`=?;""", (item.lower(), key.lower()))
-        row = c.fetchone()
+    def getKeys(self, item, keys):
+        """Get the values of several keys on an item
 
-        c.close()
-        if row is None:
-            return None
-        return row["value"]
+        :param item: the item to fetch keys from
+        :type item: str
+        :param keys: the keys who's values to return
+        :type keys: list
+        :returns: dict -- lowercased key -> value, or **None** for keys that aren't set"""
+        item = item.lower()
+        result = {}
+        missing = []
+        with self.lock:
+            generation = self.generation
+            for key in keys:
+                key = key.lower()
+                try:
+                    result[key] = self.cache[(item, key)]
+                    self.cache.move_to_end((item, key))
+                except KeyError:
+                    if (item, key) in self.unwritten:
+                        result[key] = self.unwritten[(item, key)][0]
+                    else:
+                        missing.append(key)
+        if not missing:
+            return result
+
+        found = {}
+        itemId = self._itemId(item)
+        if itemId is not None:
+            c = self.db.query("""SELECT `a`.`attribute`, `v`.`value`
+                FROM `values` `v` INNER JOIN `attribute` `a` ON `a`.`id`=`v`.`attributeid`
+                WHERE `v`.`itemid`=? AND `a`.`attribute` IN ({});""".format(",".join(["?"] * len(missing))),
+                              (itemId, *missing))
+            found = {row["attribute"]: row["value"] for row in c.fetchall()}
+            c.close()
+        with self.lock:
+            for key in missing:
+                result[key] = found.get(key)
+                if self.generation == generation:
+                    self._cache(item, key, result[key])
+        return result
 
     def set(self, item, key, value):
         return self.setKey(item, key, value)
@@ -127,37 +178,102 @@ class AttributeStorageLite(ModuleBase):
         :type key: tuple
         :param value: the value to set
         :type value: str"""
+        self.setKeys(item, {key: value})
+
+    def setKeys(self, item, values):
+        """Set several keys on an item at once
+
+        :param item: the item name to set the keys on
+        :type item: str
+        :param values: key -> value to set. A value of **None** deletes the key.
+        :type values: dict"""
         item = item.lower()
-        attribute = key.lower()
-
-        # Check attribute exists
-        c = self.db.query("SELECT `id` FROM `attribute` WHERE `attribute`=?;", (attribute,))
-        row = c.fetchone()
-        attributeId = -1
-        if row is None:
-            c = self.db.query("INSERT INTO `attribute` (`attribute`) VALUES (?);", (attribute,))
-            attributeId = c.lastrowid
-        else:
-            attributeId = row["id"]
-        c.close()
+        values = {key.lower(): value for key, value in values.items()}
+        itemId = self._itemId(item, create=True)
+        attributeIds = {attribute: self._attributeId(attribute) for attribute in values}
+        with self.lock:
+            self.generation += 1
+            for attribute, value in values.items():
+                self._cache(item, attribute, value)
+                entry = self.unwritten.setdefault((item, attribute), [value, 0])
+                entry[0] = value
+                entry[1] += 1
+        for attribute, value in values.items():
+            attributeId = attributeIds[attribute]
+            onerror = partial(self._failed, item, attribute)
+            oncommit = partial(self._written, item, attribute)
+            if value is None:
+                # delete it
+                self.db.write("DELETE FROM `values` WHERE `itemid`=? AND `attributeid`=? ;", (itemId, attributeId),
+                              onerror=onerror, oncommit=oncommit)
+                self.log.info("Stored item %s attribute %s value: %s (Deleted)" % (itemId, attributeId, value))
+            else:
+                self.db.write("INSERT INTO `values` (`itemid`, `attributeid`, `value`) VALUES (?, ?, ?) "
+                              "ON CONFLICT (`itemid`, `attributeid`) DO UPDATE SET `value`=excluded.`value`;",
+                              (itemId, attributeId, value), onerror=onerror, oncommit=oncommit)
+                self.log.info("Stored item %s attribute %s value: %s" % (itemId, attributeId, value))
 
-        # check item exists
-        c = self.db.query("SELECT `id` FROM `items` WHERE `item`=?;", (item,))
-        row = c.fetchone()
-        itemId = -1
-        if row is None:
-            c = self.db.query("INSERT INTO `items` (`item`) VALUES (?);", (item,))
-            itemId = c.lastrowid
-        else:
-            itemId = row["id"]
-        c.close()
+    def _cache(self, item, key, value):
+        # caller holds self.lock
+        if self.cache_size <= 0:
+            return
+        self.cache[(item, key)] = value
+        self.cache.move_to_end((item, key))
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
 
-        if value is None:
-            # delete it
-            c = self.db.query("DELETE FROM `values` WHERE `itemid`=? AND `attributeid`=? ;", (itemId, attributeId))
-            self.log.info("Stored item %s attribute %s value: %s (Deleted)" % (itemId, attributeId, value))
-        else:
-            c = self.db.query("REPLACE INTO `values` (`itemid`, `attributeid`, `value`) VALUES (?, ?, ?);",
-                              (itemId, attributeId, value))
-            self.log.info("Stored item %s attribute %s value: %s" % (itemId, attributeId, value))
-        c.close()
+    def _written(self, item, key):
+        """
+        Note that a queued write of a key was committed
+        """
+        with self.lock:
+            entry = self.unwritten[(item, key)]
+            entry[1] -= 1
+            if not entry[1]:
+                del self.unwritten[(item, key)]
+
+    def _failed(self, item, key, error):
+        """
+        Forget a cached key whose queued write failed, so it's read back from the database
+        """
+        self._written(item, key)
+        with self.lock:
+            self.generation += 1
+            self.cache.pop((item, key), None)
+
+    def _itemId(self, item, create=False):
+        """
+        Return the id of an item, optionally creating it. Returns None if the item doesn't exist and create is False.
+        """
+        itemId = self.itemIds.get(item)
+        if itemId is None:
+            with self.idlock:
+                c = self.db.query("SELECT `id` FROM `items` WHERE `item`=?;", (item,))
+                row = c.fetchone()
+                c.close()
+                if row is not None:
+                    itemId = row["id"]
+                elif create:
+                    c = self.db.query("INSERT INTO `items` (`item`) VALUES (?);", (item,))
+                    itemId = c.lastrowid
+                    c.close()
+                if itemId is not None:
+                    self.itemIds[item] = itemId
+        return itemId
+
+    def _attributeId(self, attribute):
+        """
+        Return the id of an attribute, creating it if needed
+        """
+        attributeId = self.attributeIds.get(attribute)
+        if attributeId is None:
+            with self.idlock:
+                self.db.query("INSERT INTO `attribute` (`attribute`) VALUES (?) ON CONFLICT (`attribute`) DO NOTHING;",
+                              (attribute,)).close()
+                c = self.db.query("SELECT `id` FROM `attribute` WHERE `attribute`=?;", (attribute,))
+                attributeId = self.attributeIds[attribute] = c.fetchone()["id"]
+                c.close()
+        return attributeId
+
+    def ondisable(self):
+        self.db.close()
@@ -6,37 +6,63 @@
 
 """
 
-from pyircbot.modulebase import ModuleBase, command
+from pyircbot.modulebase import ModuleBase, MissingDependancyException, Poller, command
 from pyircbot.modules.ModInfo import info
 from decimal import Decimal
-from requests import get
-from time import time
+
+
+APIURL = "https://api.coinmarketcap.com/v1/ticker/bitcoin/"
 
 
 class BitcoinPrice(ModuleBase):
     def __init__(self, bot, moduleName):
         ModuleBase.__init__(self, bot, moduleName)
+        self.http = self.bot.getBestModuleForService("http")
+        if self.http is None:
+            raise MissingDependancyException("BitcoinPrice: HTTP service is required.")
+        # price the last price move announcement was measured from
+        self.announced = None
+        self.poller = Poller(self.getApi, self.config.get("interval", self.config.get("cache", 300)),
+                             on_change=self.announce_move, log=self.log)
+        self.poller.start()
 
-        self.cache = None
-        self.cacheAge = 0
+    def ondisable(self):
+        self.poller.stop()
 
     @info("btc", "retrieve the current price of bitcoin", cmds=["btc"])
     @command("btc", "bitcoin")
     def btc(self, msg, cmd):
         replyTo = msg.prefix.nick if "#" not in msg.args[0] else msg.args[0]
 
-        data = self.getApi()
-        self.bot.act_PRIVMSG(replyTo, "%s: %s" % (
-            msg.prefix.nick,
-            "\x02\x0307Bitcoin:\x03\x02 \x0307${price:.2f}\x0f - "
-            "24h change: \x0307${change:.2f}\x0f - "
-            "24h volume: \x0307${volume:.0f}M\x0f".format(price=Decimal(data["price_usd"]),
-                                                          change=Decimal(data["percent_change_24h"]),
-                                                          volume=Decimal(data["24h_volume_usd"]) / 10**6)
-        ))
+        data = self.poller.get()
+        if data is None:
+            self.bot.act_PRIVMSG(replyTo, "%s: the bitcoin price isn't available right now" % msg.prefix.nick)
+            return
+        self.bot.act_PRIVMSG(replyTo, "%s: %s" % (msg.prefix.nick, self.format_price(data)))
+
+    def format_price(self, data):
+        return "\x02\x0307Bitcoin:\x03\x02 \x0307${price:.2f}\x0f - " \
+               "24h change: \x0307${change:.2f}\x0f - " \
+               "24h volume: \x0307${volume:.0f}M\x0f".format(price=data["price_usd"],
+                                                             change=data["percent_change_24h"],
+                                                             volume=data["24h_volume_usd"] / 10**6)
+
+    def announce_move(self, old, new):
+        """
+        Tell the ``announce_channels`` when the price has moved ``announce_percent`` or more since the last time
+        """
+        channels = self.config.get("announce_channels", [])
+        if not channels:
+            return
+        if self.announced is None:
+            self.announced = old["price_usd"]
+        move = (new["price_usd"] - self.announced) / self.announced * 100
+        if abs(move) < Decimal(str(self.config.get("announce_percent", 5))):
+            return
+        self.announced = new["price_usd"]
+        for channel in channels:
+            self.bot.act_PRIVMSG(channel, "%s (%s%.1f%%)" % (self.format_price(new), "+" if move > 0 else "", move))
 
     def getApi(self):
-        if self.cache is None or time() - self.cacheAge > self.config["cache"]:
-            self.cache = get("https://api.coinmarketcap.com/v1/ticker/bitcoin/").json()[0]
-            self.cacheAge = time()
-        return self.cache
+        data = self.http.get(self.config.get("api_url", APIURL)).json()[0]
+        return {key: Decimal(data[key]) for key in ["price_usd", "percent_change_24h", "24h_volume_usd"]}
@@ -1,12 +1,69 @@
 
 from pyircbot.modulebase import ModuleBase, MissingDependancyException, regex, command
 from pyircbot.modules.ModInfo import info
+from random import choice
 import datetime
+import sqlite3
 import time
 import math
 
 
+class ChannelIndex(object):
+    """
+    The words of one channel that have a definition, so they can be picked at random or by name without a query
+    """
+    def __init__(self):
+        self.ids = []  # word ids, in no particular order
+        self.positions = {}  # word id -> index in self.ids
+        self.words = {}  # word id -> (word, id of its newest definition)
+        self.names = {}  # lowercased word -> set of word ids
+
+    def set(self, wordId, word, definitionId):
+        if wordId not in self.words:
+            self.positions[wordId] = len(self.ids)
+            self.ids.append(wordId)
+            self.names.setdefault(word.lower(), set()).add(wordId)
+        self.words[wordId] = (word, definitionId)
+
+    def remove(self, wordId):
+        if wordId not in self.words:
+            return
+        word, _ = self.words.pop(wordId)
+        # move the last id into the removed one's place
+        position = self.positions.pop(wordId)
+        last = self.ids.pop()
+        if last != wordId:
+            self.ids[position] = last
+            self.positions[last] = position
+        names = self.names[word.lower()]
+        names.discard(wordId)
+        if not names:
+            del self.names[word.lower()]
+
+    def random(self):
+        """
+        Return (word, definition id) of a random word, or None if the channel has none
+        """
+        if not self.ids:
+            return None
+        return self.words[choice(self.ids)]
+
+    def get(self, word):
+        """
+        Return (word, definition id) of a word, ignoring case, or None if it has no definition
+        """
+        ids = self.names.get(word.lower())
+        if not ids:
+            return None
+        return self.words[choice(tuple(ids))]
+
+
 class Calc(ModuleBase):
+    """
+    Words that have a definition are indexed in memory per channel, along with the id of each word's newest
+    definition, so random and specific lookups only fetch the definition itself. ``match`` searches a trigram full
+    text index of the words when sqlite supports one and the search term is at least three characters.
+    """
     def __init__(self, bot, moduleName):
         ModuleBase.__init__(self, bot, moduleName)
 
@@ -60,6 +117,60 @@ class Calc(ModuleBase):
                 );
             """)
             c.close()
+        self.sql.query("CREATE INDEX IF NOT EXISTS `calc_definitions_word` ON `calc_definitions` (`word`);").close()
+
+        self.fts = self.sql.tableExists("calc_words_fts") or self.createSearchIndex()
+
+        # channel name -> id. Should a channel have several rows, the first one wins, as it did before.
+        c = self.sql.query("SELECT `id`, `channel` FROM `calc_channels` ORDER BY `id` DESC;")
+        self.channelIds = {row["channel"]: row["id"] for row in c.fetchall()}
+        c.close()
+        # (username, userhost) -> id
+        self.addedByIds = {}
+
+        # channel id -> ChannelIndex. Rows come oldest definition first, so each word ends up with its newest.
+        self.index = {}
+        c = self.sql.query("SELECT `cw`.`id`, `cw`.`channel`, `cw`.`word`, `cd`.`id` AS `definitionId` FROM "
+                           "`calc_words` `cw` JOIN `calc_definitions` `cd` ON `cd`.`word`=`cw`.`id` WHERE "
+                           "`cw`.`status`='approved' AND `cd`.`status`='approved' ORDER BY `cd`.`date`, `cd`.`id` ;")
+        for row in c:
+            self.channelIndex(row["channel"]).set(row["id"], row["word"], row["definitionId"])
+        c.close()
+
+    def createSearchIndex(self):
+        """
+        Create a trigram index of calc_words for substring searches, kept up to date by triggers. Returns False if
+        this sqlite lacks fts5 or the trigram tokenizer.
+        """
+        try:
+            self.sql.query("""CREATE VIRTUAL TABLE `calc_words_fts` USING fts5(`word`, `channel` UNINDEXED,
+                              content='calc_words', content_rowid='id', tokenize='trigram');""").close()
+        except sqlite3.OperationalError as e:
+            self.log.warning("Calc: full text search unavailable, match will scan: %s", e)
+            return False
+        for statement in (
+                """CREATE TRIGGER `calc_words_fts_insert` AFTER INSERT ON `calc_words` BEGIN
+                     INSERT INTO `calc_words_fts` (`rowid`, `word`, `channel`) VALUES (new.`id`, new.`word`,
+                                                                                        new.`channel`);
+                   END;""",
+                """CREATE TRIGGER `calc_words_fts_delete` AFTER DELETE ON `calc_words` BEGIN
+                     INSERT INTO `calc_words_fts` (`calc_words_fts`, `rowid`, `word`, `channel`)
+                         VALUES ('delete', old.`id`, old.`word`, old.`channel`);
+                   END;""",
+                """CREATE TRIGGER `calc_words_fts_update` AFTER UPDATE ON `calc_words` BEGIN
+                     INSERT INTO `calc_words_fts` (`calc_words_fts`, `rowid`, `word`, `channel`)
+                         VALUES ('delete', old.`id`, old.`word`, old.`channel`);
+                     INSERT INTO `calc_words_fts` (`rowid`, `word`, `channel`) VALUES (new.`id`, new.`word`,
+                                                                                        new.`channel`);
+                   END;""",
+                "INSERT INTO `calc_words_fts` (`calc_words_fts`) VALUES ('rebuild');"):
+            self.sql.query(statement).close()
+        return True
+
+    def channelIndex(self, channelId):
+        if channelId not in self.index:
+            self.index[channelId] = ChannelIndex()
+        return self.index[channelId]
 
     def timeSince(self, channel, timetype):
         if channel not in self.timers:
@@ -146,11 +257,7 @@ class Calc(ModuleBase):
             term = cmd.args_str
             if not term.strip():
                 return
-            c = self.sql.getCursor()
-            channelId = self.getChannelId(msg.args[0])
-            c.execute("SELECT * FROM `calc_words` WHERE `word` LIKE ? AND `channel`=? ORDER BY `word` ASC ;",
-                      ("%%" + term + "%%", channelId))
-            rows = c.fetchall()
+            rows = self.matchWords(self.getChannelId(msg.args[0]), term)
             if not rows:
                 self.bot.act_PRIVMSG(msg.args[0], "%s: Sorry, no matches" % msg.prefix.nick)
             else:
@@ -164,19 +271,33 @@ class Calc(ModuleBase):
                                                                      "", ", \x03".join(matches)))
                 self.updateTimeSince(msg.args[0], "match")
 
+    def matchWords(self, channelId, term, limit=10):
+        """
+        Return up to ``limit`` rows of the channel's words containing ``term``, in order
+        """
+        # the trigram index can't find terms shorter than a trigram, those scan the table instead
+        table = "calc_words_fts" if self.fts and len(term) >= 3 else "calc_words"
+        c = self.sql.query("SELECT `word` FROM `{}` WHERE `word` LIKE ? AND `channel`=? ORDER BY `word` ASC "
+                           "LIMIT ? ;".format(table), ("%%" + term + "%%", channelId, limit))
+        rows = c.fetchall()
+        c.close()
+        return rows
+
     def addNewCalc(self, channel, word, definition, name, host):
         " Find the channel ID"
         channelId = self.getChannelId(channel)
 
         " Check if we need to add a user"
         c = self.sql.getCursor()
-        c.execute("SELECT * FROM `calc_addedby` WHERE `username`=? AND `userhost`=? ;", (name, host))
-        rows = c.fetchall()
-        if not rows:
-            c.execute("INSERT INTO `calc_addedby` (`username`, `userhost`) VALUES (?, ?) ;", (name, host,))
+        addedId = self.addedByIds.get((name, host))
+        if addedId is None:
             c.execute("SELECT * FROM `calc_addedby` WHERE `username`=? AND `userhost`=? ;", (name, host))
             rows = c.fetchall()
-        addedId = rows[0]["id"]
+            if not rows:
+                c.execute("INSERT INTO `calc_addedby` (`username`, `userhost`) VALUES (?, ?) ;", (name, host,))
+                c.execute("SELECT * FROM `calc_addedby` WHERE `username`=? AND `userhost`=? ;", (name, host))
+                rows = c.fetchall()
+            addedId = self.addedByIds[(name, host)] = rows[0]["id"]
 
         " Check if the word exists"
         c.execute("SELECT * FROM `calc_words` WHERE `channel`=? AND `word`=? ;", (channelId, word))
@@ -190,53 +311,31 @@ class Calc(ModuleBase):
         " Add definition "
         c.execute("INSERT INTO `calc_definitions` (`word`, `definition`, `addedby`, `date`, `status`) VALUES "
                   "(?, ?, ?, ?, ?) ;", (wordId, definition, addedId, datetime.datetime.now(), 'approved',))
+        if rows[0]["status"] == "approved":
+            self.channelIndex(channelId).set(wordId, word, c.lastrowid)
         c.close()
 
-    def getSpecificCalc(self, channel, word):
-        c = self.sql.getCursor()
-        channelId = self.getChannelId(channel)
-        c.execute("SELECT `cw`.`word`, (SELECT `cdq`.`id` FROM `calc_definitions` `cdq` WHERE `cdq`.`word`=`cw`.`id` "
-                  "AND `cdq`.`status`='approved' ORDER BY `cdq`.`date` DESC LIMIT 1) as `definitionId` FROM "
-                  "`calc_words` `cw` WHERE `cw`.`channel`=? AND `cw`.`status`='approved' AND `cw`.`word`=? "
-                  "COLLATE NOCASE ORDER BY RANDOM() LIMIT 1 ;", (channelId, word.lower()))
-        word = c.fetchone()
-
-        if word is None:
-            return None
-
-        c.execute("SELECT `ca`.`username`, `cd`.`definition` FROM `calc_definitions` `cd` JOIN `calc_addedby` `ca` ON "
-                  "`ca`.`id` = `cd`.`addedby` WHERE `cd`.`id`=? LIMIT 1 ;", (word["definitionId"], ))
-
+    def getDefinition(self, word, definitionId):
+        c = self.sql.query("SELECT `ca`.`username`, `cd`.`definition` FROM `calc_definitions` `cd` JOIN "
+                           "`calc_addedby` `ca` ON `ca`.`id` = `cd`.`addedby` WHERE `cd`.`id`=? LIMIT 1 ;",
+                           (definitionId, ))
         who = c.fetchone()
-
+        c.close()
         if who is None:
             return None
+        return {"word": word, "definition": who["definition"], "by": who["username"]}
 
-        c.close()
-        return {"word": word["word"], "definition": who["definition"], "by": who["username"]}
+    def getSpecificCalc(self, channel, word):
+        found = self.channelIndex(self.getChannelId(channel)).get(word)
+        if found is None:
+            return None
+        return self.getDefinition(*found)
 
     def getRandomCalc(self, channel):
-        c = self.sql.getCursor()
-        channelId = self.getChannelId(channel)
-
-        for i in range(0, 5):
-            c.execute("SELECT `cw`.`word`, (SELECT `cdq`.`id` FROM `calc_definitions` `cdq` WHERE "
-                      "`cdq`.`word`=`cw`.`id` AND `cdq`.`status`='approved' ORDER BY `cdq`.`date` DESC LIMIT 1) as "
-                      "`definitionId` FROM `calc_words` `cw` WHERE `cw`.`channel`=? AND `cw`.`status`='approved' "
-                      "ORDER BY RANDOM() LIMIT 1 ;", (channelId,))
-            word = c.fetchone()
-            if word is None:
-                return None
-            c.execute("SELECT `ca`.`username`, `cd`.`definition` FROM `calc_definitions` `cd` JOIN `calc_addedby` `ca` "
-                      "ON `ca`.`id` = `cd`.`addedby` WHERE `cd`.`id`=? LIMIT 1 ;", (word["definitionId"], ))
-
-            who = c.fetchone()
-
-            if who is None:
-                continue
-
-            c.close()
-            return {"word": word["word"], "definition": who["definition"], "by": who["username"]}
+        found = self.channelIndex(self.getChannelId(channel)).random()
+        if found is None:
+            return None
+        return self.getDefinition(*found)
 
     def deleteCalc(self, channel, word):
         " Return true if deleted something, false if it doesnt exist"
@@ -253,18 +352,16 @@ class Calc(ModuleBase):
         # c.execute("DELETE FROM `calc_words` WHERE `id`=? ;", (wordId,))
         # c.execute("DELETE FROM `calc_definitions` WHERE `word`=? ;", (wordId,))
         c.execute("UPDATE `calc_definitions` SET `status`='deleted' WHERE `word`=? ;", (wordId,))
+        self.channelIndex(channelId).remove(wordId)
 
         c.close()
         return True
 
     def getChannelId(self, channel):
-        c = self.sql.getCursor()
-        c.execute("SELECT * FROM `calc_channels` WHERE `channel` = ?", (channel,))
-        rows = c.fetchall()
-        if not rows:
+        chId = self.channelIds.get(channel)
+        if chId is None:
+            c = self.sql.getCursor()
             c.execute("INSERT INTO `calc_channels` (`channel`) VALUES (?);", (channel,))
-            c.execute("SELECT * FROM `calc_channels` WHERE `channel` = ?", (channel,))
-            rows = c.fetchall()
-        chId = rows[0]["id"]
-        c.close()
+            chId = self.channelIds[channel] = c.lastrowid
+            c.close()
         return chId
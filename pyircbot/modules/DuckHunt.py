@@ -7,7 +7,7 @@
 
 """
 
-from pyircbot.modulebase import ModuleBase, command
+from pyircbot.modulebase import ModuleBase, MissingDependancyException, command
 from pyircbot.modules.ModInfo import info
 import time
 import json
@@ -20,7 +20,11 @@ class DuckHunt(ModuleBase):
     def __init__(self, bot, moduleName):
         ModuleBase.__init__(self, bot, moduleName)
 
-        self.jsonPath = self.getFilePath("scores.json")
+        scores = self.bot.getBestModuleForService("scores")
+        if scores is None:
+            raise MissingDependancyException("DuckHunt: Scores service is required.")
+        self.scores = scores.board("DuckHunt")
+        self.migrateScores()
 
         self.timer = None
         self.isDuckOut = False
@@ -32,33 +36,15 @@ class DuckHunt(ModuleBase):
     @info("huntscore", "show your duckhunt score", cmds=["huntscore"])
     @command("huntscore", allow_private=True)
     def hunt(self, msg, cmd):
-        scores = self.loadScores()
         fromWho = msg.prefix.nick
-        if fromWho not in scores:
+        stats = self.scores.stats(fromWho)
+        if not stats.get("kills"):
             self.bot.act_PRIVMSG(fromWho, "You have no points :(")
         else:
-            scores = scores[fromWho]
-            kills = 0
-            runts = 0
-            prime = 0
-            weight = 0.0
-            shots = 0
-            misses = 0
-            for kill in scores:
-                if kill["prime"]:
-                    prime += 1
-                if kill["runt"]:
-                    runts += 1
-                kills += 1
-                weight += kill["weight"]
-                shots += 1
-                shots += kill["misses"]
-                misses += kill["misses"]
-
             self.bot.act_PRIVMSG(fromWho, "You've shot %s %s for a total weight of %s lbs." %
-                                 (kills, self.config["animalSpeciesPlural"], weight))
+                                 (stats["kills"], self.config["animalSpeciesPlural"], round(stats["weight"], 2)))
             self.bot.act_PRIVMSG(fromWho, "%s prime catches, %s runts, %s bullets used and %s misses." %
-                                 (prime, runts, shots, misses))
+                                 (stats["prime"], stats["runts"], stats["kills"] + stats["misses"], stats["misses"]))
             # self.bot.act_PRIVMSG(fromWho, "More info & highscores: http://duckhunt.xmopx.net/")
 
     @info("shoot", "shoot active targets", cmds=["shoot"])
@@ -138,21 +124,27 @@ class DuckHunt(ModuleBase):
         return round(weight + minW, 2)
 
     def addKillFor(self, playername, kill):
-        scores = self.loadScores()
-        if scores is None:
-            scores = {}
-        if playername not in scores:
-            scores[playername] = []
-        scores[playername].append(kill)
-        self.saveScores(scores)
-
-    def loadScores(self):
-        if not os.path.exists(self.jsonPath):
-            json.dump({}, open(self.jsonPath, 'w'))
-        return json.load(open(self.jsonPath, 'r'))
-
-    def saveScores(self, scores):
-        json.dump(scores, open(self.jsonPath, 'w'))
+        self.scores.update(playername, {"kills": 1,
+                                        "prime": 1 if kill["prime"] else 0,
+                                        "runts": 1 if kill["runt"] else 0,
+                                        "weight": kill["weight"],
+                                        "misses": kill["misses"]})
+
+    def migrateScores(self):
+        """
+        Move the kills in the scores.json file used by older versions into the scores service, as totals
+        """
+        jsonPath = self.getFilePath("scores.json")
+        if not os.path.exists(jsonPath):
+            return
+        if not len(self.scores):
+            with open(jsonPath) as f:
+                for playername, kills in json.load(f).items():
+                    for kill in kills:
+                        self.addKillFor(playername, kill)
+            self.log.info("Migrated %s players' kills from %s" % (len(self.scores), jsonPath))
+            self.scores.master.flush()
+        os.rename(jsonPath, jsonPath + ".migrated")
 
     def ondisable(self):
         self.timer.cancel()
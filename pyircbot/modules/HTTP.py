@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+"""
+.. module:: HTTP
+    :synopsis: Module providing a shared http client service
+
+"""
+
+from pyircbot.modulebase import ModuleBase
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from functools import partial
+from threading import BoundedSemaphore, Lock
+from time import sleep, time
+from urllib.parse import urlsplit
+import asyncio
+import requests
+import requests.adapters
+
+
+# Status codes that may be cached without explicit freshness information from the server (RFC 7231 section 6.1)
+CACHEABLE_STATUS = frozenset([200, 203, 204, 300, 301, 404, 405, 410, 414, 501])
+
+
+class HTTP(ModuleBase):
+    """
+    A shared http client for other modules. Requests to each host go through that host's own
+    :py:class:`requests.Session`, so connections are kept alive and reused. At most ``per_host`` requests (default 4)
+    run against one host at a time and, if ``per_host_rate`` is set, no more than that many start per second.
+
+    GET responses are cached when the server allows it (``Cache-Control: max-age`` or ``Expires``), or for ``ttl``
+    seconds when the caller passes one. The cache holds up to ``cache_bytes`` of response bodies (default 16MiB),
+    evicting the least recently used. Identical GETs made while one is already in flight wait for and share its
+    response rather than making their own request.
+
+    Responses are :py:class:`requests.Response` objects which, coming from the cache or a shared request, may be
+    handed to several callers and must be treated as read only.
+    """
+    def __init__(self, bot, moduleName):
+        ModuleBase.__init__(self, bot, moduleName)
+        self.services = ["http"]
+        self.timeout = self.config.get("timeout", 10)
+        self.per_host = self.config.get("per_host", 4)
+        self.per_host_rate = self.config.get("per_host_rate", 0)
+        self.user_agent = self.config.get("user_agent", None)
+        self.cache = ResponseCache(self.config.get("cache_bytes", 16 * 1024 * 1024))
+        self.hosts = {}  # "scheme://host:port" -> Host
+        self.hosts_lock = Lock()
+        self.inflight = {}  # cache key -> Future of the response
+        self.inflight_lock = Lock()
+        self.executor = ThreadPoolExecutor(max_workers=self.config.get("async_workers", 8),
+                                           thread_name_prefix="http")
+
+    def ondisable(self):
+        self.executor.shutdown(wait=False)
+        with self.hosts_lock:
+            for host in self.hosts.values():
+                host.session.close()
+            self.hosts = {}
+
+    def get(self, url, params=None, headers=None, ttl=None, stream=False, **kwargs):
+        """Make a GET request, from the cache if possible
+
+        :param url: url to request
+        :type url: str
+        :param params: query string parameters
+        :type params: dict
+        :param headers: extra request headers
+        :type headers: dict
+        :param ttl: cache the response for this many seconds, whatever the server says. Responses marked
+                    ``no-store`` are never cached.
+        :type ttl: int
+        :param stream: don't read the body up front. Streamed responses aren't cached or shared.
+        :type stream: bool
+        :param kwargs: passed on to :py:meth:`requests.Session.request`, such as ``timeout``
+        :returns: :py:class:`requests.Response`"""
+        if stream:
+            return self.request("GET", url, params=params, headers=headers, stream=True, **kwargs)
+        prepared = requests.Request("GET", url, params=params, headers=headers).prepare()
+        key = (prepared.url, tuple(sorted((headers or {}).items())))
+
+        response = self.cache.get(key)
+        if response is not None:
+            return response
+
+        with self.inflight_lock:
+            pending = self.inflight.get(key)
+            owner = pending is None
+            if owner:
+                pending = self.inflight[key] = Future()
+        if not owner:
+            return pending.result()
+
+        try:
+            response = self.request("GET", prepared.url, headers=headers, **kwargs)
+            lifetime = freshness(response, ttl)
+            if lifetime:
+                self.cache.put(key, response, time() + lifetime)
+            pending.set_result(response)
+            return response
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self.inflight_lock:
+                del self.inflight[key]
+
+    def head(self, url, **kwargs):
+        """Make a HEAD request. Redirects are followed unless ``allow_redirects=False`` is passed.
+
+        :param url: url to request
+        :type url: str
+        :returns: :py:class:`requests.Response`"""
+        kwargs.setdefault("allow_redirects", True)
+        return self.request("HEAD", url, **kwargs)
+
+    def request(self, method, url, headers=None, **kwargs):
+        """Make a request through the host's session, within the host's concurrency and rate limits. Nothing is
+        cached or shared.
+
+        :param method: http method
+        :type method: str
+        :param url: url to request
+        :type url: str
+        :returns: :py:class:`requests.Response`"""
+        kwargs.setdefault("timeout", self.timeout)
+        if self.user_agent:
+            headers = dict(headers or {})
+            headers.setdefault("User-Agent", self.user_agent)
+        host = self.host(url)
+        with host.slots:
+            host.wait_turn()
+            return host.session.request(method, url, headers=headers, **kwargs)
+
+    async def aget(self, url, **kwargs):
+        """Like :py:meth:`get`, for coroutines. The request runs on a small pool of threads.
+
+        :returns: :py:class:`requests.Response`"""
+        return await asyncio.get_event_loop().run_in_executor(self.executor, partial(self.get, url, **kwargs))
+
+    async def ahead(self, url, **kwargs):
+        """Like :py:meth:`head`, for coroutines
+
+        :returns: :py:class:`requests.Response`"""
+        return await asyncio.get_event_loop().run_in_executor(self.executor, partial(self.head, url, **kwargs))
+
+    def host(self, url):
+        """
+        Return the :py:class:`Host` that requests to a url go through
+        """
+        parts = urlsplit(url)
+        name = "{}://{}".format(parts.scheme, parts.netloc.lower())
+        with self.hosts_lock:
+            if name not in self.hosts:
+                self.hosts[name] = Host(self.per_host, self.per_host_rate)
+            return self.hosts[name]
+
+
+class Host(object):
+    """
+    Session and limits for the requests to one host
+
+    :param slots: most requests to run at once
+    :param rate: most requests to start per second, 0 for no limit
+    """
+    def __init__(self, slots, rate):
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=slots)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.slots = BoundedSemaphore(slots)
+        self.interval = 1 / rate if rate else 0
+        self.next_start = 0
+        self.lock = Lock()
+
+    def wait_turn(self):
+        """
+        Sleep until another request may start under the rate limit
+        """
+        if not self.interval:
+            return
+        with self.lock:
+            now = time()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            sleep(start - now)
+
+
+class ResponseCache(object):
+    """
+    LRU cache of responses, bounded by the total size of their bodies
+
+    :param max_bytes: most bytes of response bodies to keep
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()  # key -> (expires, response)
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        now = time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= now:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, response, expires):
+        size = len(response.content)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (expires, response)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        _, response = self.entries.pop(key)
+        self.size -= len(response.content)
+
+
+def freshness(response, ttl=None):
+    """
+    Return how many seconds a response may be cached for, following RFC 7234 for a private cache. ``ttl``, if given,
+    replaces any lifetime the server gave, but only for successful responses that could be cached at all. Errors are
+    never kept for a caller's ttl.
+    """
+    cache_control = parse_cache_control(response.headers.get("Cache-Control", ""))
+    if "no-store" in cache_control or response.headers.get("Vary", "").strip() == "*":
+        return 0
+    if ttl is not None:
+        return ttl if response.status_code in CACHEABLE_STATUS and response.status_code < 400 else 0
+    if "no-cache" in cache_control or response.status_code not in CACHEABLE_STATUS:
+        return 0
+    if "max-age" in cache_control:
+        try:
+            return max(0, int(cache_control["max-age"]) - int(response.headers.get("Age", 0)))
+        except ValueError:
+            return 0
+    if "Expires" in response.headers:
+        try:
+            expires = parsedate_to_datetime(response.headers["Expires"]).timestamp()
+            date = parsedate_to_datetime(response.headers["Date"]).timestamp() if "Date" in response.headers \
+                else time()
+        except (TypeError, ValueError):
+            return 0  # invalid dates mean already expired
+        return max(0, expires - date)
+    return 0
+
+
+def parse_cache_control(value):
+    """
+    Parse a Cache-Control header into a dict of lowercased directive -> argument, or None for directives without one
+    """
+    directives = {}
+    for item in value.split(","):
+        name, _, arg = item.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') if arg else None
+    return directives
@@ -7,33 +7,69 @@
 
 """
 
-from pyircbot.modulebase import ModuleBase, hook
-from requests import get
+from pyircbot.modulebase import ModuleBase, MissingDependancyException, hook
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from urllib.parse import urlsplit, urlunsplit
 import re
 import time
 import praw  # TODO: enable/disable modules
 import datetime
-from requests import head
+import codecs
 import html.parser
-from threading import Thread
+
+
+YOUTUBE_RE = re.compile(r'(?:youtube.*?(?:v=|/v/)|youtu\.be/|yooouuutuuube.*?id=)([-_a-z0-9]+)', re.I)
+REDDIT_RE = re.compile(r'(?:reddit\.com/.*?comments/([a-zA-Z0-9]+)/|https?://(www\.)?redd.it/([a-zA-Z0-9]+))')
+URL_RE = re.compile(r'(https?:\/\/(www\.)?[-a-zA-Z0-9@:%._\+~#=]{2,256}\.[a-z]{2,6}\b([-a-zA-Z0-9@:%_\+.~#?&//=]*))')
+# Every message any of the above can match contains one of these
+LINK_HINT_RE = re.compile(r'https?://|youtu|yooouuutuuube|reddit\.com', re.I)
+DEFAULT_PORTS = {"http": 80, "https": 443}
 
 
 class LinkTitler(ModuleBase):
     def __init__(self, bot, moduleName):
         ModuleBase.__init__(self, bot, moduleName)
         self.REQUEST_SIZE_LIMIT = 10 * 1024
+        self.http = self.bot.getBestModuleForService("http")
+        if self.http is None:
+            raise MissingDependancyException("LinkTitler: HTTP service is required.")
+        self.youtube = self.bot.getBestModuleForService("youtubeinfo")
+        if self.youtube is None:
+            raise MissingDependancyException("LinkTitler: YoutubeInfo service is required.")
+        workers = self.config.get("workers", 4)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="LinkTitler")
+        # Messages being handled or waiting for a worker. Messages beyond this are dropped.
+        self.slots = BoundedSemaphore(workers + self.config.get("queue_size", 16))
+        self.cache = TitleCache(self.config.get("cache_size", 512), self.config.get("cache_ttl", 3600))
+        self.inflight = {}  # normalized url -> Future of its description
+        self.inflight_lock = Lock()
+
+    def ondisable(self):
+        self.executor.shutdown(wait=False)
 
     @hook("PRIVMSG")
     def searches(self, msg, cmd):
-        t = Thread(target=self.doLinkTitle, args=(msg.args, msg.prefix.nick, msg.trailing))
-        t.daemon = True
-        t.start()
+        if not LINK_HINT_RE.search(msg.trailing):
+            return
+        if not self.slots.acquire(blocking=False):
+            self.log.warning("dropping message, too many links waiting")
+            return
+        future = self.executor.submit(self.doLinkTitle, msg.args, msg.prefix.nick, msg.trailing)
+        future.add_done_callback(self._finished)
+
+    def _finished(self, future):
+        self.slots.release()
+        if future.exception() is not None:
+            self.log.error("link title failed", exc_info=future.exception())
 
     def doLinkTitle(self, args, sender, trailing):
         # Youtube
-        matches = re.compile(r'(?:youtube.*?(?:v=|/v/)|youtu\.be/|yooouuutuuube.*?id=)([-_a-z0-9]+)', re.I) \
-            .findall(trailing)
+        matches = YOUTUBE_RE.findall(trailing)
         if matches:
+            # look them all up in one batch
+            self.youtube.videos(list(OrderedDict.fromkeys(matches)))
             done = []
             for item in matches:
                 if item not in done:
@@ -44,8 +80,7 @@ class LinkTitler(ModuleBase):
             return
 
         # reddit threads
-        matches = re.compile(r'(?:reddit\.com/.*?comments/([a-zA-Z0-9]+)/|https?://(www\.)?redd.it/([a-zA-Z0-9]+))') \
-            .findall(trailing)
+        matches = REDDIT_RE.findall(trailing)
         # Either [('', '', '2ibrz7')] or [('2ibrz7', '', '')]
         if matches:
             done = []
@@ -76,32 +111,80 @@ class LinkTitler(ModuleBase):
         # subreddits
 
         # generic <title>
-        matches = re.compile(r'(https?:\/\/(www\.)?[-a-zA-Z0-9@:%._\+~#=]{2,256}\.[a-z]{2,6}\b([-a-zA-Z0-9@:%_\+.~#?&//=]*))') \
-            .findall(trailing)
+        matches = URL_RE.findall(trailing)
         if matches:
             done = []
             for match in matches:
-                if match[0] in done:
+                url = normalize_url(match[0])
+                if url in done:
                     continue
-                done.append(match[0])
+                done.append(url)
 
-                headers = self.url_headers(match[0])
+                description = self.describe_url(url)
+                if description:
+                    self.bot.act_PRIVMSG(args[0], "%s: %s" % (sender, description))
 
-                # Don't mess with unknown content types
-                if "Content-Type" not in headers:
-                    continue
+    def describe_url(self, url):
+        """
+        Return the text to show for a normalized url, or None if there's nothing to show. Results are cached, and
+        concurrent calls for the same url share one fetch.
+        """
+        found, description = self.cache.get(url)
+        if found:
+            return description
 
-                if "text/html" in headers["Content-Type"]:
-                    # Fetch HTML title
-                    title = self.url_htmltitle(match[0])
-                    if title:
-                        self.bot.act_PRIVMSG(args[0], "%s: \x02%s\x02" % (sender, title))
-                else:
-                    # Unknown types, just print type and size
-                    self.bot.act_PRIVMSG(args[0], "%s: \x02%s\x02, %s" %
-                                         (sender, headers["Content-Type"],
-                                          self.nicesize(int(headers["Content-Length"])) if
-                                          "Content-Length" in headers else "unknown size"))
+        with self.inflight_lock:
+            pending = self.inflight.get(url)
+            owner = pending is None
+            if owner:
+                pending = self.inflight[url] = Future()
+        if not owner:
+            return pending.result()
+
+        try:
+            description = self.fetch_description(url)
+            self.cache.put(url, description)
+            pending.set_result(description)
+            return description
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self.inflight_lock:
+                del self.inflight[url]
+
+    def fetch_description(self, url):
+        """
+        GET a url and describe it. The body is only read for html pages, and only up to the end of the title.
+        """
+        self.log.info("fetch_description(%s)" % (url,))
+        resp = self.http.get(url, stream=True)
+        try:
+            content_type = resp.headers.get("Content-Type")
+            # Don't mess with unknown content types
+            if content_type is None:
+                return None
+
+            if "text/html" in content_type:
+                if resp.status_code not in self.config.get("status_code_whitelist", [200]):
+                    return None
+                title = self.read_title(resp)
+                return "\x02%s\x02" % title if title else None
+
+            # Unknown types, just print type and size
+            return "\x02%s\x02, %s" % (content_type,
+                                       self.nicesize(int(resp.headers["Content-Length"])) if
+                                       "Content-Length" in resp.headers else "unknown size")
+        finally:
+            resp.close()
+
+    def cache_stats(self):
+        """
+        Return the title cache's size, hits, misses and hit rate
+
+        :returns: dict
+        """
+        return self.cache.stats()
 
     def get_reddit_submission(self, subid):
         r = praw.Reddit(**self.config["reddit"])
@@ -114,37 +197,24 @@ class LinkTitler(ModuleBase):
         else:
             return "<1kb"
 
-    def url_headers(self, url):
+    def read_title(self, resp):
         """
-        HEAD requests a url to check content type & length.
-        Returns something like: {'type': 'image/jpeg', 'size': '90583'}"
+        Read a streamed html response until its title has been seen, or ``REQUEST_SIZE_LIMIT`` bytes if it has none,
+        and return the title
         """
-        self.log.info("url_headers(%s)" % (url,))
-        resp = head(url=url, allow_redirects=True)
-        return resp.headers
-
-    def url_htmltitle(self, url):
-        "Requests page html and returns title in a safe way"
-        self.log.info("url_htmltitle(%s)" % (url,))
-        resp = get(url=url, stream=True)
-        # Fetch no more than first 10kb
-        # if the title isn't seen by then, you're doing it wrong
-        data = b""
-        for chunk in resp.iter_content(1024):
-            data += chunk
-            if len(data) > self.REQUEST_SIZE_LIMIT:
+        # if the title isn't in the first 10kb, you're doing it wrong
+        buf = bytearray(self.REQUEST_SIZE_LIMIT)
+        view = memoryview(buf)
+        parser = TitleParser()
+        resp.raw.decode_content = True
+        read = 0
+        while read < len(buf) and not parser.done:
+            count = resp.raw.readinto(view[read:read + 1024])
+            if not count:
                 break
-
-        data = data.decode('utf-8', "ignore")
-
-        titleMatches = re.findall(r'<title>([^<]+)</title>', data, re.I)
-        statusCodeWhitelist = self.config.get("status_code_whitelist", [200])
-        if titleMatches and resp.status_code in statusCodeWhitelist:
-            h = html.parser.HTMLParser()
-            title = h.unescape(titleMatches[0]).strip()
-            if len(title) > 0:
-                return title
-        return None
+            parser.feed(str(view[read:read + count], "latin-1"))
+            read += count
+        return parser.title(header_charset(resp.headers["Content-Type"]))
 
     # For youtube
     def getISOdurationseconds(self, stamp):
@@ -162,16 +232,11 @@ class LinkTitler(ModuleBase):
         )  # http://stackoverflow.com/a/16742742
         return ISO_8601_period_rx.match(stamp).groupdict()
 
-    def _get_video_description_api(self, vid_id):
-        return get('https://www.googleapis.com/youtube/v3/videos?part=snippet,contentDetails,statistics&id=%s'
-                   '&key=%s' % (vid_id, self.config["youtube_api_key"])).json()
-
     def get_video_description(self, vid_id):
-        apidata = self._get_video_description_api(vid_id)
-        if not apidata['pageInfo']['totalResults']:
+        video = self.youtube.video(vid_id)
+        if video is None:
             return
 
-        video = apidata['items'][0]
         snippet = video["snippet"]
         duration = self.getISOdurationseconds(video["contentDetails"]["duration"])
 
@@ -202,3 +267,135 @@ class LinkTitler(ModuleBase):
             base = base[:-grouping]
         builder.reverse()
         return delimiter.join(builder)
+
+
+class TitleCache(object):
+    """
+    LRU cache of url descriptions that expire after a while
+
+    :param size: most urls to keep
+    :param ttl: seconds to keep each description
+    """
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # url -> (expires, description)
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url):
+        """
+        Return a tuple of (found, description). Descriptions may be None.
+        """
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is not None and entry[0] <= time.time():
+                del self.entries[url]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            self.entries.move_to_end(url)
+            return True, entry[1]
+
+    def put(self, url, description):
+        with self.lock:
+            self.entries[url] = (time.time() + self.ttl, description)
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self.entries),
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+class TitleParser(html.parser.HTMLParser):
+    """
+    Incremental parser that picks the title and any charset declaration out of the start of an html page. It's fed the
+    page decoded as latin-1, which keeps every byte as it was, and decodes the title once the charset is known.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.in_title = False
+        self.done = False
+        self.raw_title = []
+        self.meta_charset = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title" and not self.done:
+            self.in_title = True
+        elif tag == "meta" and self.meta_charset is None:
+            attrs = dict(attrs)
+            if attrs.get("charset"):
+                self.meta_charset = attrs["charset"].strip()
+            elif (attrs.get("http-equiv") or "").lower() == "content-type" and attrs.get("content"):
+                self.meta_charset = header_charset(attrs["content"])
+
+    def handle_endtag(self, tag):
+        if tag == "title" and self.in_title:
+            self.in_title = False
+            self.done = True
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.raw_title.append(data)
+
+    def handle_entityref(self, name):
+        self.handle_data("&%s;" % name)
+
+    def handle_charref(self, name):
+        self.handle_data("&#%s;" % name)
+
+    def title(self, charset=None):
+        """
+        Return the title, decoded with the given charset, the page's declared charset or utf-8, or None if there was
+        no title
+        """
+        if not self.raw_title:
+            return None
+        data = "".join(self.raw_title).encode("latin-1")
+        for candidate in (charset, self.meta_charset, "utf-8"):
+            if candidate:
+                try:
+                    codecs.lookup(candidate)
+                except LookupError:
+                    continue
+                title = html.unescape(data.decode(candidate, "replace"))
+                return " ".join(title.split()) or None
+
+
+def header_charset(content_type):
+    """
+    Return the charset parameter of a Content-Type value, or None
+    """
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "charset":
+            return value.strip().strip("'\"") or None
+    return None
+
+
+def normalize_url(url):
+    """
+    Normalize a url so ones that point to the same page compare equal: the scheme and host are lowercased, default
+    ports and fragments are dropped, and an empty path becomes ``/``
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    try:
+        port = parts.port
+    except ValueError:  # not a number
+        return url
+    if port and port != DEFAULT_PORTS.get(scheme):
+        host = "%s:%s" % (host, port)
+    if parts.username:
+        host = "%s@%s" % (parts.netloc.rsplit("@", 1)[0], host)
+    return urlunsplit((scheme, host, parts.path or "/", parts.query, ""))
@@ -8,7 +8,8 @@
 """
 
 from pyircbot.modulebase import ModuleBase
-import sys
+from threading import Condition, local, current_thread
+from time import time
 import pymysql as MySQLdb  # python 3.x
 
 
@@ -21,18 +22,38 @@ class MySQL(ModuleBase):
     def getConnection(self):
         return Connection(self)
 
+    def ondisable(self):
+        self.connection.close()
+
 
 class Connection:
+    """
+    A pool of connections to the mysql server, shared by all threads of the bot. The first time a thread runs a query
+    it checks out a connection of its own, which it keeps until the thread exits or calls :py:meth:`release`.
+
+    A connection that has sat unused for ``idle_check`` seconds (default 30) is pinged before it's used again, and
+    reconnected if the server has closed it. Connections in regular use are never pinged. At most ``pool_size``
+    connections (default 8) are opened; further threads wait up to ``pool_timeout`` seconds (default 30) for one to
+    be released.
+    """
     def __init__(self, master):
         self.config = master.config
         self.log = master.log
-        self._connect()
+        self.pool_size = self.config.get("pool_size", 8)
+        self.idle_check = self.config.get("idle_check", 30)
+        self.pool_timeout = self.config.get("pool_timeout", 30)
+        self._local = local()
+        self._lock = Condition()
+        self._idle = []  # (connection, last used)
+        self._owners = {}  # thread -> connection checked out by that thread
+        self._idle.append((self._connect(create=True), time()))
 
     # Check if the table requested exists
     def tableExists(self, tablename):
         c = self.getCursor()
         c.execute("SHOW TABLES;")
         tables = c.fetchall()
+        c.close()
         if len(tables) == 0:
             return False
         key = list(tables[0].keys())[0]
@@ -49,22 +70,54 @@ class Connection:
         :param args: arguments to be escaped into the query
         :type args: tuple
         :returns: cursor -- the sql cursor"""
+        return self._retrying(lambda c: self._execute(c, queryText, args))
+
+    def queryMany(self, queryText, argsList):
+        """Execute a MySQL query once for each set of arguments and return the cursor. Inserts are sent as one
+        multi-row statement.
+
+        :param queryText: the mysql query as a string, using '%s' for token replacement
+        :type queryText: str
+        :param argsList: a tuple of arguments for each execution
+        :type argsList: list
+        :returns: cursor -- the sql cursor"""
+        return self._retrying(lambda c: c.executemany(queryText, argsList))
+
+    def _retrying(self, execute):
+        """
+        Call execute with a new cursor, running it again on a new connection if the connection turns out to be lost
+        before the query was sent
+        """
         c = self.getCursor()
+        try:
+            execute(c)
+        except MySQLdb.err.OperationalError as e:
+            if e.args[0] not in (2006, 2013):
+                raise
+            c.close()
+            self.log.warning("MySQL: connection lost, reconnecting")
+            try:
+                self._local.connection.close()
+            except Exception:
+                pass
+            self._replace(self._connect())
+            # 2006 means the query was never sent, so it's safe to run again. After 2013 it may or may not have run.
+            if e.args[0] == 2013:
+                raise
+            c = self.getCursor()
+            execute(c)
+        return c
+
+    @staticmethod
+    def _execute(c, queryText, args):
         if len(args) == 0:
             c.execute(queryText)
         else:
             c.execute(queryText, args)
-        return c
 
     # Returns a cusor object, after checking for connectivity
     def getCursor(self):
-        self.ensureConnected()
-        if sys.version_info > (3, 0):
-            c = self.connection.cursor(MySQLdb.cursors.DictCursor)
-        else:
-            c = self.connection.cursor(cursorclass=MySQLdb.cursors.DictCursor)
-        c.execute("USE `%s`;" % self.config["database"])
-        return c
+        return self.ensureConnected().cursor(MySQLdb.cursors.DictCursor)
 
     def escape(self, s):
         """Escape a string using the mysql server
@@ -72,43 +125,129 @@ class Connection:
         :param s: the string to escape
         :type s: str
         :returns: str -- the escaped string"""
-        self.ensureConnected()
-        return self.connection.escape_string(s)
+        return self.ensureConnected().escape_string(s)
 
     def ensureConnected(self):
+        """
+        Return the calling thread's connection, checking one out of the pool if the thread doesn't have one yet
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._checkout()
+        elif time() - self._local.used > self.idle_check:
+            connection = self._healthy(connection)
+            if connection is not self._local.connection:
+                self._replace(connection)
+        self._local.used = time()
+        return connection
+
+    def _healthy(self, connection):
+        """
+        Ping a connection that has been idle, returning it or a new connection if the server had closed it
+        """
         try:
-            self.connection.ping()
-        except:
+            connection.ping(reconnect=False)
+            return connection
+        except Exception:
+            self.log.warning("MySQL: idle connection was closed, reconnecting")
             try:
-                self.connection.close()
-            except:
+                connection.close()
+            except Exception:
                 pass
-            del self.connection
-            self._connect()
+            return self._connect()
+
+    def _replace(self, connection):
+        """
+        Make a new connection the calling thread's
+        """
+        self._local.connection = connection
+        with self._lock:
+            self._owners[current_thread()] = connection
+
+    def release(self):
+        """
+        Return the calling thread's connection to the pool. Threads that exit have their connection returned for them,
+        but long-lived threads that only need the database briefly should call this when done.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            return
+        self._local.connection = None
+        with self._lock:
+            self._owners.pop(current_thread(), None)
+            self._idle.append((connection, self._local.used))
+            self._lock.notify()
+
+    def _checkout(self):
+        deadline = time() + self.pool_timeout
+        with self._lock:
+            while True:
+                # connections of threads that have exited go back to the pool
+                for thread in [t for t in self._owners if not t.is_alive()]:
+                    connection = self._owners.pop(thread)
+                    if connection is not None:
+                        self._idle.append((connection, 0))
+                if self._idle:
+                    connection, used = self._idle.pop()
+                    break
+                if len(self._owners) < self.pool_size:
+                    connection, used = None, None
+                    break
+                remaining = deadline - time()
+                if remaining <= 0:
+                    raise Exception("MySQL: no connection became free within {}s".format(self.pool_timeout))
+                self._lock.wait(min(remaining, 1))
+            self._owners[current_thread()] = connection
+        try:
+            if connection is None:
+                connection = self._connect()
+            elif time() - used > self.idle_check:
+                connection = self._healthy(connection)
+        except Exception:
+            with self._lock:
+                self._owners.pop(current_thread(), None)
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._owners[current_thread()] = connection
+        self._local.connection = connection
+        return connection
+
+    def close(self):
+        """
+        Close all connections
+        """
+        with self._lock:
+            connections = [c for c, _ in self._idle] + [c for c in self._owners.values() if c is not None]
+            self._idle = []
+            self._owners = {}
+        for connection in connections:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        self._local = local()
 
     def ondisable(self):
-        self.connection.close()
+        self.close()
 
     # Connects to the database server, and selects a database (Or attempts to create it if it doesn't exist yet)
-    def _connect(self):
+    def _connect(self, create=False):
         self.log.info("MySQL: Connecting to db host at %s" % self.config["host"])
-        self.connection = MySQLdb.connect(host=self.config["host"], user=self.config["username"],
-                                          passwd=self.config["password"])
+        connection = MySQLdb.connect(host=self.config["host"], port=self.config.get("port", 3306),
+                                     user=self.config["username"], passwd=self.config["password"], autocommit=True,
+                                     database=None if create else self.config["database"])
         self.log.info("MySQL: Connected.")
-        self.connection.autocommit(True)
-        c = None
-        if sys.version_info > (3, 0):
-            c = self.connection.cursor(MySQLdb.cursors.DictCursor)
-        else:
-            c = self.connection.cursor(cursorclass=MySQLdb.cursors.DictCursor)
-
-        c.execute("SHOW DATABASES")
-        dblist = c.fetchall()
-        found = False
-        for row in dblist:
-            if row["Database"] == self.config["database"]:
-                found = True
-        if not found:
-            c.execute("CREATE DATABASE `%s`;" % self.config["database"])
-        c.execute("USE `%s`;" % self.config["database"])
-        c.close()
+        if create:
+            c = connection.cursor(MySQLdb.cursors.DictCursor)
+            c.execute("SHOW DATABASES")
+            dblist = c.fetchall()
+            found = False
+            for row in dblist:
+                if row["Database"] == self.config["database"]:
+                    found = True
+            if not found:
+                c.execute("CREATE DATABASE `%s`;" % self.config["database"])
+            c.close()
+            connection.select_db(self.config["database"])
+        return connection
@@ -6,10 +6,8 @@
 
 """
 
-from pyircbot.modulebase import ModuleBase, command
+from pyircbot.modulebase import ModuleBase, MissingDependancyException, Poller, command
 from pyircbot.modules.ModInfo import info
-from time import time
-from requests import get
 from lxml import etree
 from datetime import datetime, timedelta
 
@@ -17,13 +15,24 @@ from datetime import datetime, timedelta
 class NFLLive(ModuleBase):
     def __init__(self, bot, moduleName):
         ModuleBase.__init__(self, bot, moduleName)
-        self.cache = None
-        self.cacheAge = 0
+        self.http = self.bot.getBestModuleForService("http")
+        if self.http is None:
+            raise MissingDependancyException("NFLLive: HTTP service is required.")
+        self.poller = Poller(self.getNflGames, self.config.get("interval", self.config.get("cache", 90)),
+                             on_change=self.announce_scores, log=self.log)
+        self.poller.start()
+
+    def ondisable(self):
+        self.poller.stop()
 
     @info("nfl", "show nfl schedule & score", cmds=["nfl"])
     @command("nfl")
     def nflitup(self, message, cmd):
-        games = self.getNflGamesCached()
+        games = self.poller.get()
+        if games is None:
+            self.bot.act_PRIVMSG(message.args[0], "%s: the NFL schedule isn't available right now" %
+                                 message.prefix.nick)
+            return
         msg = []
 
         liveGames = []
@@ -156,18 +165,32 @@ class NFLLive(ModuleBase):
             game["home_score"]
         )
 
-    def getNflGamesCached(self):
-        if time() - self.cacheAge > self.config["cache"]:
-            self.cache = NFLLive.getNflGames()
-            self.cacheAge = time()
-        return self.cache
-
-    @staticmethod
-    def getNflGames():
+    def announce_scores(self, old, new):
+        """
+        Tell the ``announce_channels`` about score changes and games that have finished
+        """
+        channels = self.config.get("announce_channels", [])
+        if not channels:
+            return
+        before = {game["id"]: game for game in old["games"]}
+        lines = []
+        for game in new["games"]:
+            prev = before.get(game["id"])
+            if prev is None:
+                continue
+            if game["quarter"].startswith("F") and not prev["quarter"].startswith("F"):
+                lines.append("\x02Final:\x02 %s" % self.formatGamePast(game))
+            elif (game["visitor_score"], game["home_score"]) != (prev["visitor_score"], prev["home_score"]):
+                lines.append("\x02Score:\x02 %s" % self.formatGameLive(game))
+        for channel in channels:
+            for line in lines:
+                self.bot.act_PRIVMSG(channel, line)
+
+    def getNflGames(self):
         result = {}
 
         # Fetch NFL information as XML
-        nflxml = get("http://www.nfl.com/liveupdate/scorestrip/ss.xml?random=1413140448433")
+        nflxml = self.http.get("http://www.nfl.com/liveupdate/scorestrip/ss.xml?random=1413140448433")
         doc = etree.fromstring(nflxml.content)
         games = doc.xpath("/ss/gms")[0]
 
@@ -7,7 +7,7 @@
 from pyircbot.modulebase import ModuleBase, hook
 from msgbus.client import MsgbusSubClient  # see http://gitlab.davepedu.com/dave/pymsgbus
 from threading import Thread
-from json import dumps, loads
+from pyircbot.codec import JSON
 from time import sleep
 from zmq.error import Again
 from traceback import print_exc
@@ -45,14 +45,14 @@ class PubSubClient(ModuleBase):
                 if self.services:
                     self.bus.pub(self.config.get("publish", "pyircbot_{}").format("meta_update"),
                                  "{} {}".format(self.config.get("name", "default"),
-                                                dumps({"nick": self.services.nick()})))
+                                                JSON.dumps({"nick": self.services.nick()})))
             else:
                 try:
                     name, subcommand, message = message.split(" ", 2)
                     if name != self.config.get("name", "default") and name != "default":
                         continue
                     if subcommand == "privmsg":
-                        dest, message = loads(message)
+                        dest, message = JSON.loads(message)
                         self.bot.act_PRIVMSG(dest, message)
                 except:
                     print_exc()
@@ -74,9 +74,9 @@ class PubSubClient(ModuleBase):
         Relay a privmsg to the event bus
         """
         self.publish(msg.command.lower(),
-                     dumps([msg.args,
-                            msg.prefix[0],
-                            msg.trailing, {"prefix": msg.prefix}]))
+                     JSON.dumps([msg.args,
+                                 msg.prefix[0],
+                                 msg.trailing, {"prefix": msg.prefix}]))
 
     @hook("PRIVMSG")
     def bus_command(self, msg, cmd):
@@ -89,10 +89,10 @@ class PubSubClient(ModuleBase):
             cmd_name = match.groups()[1]
             cmd_args = msg.trailing[len(cmd_name) + 1:].strip()
             self.publish("command_{}".format(cmd_name),
-                         dumps([msg.args,
-                                msg.prefix[0],
-                                cmd_args,
-                                {"prefix": msg.prefix}]))
+                         JSON.dumps([msg.args,
+                                     msg.prefix[0],
+                                     cmd_args,
+                                     {"prefix": msg.prefix}]))
 
     def onenable(self):
         """
@@ -9,10 +9,17 @@
 
 from pyircbot.modulebase import ModuleBase, hook, command
 from datetime import datetime
+from random import randrange
 from pyircbot.modules.ModInfo import info
 
 
 class RandQuote(ModuleBase):
+    """
+    The ``chat`` table is a ring buffer of ``limit`` slots. Every message gets the next sequence number ``seq`` and is
+    written to slot ``seq % limit``, replacing the oldest message once the buffer is full. The slot is the primary
+    key, so logging a message and picking a random one each take a single primary key operation no matter how large
+    ``limit`` is.
+    """
     def __init__(self, bot, moduleName):
         ModuleBase.__init__(self, bot, moduleName)
         self.db = None
@@ -23,20 +30,59 @@ class RandQuote(ModuleBase):
             self.log.info("RandQuote: Selecting sqlite service provider: %s" % serviceProviders[0])
             self.db = serviceProviders[0].opendb("randquote.db")
 
+        self.limit = int(self.config["limit"])
+
         if not self.db.tableExists("chat"):
             self.log.info("RandQuote: Creating table: chat")
             c = self.db.query("""CREATE TABLE IF NOT EXISTS `chat` (
             `id` INTEGER PRIMARY KEY,
+            `seq` INTEGER,
             `date` INTEGER,
             `sender` varchar(64),
             `message` varchar(2048)
             ) ;""")
             c.close()
+            self.db.query("PRAGMA user_version={}".format(self.limit)).close()
+        elif "seq" not in [col["name"] for col in self.db.query("PRAGMA table_info(`chat`)").fetchall()]:
+            self.log.info("RandQuote: Adding column: chat.seq")
+            self.db.query("ALTER TABLE `chat` ADD COLUMN `seq` INTEGER").close()
+            self.relayout()
+
+        # the database remembers the limit its slots were laid out for
+        if self.db.query("PRAGMA user_version").fetchone()[0] != self.limit:
+            self.relayout()
+
+        self.seq = self.db.query("SELECT COALESCE(MAX(`seq`) + 1, 0) AS `seq` FROM `chat`").fetchone()["seq"]
+
+    def relayout(self):
+        """
+        Keep the newest ``limit`` messages and move them into the slots matching their new sequence numbers. Needed
+        when ``limit`` has changed, or when upgrading a table that predates the ring buffer.
+        """
+        self.log.info("RandQuote: Rebuilding chat table for a limit of %s", self.limit)
+        self.db.query("BEGIN IMMEDIATE").close()
+        try:
+            c = self.db.query("SELECT `date`, `sender`, `message` FROM `chat` "
+                              "ORDER BY `seq` DESC, `date` DESC, `id` DESC LIMIT ?", (self.limit, ))
+            rows = c.fetchall()
+            c.close()
+            rows.reverse()
+            self.db.query("DELETE FROM `chat`").close()
+            self.db.connection.executemany("INSERT INTO `chat` (`id`, `seq`, `date`, `sender`, `message`) "
+                                           "VALUES (?, ?, ?, ?, ?)",
+                                           ((seq, seq) + tuple(row) for seq, row in enumerate(rows))).close()
+            self.db.query("PRAGMA user_version={}".format(self.limit)).close()
+            self.db.query("COMMIT").close()
+        except Exception:
+            self.db.query("ROLLBACK").close()
+            raise
 
     @info("randquote", "print a random quote", cmds=["randquote", "randomquote", "rq"])
     @command("randquote", "randomquote", "rq")
     def fetchquotes(self, msg, cmd):
-        c = self.db.query("SELECT * FROM `chat` ORDER BY RANDOM() LIMIT 1;")
+        if not self.seq:
+            return
+        c = self.db.query("SELECT * FROM `chat` WHERE `id`=?", (randrange(min(self.seq, self.limit)), ))
         row = c.fetchone()
         c.close()
         if row:
@@ -44,17 +90,10 @@ class RandQuote(ModuleBase):
 
     @hook("PRIVMSG")
     def logquote(self, msg, cmd):
-        self.db.query("INSERT INTO `chat` (`date`, `sender`, `message`) VALUES (?, ?, ?)",
-                      (int(datetime.now().timestamp()), msg.prefix.nick, msg.trailing)).close()
-        # Trim quotes
-        c = self.db.query("SELECT * FROM `chat` ORDER BY `date` DESC LIMIT %s, 1000000;" % self.config["limit"])
-        while True:
-            row = c.fetchone()
-            if not row:
-                break
-            self.db.query("DELETE FROM `chat` WHERE id=?", (row["id"],)).close()
-        c.close()
+        seq = self.seq
+        self.seq += 1
+        self.db.write("REPLACE INTO `chat` (`id`, `seq`, `date`, `sender`, `message`) VALUES (?, ?, ?, ?, ?)",
+                      (seq % self.limit, seq, int(datetime.now().timestamp()), msg.prefix.nick, msg.trailing))
 
     def ondisable(self):
         self.db.close()
-
@@ -8,8 +8,9 @@
 
 from pyircbot.modulebase import ModuleBase, command
 from datetime import datetime, timedelta
-from threading import Thread
-from time import sleep
+from threading import Event, Thread
+import asyncio
+import heapq
 import re
 import pytz
 from pyircbot.modules.ModInfo import info
@@ -38,25 +39,78 @@ class Remind(ModuleBase):
             ) ;""")
             c.close()
 
-        self.disabled = False
-
-        # Start monitor thread
-        self.t = Thread(target=self.monitor_thread)
-        self.t.daemon = True
-        self.t.start()
+        # (when, id, reminder) for every pending reminder, soonest first. The database is only read at startup.
+        self.heap = []
+        c = self.db.query("SELECT * FROM `reminders`")
+        for reminder in c.fetchall():
+            self.heap.append(Remind.heap_entry(reminder))
+        c.close()
+        heapq.heapify(self.heap)
+
+        # the one timer set on the bot's event loop, for the soonest reminder. The heap and timer are only touched from
+        # the event loop's thread. Bots without an event loop, like clipub's, get a loop of our own on a timer thread.
+        self.loop = getattr(self.bot, "loop", None)
+        self.ownloop = self.loop is None
+        if self.ownloop:
+            self.loop = asyncio.new_event_loop()
+            Thread(target=self.loop.run_forever, name="Remind", daemon=True).start()
+        self.timer = None
+        self.stopped = False
+        self.loop.call_soon_threadsafe(self.arm)
 
-    def monitor_thread(self):
-        while True:
-            sleep(self.config["precision"])
-            if self.disabled:
-                break
-            self.monitor()
+    @staticmethod
+    def heap_entry(reminder):
+        reminder = dict(reminder)
+        when = reminder["when"]
+        if isinstance(when, str):
+            reminder["when"] = when = datetime.fromisoformat(when)
+        return (when, reminder["id"], reminder)
+
+    def schedule(self, reminder):
+        """
+        Add a reminder that has been saved to the database. Safe to call from any thread.
+        """
+        self.loop.call_soon_threadsafe(self.push, Remind.heap_entry(reminder))
+
+    def push(self, entry):
+        heapq.heappush(self.heap, entry)
+        if self.heap[0] is entry:
+            self.arm()
+
+    def arm(self):
+        """
+        Set the timer for the soonest reminder, if any
+        """
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        if self.heap and not self.stopped:
+            delay = (self.heap[0][0] - datetime.now()).total_seconds()
+            # recheck at least hourly, in case the wall clock is changed
+            self.timer = self.loop.call_later(min(max(delay, 0), 3600), self.monitor)
 
     def monitor(self):
-        remindPeople = self.db.query("SELECT * FROM `reminders` WHERE `when` < ?", (datetime.now(),))
-        reminders = remindPeople.fetchall()
-        remindPeople.close()
-
+        self.timer = None
+        now = datetime.now()
+        reminders = []
+        while self.heap and self.heap[0][0] <= now:
+            reminders.append(heapq.heappop(self.heap)[2])
+        if reminders:
+            try:
+                self.deliver(reminders)
+            except Exception:
+                # keep the timer going for the reminders still to come
+                self.log.exception("Remind: couldn't deliver %s reminders" % len(reminders))
+            finally:
+                # Delete now that it's sent
+                for item in reminders:
+                    self.db.write("DELETE FROM `reminders` WHERE `id`=?", (item["id"],))
+        self.arm()
+
+    def deliver(self, reminders):
+        """
+        Send a batch of due reminders, combining those for the same person and place into one message
+        """
         byrecip = {}
 
         for reminder in reminders:
@@ -90,10 +144,6 @@ class Remind(ModuleBase):
             for recip in channelpms_bysender:
                 self.sendReminders(channelpms_bysender[recip], channel, recip)
 
-        # Delete now that it's sent
-        for item in reminders:
-            self.db.query("DELETE FROM `reminders` WHERE `id`=?", (item["id"],)).close()
-
     def sendReminders(self, reminders, target, nick):
         " Send a set of reminders of the same recipient, to them. Collapse down into one message."
         reminder_str = []
@@ -104,7 +154,27 @@ class Remind(ModuleBase):
             self.bot.act_PRIVMSG(target, "%s: Reminder: %s" % (nick, reminder_str))
 
     def ondisable(self):
-        self.disabled = True
+        stopped = Event()
+
+        def stop():
+            self.stopped = True
+            self.arm()
+            self.heap = []
+            stopped.set()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            stop()
+        else:
+            # callbacks already queued on the loop, like a due reminder, run first and may still write to the database
+            self.loop.call_soon_threadsafe(stop)
+            if self.loop.is_running():
+                stopped.wait(5)
+        if self.ownloop:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self.db.close()
 
     @info("remind <time>", "have the bot remind you", cmds=["remind", "at"])
     @command("remind", "at", allow_private=True)
@@ -168,13 +238,7 @@ class Remind(ModuleBase):
         # self.bot.act_PRIVMSG(replyTo, "Diff: %s" % (timediff))
 
         # Save the reminder
-        c = self.db.query("INSERT INTO `reminders` (`sender`, `senderch`, `when`, `message`) VALUES (?, ?, ?, ?)", (
-            msg.prefix.nick,
-            msg.args[0] if "#" in msg.args[0] else "",
-            remindAt,
-            message
-        ))
-        c.close()
+        self.save(msg.prefix.nick, msg.args[0] if "#" in msg.args[0] else "", remindAt, message)
 
         diffHours = int(timediff.seconds / 60 / 60)
         diffMins = int((timediff.seconds - diffHours * 60 * 60) / 60)
@@ -182,6 +246,15 @@ class Remind(ModuleBase):
         self.bot.act_PRIVMSG(replyTo, "%s: Ok, will do. Approx %sh%sm to go." %
                              (msg.prefix.nick, diffHours, diffMins))
 
+    def save(self, sender, senderch, when, message):
+        """
+        Store a new reminder and schedule it
+        """
+        c = self.db.query("INSERT INTO `reminders` (`sender`, `senderch`, `when`, `message`) VALUES (?, ?, ?, ?)",
+                          (sender, senderch, when, message))
+        c.close()
+        self.schedule({"id": c.lastrowid, "sender": sender, "senderch": senderch, "when": when, "message": message})
+
     @staticmethod
     def is_dst(tz):
         now = pytz.utc.localize(datetime.utcnow())
@@ -226,12 +299,8 @@ class Remind(ModuleBase):
 
         remindAt = datetime.now() + timedelta(seconds=delaySeconds)
 
-        self.db.query("INSERT INTO `reminders` (`sender`, `senderch`, `when`, `message`) VALUES (?, ?, ?, ?)", (
-            msg.prefix.nick,
-            msg.args[0] if "#" in msg.args[0] else "",
-            remindAt,
-            cmd.args_str[len(cmd.args[0]):].strip()
-        )).close()
+        self.save(msg.prefix.nick, msg.args[0] if "#" in msg.args[0] else "", remindAt,
+                  cmd.args_str[len(cmd.args[0]):].strip())
 
         hours = int(delaySeconds / 60 / 60)
         minutes = int((delaySeconds - (hours * 60 * 60)) / 60)
@@ -8,6 +8,9 @@
 """
 
 from pyircbot.modulebase import ModuleBase
+from threading import Condition, Lock, Thread, local, current_thread
+from itertools import groupby
+from time import time
 import sqlite3
 
 
@@ -15,17 +18,76 @@ class SQLite(ModuleBase):
     def __init__(self, bot, moduleName):
         ModuleBase.__init__(self, bot, moduleName)
         self.services = ["sqlite"]
+        self.connections = []
 
     def opendb(self, dbname):
-        return Connection(self, dbname)
+        connection = Connection(self, dbname)
+        self.connections.append(connection)
+        return connection
+
+    def ondisable(self):
+        for connection in self.connections:
+            connection.flush()
+
+
+class Row(sqlite3.Row):
+    """
+    Result row, accessed by column name like a dict: ``row["id"]``. Built in C by sqlite3, which is several times
+    faster than building a dict per row. ``dict(row)`` gives a plain dict.
+    """
+    __slots__ = ()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except IndexError:
+            return default
+
+    def items(self):
+        return zip(self.keys(), self)
 
 
 class Connection:
+    """
+    A sqlite database shared by all threads of the bot. Each thread gets its own sqlite connection, opened the first
+    time the thread uses the database, so threads never share a cursor or a transaction. The database is put in WAL
+    mode, letting readers run while another thread writes.
+
+    The pragmas applied to each connection can be set in the SQLite module's config:
+
+    * ``journal_mode`` - default ``wal``
+    * ``synchronous`` - default ``normal``, which is durable in WAL mode except against power loss
+    * ``cache_size`` - page cache size, negative values are KiB. Default ``-8192``
+    * ``mmap_size`` - bytes of the database to memory map. Default ``67108864``
+    * ``busy_timeout`` - seconds to wait for another thread's write lock. Default ``30``
+    * ``cached_statements`` - number of prepared statements kept per connection. Default ``256``
+
+    Writes that needn't be seen immediately can be queued with :py:meth:`write`. A background thread commits queued
+    writes together in one transaction after ``write_delay_ms`` milliseconds (default ``250``) or once
+    ``write_batch_rows`` writes (default ``500``) are waiting. Queued writes are committed on a connection of their
+    own, so they never join a transaction a thread has open. A query through this object commits any writes it has
+    queued before running, so the module that queued them always reads them back. Reads cost nothing extra while no
+    writes are queued. A query inside a transaction the thread has open doesn't commit them, as it would wait on that
+    transaction. :py:meth:`close` commits anything still queued.
+    """
     def __init__(self, master, dbname):
         self.master = master
         self.log = master.log
         self.dbname = dbname
-        self.connection = None
+        self.path = self.master.getFilePath(self.dbname)
+        self.config = master.config
+        self._local = local()
+        self._connections = []
+        self._lock = Lock()
+        self.write_delay = self.config.get("write_delay_ms", 250) / 1000
+        self.write_batch_rows = self.config.get("write_batch_rows", 500)
+        self._pending = []
+        self._pending_since = 0
+        self._pending_cv = Condition()
+        self._commit_lock = Lock()
+        self._commit_connection = None
+        self._writer = None
+        self.log.info("Sqlite: opening database %s" % self.path)
         self._connect()
 
     # Check if the table requested exists
@@ -59,23 +121,147 @@ class Connection:
             c.execute(queryText, args)
         return c
 
-    # Returns a cusor object, after checking for connectivity
+    # Returns a cusor object, after committing queued writes so they can be read back
     def getCursor(self):
-        c = self.connection.cursor()
+        connection = self.connection
+        if self._pending and not connection.in_transaction:
+            self.flush()
+        c = connection.cursor()
         return c
 
+    def write(self, queryText, args=(), onerror=None, oncommit=None):
+        """Queue a query that changes the database, such as an INSERT, to be committed in the background along with
+        other queued writes. Queries made through this connection afterwards will see the change.
+
+        :param queryText: the sqlite query as a string
+        :type queryText: str
+        :param args: arguments to be escaped into the query
+        :type args: tuple
+        :param onerror: called with the exception, from the committing thread, if the write fails and is dropped
+        :type onerror: callable
+        :param oncommit: called without arguments, from the committing thread, once the write is committed
+        :type oncommit: callable"""
+        with self._pending_cv:
+            if not self._pending:
+                self._pending_since = time()
+            self._pending.append((queryText, args, onerror, oncommit))
+            if len(self._pending) in (1, self.write_batch_rows):
+                self._pending_cv.notify()
+            if not self._writer:
+                self._writer = Thread(target=self._write_loop, daemon=True)
+                self._writer.start()
+
+    def flush(self):
+        """Commit all queued writes now, waiting until they're written"""
+        with self._commit_lock:
+            with self._pending_cv:
+                batch = self._pending
+                self._pending = []
+            if batch:
+                self._commit(batch)
+
+    def _write_loop(self):
+        while True:
+            with self._pending_cv:
+                while self._writer and (not self._pending or
+                                        (len(self._pending) < self.write_batch_rows and
+                                         time() < self._pending_since + self.write_delay)):
+                    self._pending_cv.wait(self._pending_since + self.write_delay - time() if self._pending else None)
+                if not self._writer:
+                    return
+            self.flush()
+
+    def _commit(self, batch):
+        # caller holds self._commit_lock
+        if self._commit_connection is None:
+            self._commit_connection = self._open()
+        connection = self._commit_connection
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            # consecutive uses of the same query, like a series of inserts, run as one executemany
+            for queryText, group in groupby(batch, key=lambda item: item[0]):
+                connection.executemany(queryText, [item[1] for item in group]).close()
+            connection.execute("COMMIT")
+        except Exception:
+            self.log.exception("Sqlite: batch of %s writes to %s failed, retrying them one by one",
+                               len(batch), self.dbname)
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            for queryText, args, onerror, oncommit in batch:
+                try:
+                    connection.execute(queryText, args).close()
+                except Exception as e:
+                    self.log.exception("Sqlite: dropped write: %s", queryText)
+                    if onerror:
+                        onerror(e)
+                else:
+                    if oncommit:
+                        oncommit()
+            return
+        for _, _, _, oncommit in batch:
+            if oncommit:
+                oncommit()
+
+    @property
+    def connection(self):
+        """
+        The calling thread's sqlite connection
+        """
+        try:
+            return self._local.connection
+        except AttributeError:
+            return self._connect()
+
     # Opens the sqlite database / attempts to create it if it doesn't exist yet
     def _connect(self):
-        self.log.info("Sqlite: opening database %s" % self.master.getFilePath(self.dbname))
-        self.connection = sqlite3.connect(self.master.getFilePath(self.dbname), check_same_thread=False)
-        self.connection.row_factory = Connection.dict_factory
-        self.connection.isolation_level = None
-        self.log.info("Sqlite: Connected.")
+        connection = self._open()
+        self._local.connection = connection
+        with self._lock:
+            # connections of threads that have exited won't be used again
+            for thread, old in [i for i in self._connections if not i[0].is_alive()]:
+                old.close()
+                self._connections.remove((thread, old))
+            self._connections.append((current_thread(), connection))
+        return connection
+
+    def _open(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False,
+                                     timeout=self.config.get("busy_timeout", 30),
+                                     cached_statements=self.config.get("cached_statements", 256))
+        connection.row_factory = Row
+        connection.isolation_level = None
+        for pragma, default in (("journal_mode", "wal"),
+                                ("synchronous", "normal"),
+                                ("cache_size", -8192),
+                                ("mmap_size", 67108864)):
+            connection.execute("PRAGMA {}={}".format(pragma, self.config.get(pragma, default))).close()
 
         # Test the connection
-        c = self.connection.cursor()
+        c = connection.cursor()
         derp = c.execute("SELECT * FROM SQLITE_MASTER")  # NOQA
         c.close()
+        return connection
 
     def close(self):
-        self.connection.close()
+        """
+        Commit queued writes and close the connections of all threads
+        """
+        with self._pending_cv:
+            writer = self._writer
+            self._writer = None
+            self._pending_cv.notify()
+        if writer:
+            writer.join()
+        self.flush()
+        with self._commit_lock:
+            if self._commit_connection:
+                self._commit_connection.close()
+                self._commit_connection = None
+        if self in self.master.connections:
+            self.master.connections.remove(self)
+        with self._lock:
+            connections = self._connections
+            self._connections = []
+        for _, connection in connections:
+            connection.close()
+        self._local = local()
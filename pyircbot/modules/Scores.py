@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+.. module:: Scores
+    :synopsis: Module providing a shared, durable score keeping service
+
+"""
+
+from pyircbot.modulebase import ModuleBase, MissingDependancyException
+from bisect import bisect_left, insort
+from threading import Lock
+
+
+class Scores(ModuleBase):
+    """
+    Keeps players' scores for games. Scores live in memory, in named boards, and each board can hold several stats per
+    player, such as kills and total weight. Changes are queued to a sqlite database and committed in batches, so every
+    commit is atomic and scoring a point never rewrites the whole score table. Each stat keeps a ranking as it's
+    updated, so top-N queries don't sort every player.
+    """
+    def __init__(self, bot, moduleName):
+        ModuleBase.__init__(self, bot, moduleName)
+        self.services = ["scores"]
+        sqlite = self.bot.getBestModuleForService("sqlite")
+        if sqlite is None:
+            raise MissingDependancyException("Scores: SQLite service is required.")
+        self.db = sqlite.opendb("scores.db")
+        if not self.db.tableExists("scores"):
+            self.db.query("""CREATE TABLE `scores` (
+            `board` varchar(64),
+            `player` varchar(64),
+            `stat` varchar(64),
+            `value` NUMERIC,
+            PRIMARY KEY (`board`, `player`, `stat`)
+            ) ;""").close()
+        self.lock = Lock()
+        self.boards = {}
+        c = self.db.query("SELECT `board`, `player`, `stat`, `value` FROM `scores`;")
+        for row in c.fetchall():
+            self.board(row["board"])._set(row["player"], row["stat"], row["value"])
+        c.close()
+
+    def ondisable(self):
+        self.db.close()
+
+    def flush(self):
+        """Write all queued score changes to the database now"""
+        self.db.flush()
+
+    def board(self, name):
+        """Get a score board, creating it if it doesn't exist
+
+        :param name: name of the board, usually the game's module name
+        :type name: str
+        :returns: :py:class:`Board`"""
+        with self.lock:
+            if name not in self.boards:
+                self.boards[name] = Board(self, name)
+            return self.boards[name]
+
+
+class Board(object):
+    """
+    One game's scores
+
+    :param master: the Scores module
+    :param name: name of the board
+    """
+    def __init__(self, master, name):
+        self.master = master
+        self.name = name
+        self.values = {}  # stat -> player -> value
+        self.rankings = {}  # stat -> list of (-value, player), best first
+
+    def __len__(self):
+        """Number of players with any score"""
+        with self.master.lock:
+            return len(set(player for values in self.values.values() for player in values))
+
+    def get(self, player, stat="score", default=0):
+        """Get a player's score
+
+        :param player: player name
+        :type player: str
+        :param stat: which of the player's scores
+        :type stat: str
+        :param default: returned for players with no such score
+        :returns: the score"""
+        with self.master.lock:
+            return self.values.get(stat, {}).get(player, default)
+
+    def stats(self, player):
+        """Get all of a player's scores
+
+        :param player: player name
+        :type player: str
+        :returns: dict -- stat -> value"""
+        with self.master.lock:
+            return {stat: values[player] for stat, values in self.values.items() if player in values}
+
+    def add(self, player, amount=1, stat="score"):
+        """Add to a player's score
+
+        :param player: player name
+        :type player: str
+        :param amount: amount to add, may be negative
+        :param stat: which of the player's scores
+        :type stat: str
+        :returns: the new score"""
+        return self.update(player, {stat: amount})[stat]
+
+    def update(self, player, amounts):
+        """Add to several of a player's scores at once
+
+        :param player: player name
+        :type player: str
+        :param amounts: stat -> amount to add
+        :type amounts: dict
+        :returns: dict -- stat -> new score, for the stats updated"""
+        result = {}
+        with self.master.lock:
+            for stat, amount in amounts.items():
+                result[stat] = self._set(player, stat, self.values.get(stat, {}).get(player, 0) + amount)
+                self.master.db.write("REPLACE INTO `scores` (`board`, `player`, `stat`, `value`) VALUES (?, ?, ?, ?)",
+                                     (self.name, player, stat, result[stat]))
+        return result
+
+    def top(self, count, stat="score"):
+        """Get the players with the highest scores
+
+        :param count: how many players to return
+        :type count: int
+        :param stat: which score to rank players by
+        :type stat: str
+        :returns: list -- of (player, score) tuples, highest first"""
+        with self.master.lock:
+            return [(player, -value) for value, player in self.rankings.get(stat, [])[0:count]]
+
+    def _set(self, player, stat, value):
+        values = self.values.setdefault(stat, {})
+        ranking = self.rankings.setdefault(stat, [])
+        if player in values:
+            del ranking[bisect_left(ranking, (-values[player], player))]
+        values[player] = value
+        insort(ranking, (-value, player))
+        return value
@@ -6,13 +6,14 @@
 
 """
 
-from pyircbot.modulebase import ModuleBase, hook
+from pyircbot.modulebase import ModuleBase, MissingDependancyException, hook
 from pyircbot.common import messageHasCommand
+from array import array
 import random
 import json
+import mmap
 import os
-from threading import Timer
-from operator import itemgetter
+from threading import Lock, Timer
 
 
 class Scramble(ModuleBase):
@@ -21,22 +22,15 @@ class Scramble(ModuleBase):
         ModuleBase.__init__(self, bot, moduleName)
 
         # Dictionary
-        self.wordsCount = 0
         self.wordsFile = self.getFilePath("words.txt")
-        print(self.wordsFile)
-        wordsF = open(self.wordsFile, "r")
-        while True:
-            word = wordsF.readline()
-            if not word:
-                break
-            self.wordsCount += 1
-        wordsF.close
-        self.log.info("Scramble: Loaded %s words" % str(self.wordsCount))
+        self.words = WordList(self.wordsFile)
+        self.log.info("Scramble: Loaded %s words" % str(len(self.words)))
         # Load scores
-        self.scoresFile = self.getFilePath("scores.json")
-        if not os.path.exists(self.scoresFile):
-            json.dump({}, open(self.scoresFile, 'w'))
-        self.scores = json.load(open(self.scoresFile, 'r'))
+        scores = self.bot.getBestModuleForService("scores")
+        if scores is None:
+            raise MissingDependancyException("Scramble: Scores service is required.")
+        self.scores = scores.board("Scramble")
+        self.migrateScores()
         # Per channel games
         self.games = {}
         # Hook in
@@ -49,30 +43,107 @@ class Scramble(ModuleBase):
                 self.games[channel] = scrambleGame(self, channel)
             self.games[channel].scramble(msg.args, msg.prefix, msg.trailing)
 
-    def saveScores(self):
-        json.dump(self.scores, open(self.scoresFile, 'w'))
+    def migrateScores(self):
+        """
+        Move scores from the scores.json file used by older versions into the scores service
+        """
+        scoresFile = self.getFilePath("scores.json")
+        if not os.path.exists(scoresFile):
+            return
+        if not len(self.scores):
+            with open(scoresFile) as f:
+                for player, score in json.load(f).items():
+                    self.scores.add(player.lower(), score)
+            self.log.info("Scramble: Migrated %s scores from %s" % (len(self.scores), scoresFile))
+            self.scores.master.flush()
+        os.rename(scoresFile, scoresFile + ".migrated")
 
     def getScore(self, player, add=0):
         player = player.lower()
-        if player not in self.scores:
-            self.scores[player] = 0
         if not add == 0:
-            self.scores[player] += add
-            self.saveScores()
-
-        return self.scores[player]
+            return self.scores.add(player, add)
+        return self.scores.get(player)
 
     def getScoreNoWrite(self, player):
-        if not player.lower() in self.scores:
-            return 0
-        else:
-            return self.getScore(player)
+        return self.getScore(player)
 
     def ondisable(self):
         self.log.info("Scramble: Unload requested, ending games...")
         for game in self.games:
             self.games[game].gameover()
-        self.saveScores()
+        self.words.close()
+
+
+class WordList(object):
+    """
+    Random access to the lines of a word file. The file is mmap'd and the offset of each line is indexed, so picking a
+    random word is one lookup. The index is rebuilt when the file's mtime changes.
+
+    :param path: path to the word file, one word or phrase per line
+    :type path: str
+    """
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.file = None
+        self.map = None
+        self.offsets = array('Q')  # start of each non-blank line
+        self.lock = Lock()
+        self.refresh()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def refresh(self):
+        """
+        Rebuild the index if the file has changed since it was built
+        """
+        mtime = os.stat(self.path).st_mtime_ns
+        with self.lock:
+            if mtime != self.mtime:
+                self._load(mtime)
+
+    def _load(self, mtime):
+        self._close()
+        self.mtime = mtime
+        self.offsets = array('Q')
+        self.file = open(self.path, "rb")
+        if os.fstat(self.file.fileno()).st_size == 0:  # can't mmap an empty file
+            return
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        start = 0
+        size = len(self.map)
+        while start < size:
+            end = self.map.find(b"\n", start)
+            if end == -1:
+                end = size
+            if self.map[start:end].strip():
+                self.offsets.append(start)
+            start = end + 1
+
+    def random(self):
+        """
+        Return a random word, lowercased, or an empty string if there are none
+        """
+        self.refresh()
+        with self.lock:
+            if not self.offsets:
+                return ""
+            start = self.offsets[random.randrange(len(self.offsets))]
+            end = self.map.find(b"\n", start)
+            return self.map[start:end if end != -1 else len(self.map)].decode("utf-8", "replace").strip().lower()
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def _close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
 
 
 class scrambleGame:
@@ -129,19 +200,10 @@ class scrambleGame:
             return
         cmd = messageHasCommand(".scramble top", trailing)
         if cmd:
-            sortedscores = []
-            for player in self.master.scores:
-                sortedscores.append({'name': player, 'score': self.master.scores[player]})
-            sortedscores = sorted(sortedscores, key=itemgetter('score'))
-            sortedscores.reverse()
-            numScores = len(sortedscores)
-            if numScores > 3:
-                numScores = 3
-            resp = "Top %s: " % str(numScores)
-            which = 1
-            while which <= numScores:
-                resp += "%s: %s, " % (sortedscores[which - 1]["name"], sortedscores[which - 1]["score"])
-                which += 1
+            topscores = self.master.scores.top(3)
+            resp = "Top %s: " % str(len(topscores))
+            for name, score in topscores:
+                resp += "%s: %s, " % (name, score)
             self.master.bot.act_PRIVMSG(self.channel, resp[:-2])
         cmd = messageHasCommand(".scramble score", trailing)
         if cmd:
@@ -224,14 +286,7 @@ class scrambleGame:
         self.nextTimer.start()
 
     def pickWord(self):
-        f = open(self.master.wordsFile, "r")
-        skip = random.randint(0, self.master.wordsCount)
-        while skip >= 0:
-            f.readline()
-            skip -= 1
-        picked = f.readline().strip().lower()
-        f.close()
-        return picked
+        return self.master.words.random()
 
     def scrambleWord(self, word):
         scrambled = ""
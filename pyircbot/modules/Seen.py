@@ -9,61 +9,82 @@
 
 from pyircbot.modules.ModInfo import info
 from pyircbot.modulebase import ModuleBase, command, hook
-from contextlib import closing
+from threading import Event, Lock, Thread
 import sqlite3
 import time
 
 
 class Seen(ModuleBase):
+    """
+    Last seen times are kept in memory and written to the database in one transaction every ``flush_interval`` seconds
+    (default 30) and when the module is disabled.
+    """
     def __init__(self, bot, moduleName):
         ModuleBase.__init__(self, bot, moduleName)
         # if the database doesnt exist, it will be created
-        sql = self.getSql()
-        c = sql.cursor()
+        self.sql = self.getSql()
         # check if our table exists
-        c.execute("SELECT * FROM SQLITE_MASTER WHERE `type`='table' AND `name`='seen'")
-        if len(c.fetchall()) == 0:
+        if not self.sql.execute("SELECT * FROM SQLITE_MASTER WHERE `type`='table' AND `name`='seen'").fetchall():
             self.log.info("Seen: Creating database")
             # if no, create it.
-            c.execute("CREATE TABLE `seen` (`nick` VARCHAR(32), `date` INTEGER, PRIMARY KEY(`nick`))")
+            self.sql.execute("CREATE TABLE `seen` (`nick` VARCHAR(32), `date` INTEGER, PRIMARY KEY(`nick`))")
+            self.sql.commit()
+        # nick -> last seen timestamp
+        self.seen = {nick: float(date) for nick, date in self.sql.execute("SELECT `nick`, `date` FROM `seen`")}
+        # entries of self.seen changed since the last flush
+        self.dirty = {}
+        self.lock = Lock()
+        self.disabled = Event()
+        self.flusher = Thread(target=self.flush_thread, daemon=True)
+        self.flusher.start()
 
-    @hook("PRIVMSG")
+    @hook("PRIVMSG", "JOIN", "PART", "QUIT", "NICK")
     def recordSeen(self, message, command):
         # using a message to update last seen, also, the .seen query
-        datest = str(time.time() + (int(self.config["add_hours"]) * 60 * 60))
-        sql = self.getSql()
-        with closing(sql.cursor()) as c:
-            # update or add the user's row
-            c.execute("REPLACE INTO `seen` (`nick`, `date`) VALUES (?, ?)", (message.prefix.nick.lower(), datest))
-            # self.log.info("Seen: %s on %s" % (nick.lower(), datest))
-            sql.commit()
+        date = time.time() + (int(self.config["add_hours"]) * 60 * 60)
+        nicks = [message.prefix.nick.lower()]
+        if message.command == "NICK":
+            nicks.append((message.trailing or message.args[0]).lower())
+        with self.lock:
+            for nick in nicks:
+                self.seen[nick] = self.dirty[nick] = date
 
     @info("seen <nick>", "print last time user was seen", cmds=["seen"])
     @command("seen", require_args=True)
     def lastSeen(self, message, command):
-        sql = self.getSql()
-        searchnic = command.args[0].lower()
-        with closing(sql.cursor()) as c:
-            # query the DB for the user
-            c.execute("SELECT * FROM `seen` WHERE `nick`= ? ", [searchnic])
-            rows = c.fetchall()
-            if len(rows) == 1:
-                self.bot.act_PRIVMSG(message.args[0], "I last saw %s on %s (%s)." %
-                                     (command.args[0], time.strftime("%m/%d/%y at %I:%M %p",
-                                      time.localtime(rows[0]['date'])), self.config["timezone"]))
-            else:
-                self.bot.act_PRIVMSG(message.args[0], "Sorry, I haven't seen %s!" % command.args[0])
+        date = self.seen.get(command.args[0].lower())
+        if date is not None:
+            self.bot.act_PRIVMSG(message.args[0], "I last saw %s on %s (%s)." %
+                                 (command.args[0], time.strftime("%m/%d/%y at %I:%M %p", time.localtime(date)),
+                                  self.config["timezone"]))
+        else:
+            self.bot.act_PRIVMSG(message.args[0], "Sorry, I haven't seen %s!" % command.args[0])
+
+    def flush_thread(self):
+        while not self.disabled.wait(self.config.get("flush_interval", 30)):
+            self.flush()
+
+    def flush(self):
+        """
+        Write changed last seen times to the database
+        """
+        with self.lock:
+            dirty = self.dirty
+            self.dirty = {}
+        if dirty:
+            with self.sql:  # one transaction
+                self.sql.executemany("REPLACE INTO `seen` (`nick`, `date`) VALUES (?, ?)", dirty.items())
+
+    def ondisable(self):
+        self.disabled.set()
+        self.flusher.join()
+        self.flush()
+        self.sql.close()
 
     def getSql(self):
         # return a SQL reference to the database
         path = self.getFilePath('database.sql3')
-        sql = sqlite3.connect(path)
-        sql.row_factory = self.dict_factory
+        sql = sqlite3.connect(path, check_same_thread=False)
+        sql.execute("PRAGMA journal_mode=WAL").close()
+        sql.execute("PRAGMA synchronous=NORMAL").close()
         return sql
-
-    def dict_factory(self, cursor, row):
-        # because Lists suck for database results
-        d = {}
-        for idx, col in enumerate(cursor.description):
-            d[col[0]] = row[idx]
-        return d
@@ -1,13 +1,13 @@
 from pyircbot.modulebase import ModuleBase, MissingDependancyException, command
 from pyircbot.modules.ModInfo import info
 from pyircbot.modules.NickUser import protected
-from contextlib import closing
+from contextlib import closing, contextmanager
+from concurrent.futures import Future
 from decimal import Decimal
 from time import sleep, time
 from queue import Queue, Empty
-from threading import Thread
-from requests import get
-from collections import namedtuple
+from threading import Lock, Thread
+from collections import deque, namedtuple
 from math import ceil
 from datetime import datetime, timedelta
 import re
@@ -17,6 +17,8 @@ import traceback
 
 RE_SYMBOL = re.compile(r'^([A-Z\-]+)$')
 DUSTACCT = "#dust"
+APIURL = "https://www.alphavantage.co/query"
+NUMFIELDS = frozenset(['open', 'high', 'low', 'price', 'volume', 'change', 'previous close'])
 
 Trade = namedtuple("Trade", "nick buy symbol amount replyto")
 
@@ -70,6 +72,59 @@ def format_gainloss_inner(diff, pct):
                                      "⬆" if profit else "⬇")
 
 
+class QuotaExceeded(Exception):
+    pass
+
+
+class Quota(object):
+    """
+    Sliding window limits on the number of api requests per minute and per day
+    """
+    def __init__(self, per_minute, per_day):
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self.calls = deque()  # times of the requests made in the last day, oldest first
+        self.lock = Lock()
+
+    def acquire(self, reserve=0):
+        """
+        Take one request from the quota, if more than ``reserve`` requests are left in both windows
+        :return: True if the request may be made
+        """
+        now = time()
+        with self.lock:
+            while self.calls and self.calls[0] <= now - 86400:
+                self.calls.popleft()
+            minute = 0
+            for when in reversed(self.calls):
+                if when <= now - 60:
+                    break
+                minute += 1
+            if minute + reserve >= self.per_minute or len(self.calls) + reserve >= self.per_day:
+                return False
+            self.calls.append(now)
+            return True
+
+
+def decode_priceinfo(data):
+    """
+    Convert the numeric fields of a quote as returned by :py:meth:`StockPlay.fetch_priceinfo` to Decimals
+    """
+    return {k: Decimal(v) if k in NUMFIELDS else v for k, v in data.items()}
+
+
+def calc_avgbuy(count, spent):
+    """
+    Calculate the average buy price of a holding
+    :param count: number of shares held
+    :param spent: cents spent on the shares, see :py:meth:`StockPlay.calc_user_avgbuy`
+    :return: Decimal price, in dollars
+    """
+    if not count:
+        return Decimal(0)
+    return Decimal(spent) / 100 / Decimal(count)
+
+
 def calc_gain(start, end):
     """
     Calculate the +/- gain percent given start/end values
@@ -91,6 +146,10 @@ class StockPlay(ModuleBase):
 
         self.sql = self.sqlite.opendb("stockplay.db")
 
+        self.http = self.bot.getBestModuleForService("http")
+        if self.http is None:
+            raise MissingDependancyException("StockPlay: HTTP service is required.")
+
         with closing(self.sql.getCursor()) as c:
             if not self.sql.tableExists("stockplay_balances"):
                 c.execute("""CREATE TABLE `stockplay_balances` (
@@ -103,6 +162,7 @@ class StockPlay(ModuleBase):
                       `nick` varchar(64),
                       `symbol` varchar(12),
                       `count` integer,
+                      `spent` integer NOT NULL DEFAULT 0,
                       PRIMARY KEY (nick, symbol)
                     );""")
             if not self.sql.tableExists("stockplay_trades"):
@@ -127,16 +187,44 @@ class StockPlay(ModuleBase):
                       `cents` integer,
                       PRIMARY KEY(nick, day)
                     );""")
+            if not self.sql.tableExists("stockplay_leaderboard"):
+                c.execute("""CREATE TABLE `stockplay_leaderboard` (
+                      `nick` varchar(64) PRIMARY KEY,
+                      `cents` integer,
+                      `day_cents` integer
+                    );""")
+                c.execute("""CREATE INDEX `stockplay_leaderboard_cents`
+                             ON `stockplay_leaderboard` (`cents` DESC, `nick`)""")
             # if not self.sql.tableExists("stockplay_report_cache"):
             #     c.execute("""CREATE TABLE `stockplay_report_cache` (
             #           `nick` varchar(64) PRIMARY KEY,
             #           `time` integer,
             #           `data` text
             #         );""")
+            holding_cols = [col["name"] for col in c.execute("PRAGMA table_info(`stockplay_holdings`)").fetchall()]
+
+        if "spent" not in holding_cols:
+            self.backfill_spent()
+
+        # symbol -> (time fetched, quote with numbers decoded) of every quote in stockplay_prices
+        with closing(self.sql.getCursor()) as c:
+            self.prices = {row["symbol"]: (row["time"], decode_priceinfo(json.loads(row["data"])))
+                           for row in c.execute("SELECT * FROM stockplay_prices").fetchall()}
+        # symbol -> Future of a quote being fetched right now
+        self.fetching = {}
+        self.fetching_lock = Lock()
+        self.quota = Quota(self.config.get("api_per_minute", 5), self.config.get("api_per_day", 500))
 
         # Last time the interval tasks were executed
         self.task_time = 0
 
+        # Players who traded and symbols requoted since the leaderboard was last updated. The leaderboard is built in
+        # full once, then only these players' rows are updated.
+        self.changed_nicks = set()
+        self.changed_symbols = set()
+        self.changes_lock = Lock()
+        self.leaderboard_built = False
+
         # background work executor thread
         self.asyncq = Queue()
         self.running = True
@@ -154,23 +242,43 @@ class StockPlay(ModuleBase):
 
     def calc_user_avgbuy(self, nick, symbol):
         """
-        Calculate the average buy price of a user's stock. This is generated by backtracking through their
-        buy/sell history
-        :return: price, in cents
+        Calculate the average buy price of a user's stock. Each holding records what was spent on buying the symbol,
+        less what selling it returned, since the player last held none of it. This is updated with every trade.
+        :return: price, in dollars
+        """
+        return calc_avgbuy(*self.get_position(nick, symbol))
+
+    def backfill_spent(self):
+        """
+        Add the ``spent`` column to a holdings table that predates it, filling it in by replaying the trade history
+        """
+        self.log.info("StockPlay: adding spent column to holdings")
+        positions = {}  # (nick, symbol) -> [count, spent]
+        with self.transaction() as c:
+            c.execute("ALTER TABLE stockplay_holdings ADD COLUMN `spent` integer NOT NULL DEFAULT 0")
+            for row in c.execute("SELECT * FROM stockplay_trades ORDER BY time ASC, rowid ASC"):
+                position = positions.setdefault((row["nick"], row["symbol"]), [0, 0])
+                sign = 1 if row["type"] == "buy" else -1
+                position[0] += row["count"] * sign
+                position[1] += row["price"] * sign
+                if position[0] <= 0:  # sold out, the next buy starts over
+                    position[0] = position[1] = 0
+            c.executemany("UPDATE stockplay_holdings SET spent=? WHERE nick=? AND symbol=?",
+                          ((spent, nick, symbol) for (nick, symbol), (_, spent) in positions.items()))
+
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager running the database queries made within it by this thread in one transaction. Yields a cursor.
         """
-        target_count = self.get_holding(nick, symbol)  # backtrack until we hit this many shares
-        spent = 0
-        count = 0
         with closing(self.sql.getCursor()) as c:
-            for row in c.execute("SELECT * FROM stockplay_trades WHERE nick=? AND symbol=? ORDER BY time DESC",
-                                 (nick, symbol)).fetchall():
-                count += row["count"] * (1 if row["type"] == "buy" else -1)
-                spent += row["price"] * (1 if row["type"] == "buy" else -1)
-                if count == target_count:  # at this point in history the user held 0 of the symbol, stop backtracking
-                    break
-        if not count:
-            return Decimal(0)
-        return Decimal(spent) / 100 / Decimal(count)
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                yield c
+            except Exception:
+                c.execute("ROLLBACK")
+                raise
+            c.execute("COMMIT")
 
     def price_updater(self):
         """
@@ -179,16 +287,11 @@ class StockPlay(ModuleBase):
         while self.running:
             self.log.info("price_updater")
             try:
-                updatesym = None
-                with closing(self.sql.getCursor()) as c:
-                    row = c.execute("""SELECT * FROM stockplay_prices
-                                        WHERE symbol in (SELECT symbol FROM stockplay_holdings WHERE count>0)
-                                       ORDER BY time ASC LIMIT 1""").fetchone()
-                    updatesym = row["symbol"] if row else None
-
+                updatesym = self.pick_refresh()
                 if updatesym:
-                    self.get_price(updatesym, 0)
-
+                    self.fetch_shared(updatesym, background=True, stale=False)
+            except QuotaExceeded:
+                self.log.info("price_updater: api quota used up, skipping refresh")
             except Exception:
                 traceback.print_exc()
             delay = self.config["bginterval"]
@@ -196,6 +299,33 @@ class StockPlay(ModuleBase):
                 delay -= 1
                 sleep(1)
 
+    def pick_refresh(self):
+        """
+        Choose the held symbol most in need of a new quote. Symbols that have never been quoted come first, then the
+        one with the greatest value held multiplied by the age of its quote. Quotes younger than *bginterval* are
+        left alone.
+        :return: symbol, or None if no quote needs refreshing
+        """
+        now = time()
+        best = None
+        best_score = 0
+        with closing(self.sql.getCursor()) as c:
+            held = c.execute("SELECT symbol, SUM(count) AS count FROM stockplay_holdings WHERE count>0 "
+                             "GROUP BY symbol").fetchall()
+        for row in held:
+            cached = self.prices.get(row["symbol"])
+            if cached is None:
+                return row["symbol"]
+            fetched, priceinfo = cached
+            age = now - fetched
+            if age < self.config["bginterval"]:
+                continue
+            score = Decimal(age) * priceinfo["price"] * row["count"]
+            if best is None or score > best_score:
+                best = row["symbol"]
+                best_score = score
+        return best
+
     def trader_background(self):
         """
         Perform trading, reporting and other background tasks
@@ -229,9 +359,9 @@ class StockPlay(ModuleBase):
                                                           "buy" if trade.buy else "sell",
                                                           trade.amount,
                                                           trade.symbol))
-        # Update quote price
+        # Update quote price. Trades need a fresh quote, a stale one could be traded against the real price.
         try:
-            symprice = self.get_price(trade.symbol, self.config["tcachesecs"])
+            symprice = self.get_price(trade.symbol, self.config["tcachesecs"], stale=False)
         except Exception:
             traceback.print_exc()
             self.bot.act_PRIVMSG(trade.replyto, "{}: invalid symbol or api failure, trade aborted!"
@@ -252,7 +382,7 @@ class StockPlay(ModuleBase):
 
         # fetch existing user balances
         nickbal = self.get_bal(trade.nick)
-        count = self.get_holding(trade.nick, trade.symbol)
+        count, spent = self.get_position(trade.nick, trade.symbol)
 
         # check if trade is legal
         if trade.buy and nickbal < price_rounded:
@@ -267,17 +397,25 @@ class StockPlay(ModuleBase):
         if trade.buy:
             nickbal -= price_rounded
             count += trade.amount
+            spent += price_rounded
         else:
             nickbal += price_rounded
             count -= trade.amount
+            spent = spent - price_rounded if count else 0
 
         # commit the trade
-        self.set_bal(trade.nick, nickbal)
-        self.set_holding(trade.nick, trade.symbol, count)
+        with self.transaction():
+            self.set_bal(trade.nick, nickbal)
+            self.set_holding(trade.nick, trade.symbol, count, spent)
 
-        # save dust
-        dustbal = self.get_bal(DUSTACCT)
-        self.set_bal(DUSTACCT, dustbal + int(dust * 100))
+            # save dust
+            dustbal = self.get_bal(DUSTACCT)
+            self.set_bal(DUSTACCT, dustbal + int(dust * 100))
+
+            self.log_trade(trade.nick, time(), "buy" if trade.buy else "sell",
+                           trade.symbol, trade.amount, price_rounded)
+        with self.changes_lock:
+            self.changed_nicks.add(trade.nick)
 
         # notify user
         self.bot.act_PRIVMSG(trade.replyto,
@@ -288,9 +426,6 @@ class StockPlay(ModuleBase):
                                                                     format_price(price_rounded),
                                                                     format_price(nickbal)))
 
-        self.log_trade(trade.nick, time(), "buy" if trade.buy else "sell",
-                       trade.symbol, trade.amount, price_rounded)
-
     def do_report(self, lookup, sender, replyto, full):
         """
         Generate a text report of the nick's portfolio ::
@@ -305,7 +440,11 @@ class StockPlay(ModuleBase):
             <bloomberg_terminal> player:  10 INTC bought at average  $53.23  +0.00   (0.00%)⬆ now  $53.23
             <bloomberg_terminal> player: 160 KPTI bought at average   $4.88  +0.00   (0.00%)⬆ now   $4.88
         """
-        data = self.build_report(lookup)
+        try:
+            data = self.build_report(lookup)
+        except QuotaExceeded:
+            self.bot.act_PRIVMSG(replyto, "{}: api quota used up, try again later.".format(sender))
+            return
         dest = sender if full else replyto
 
         self.bot.act_PRIVMSG(dest, "{}: {} cash: {} stock value: ~{} total: ~{} (24h {})"
@@ -345,12 +484,12 @@ class StockPlay(ModuleBase):
             for row in c.execute("SELECT * FROM stockplay_holdings WHERE count>0 AND nick=? ORDER BY count DESC",
                                  (nick, )).fetchall():
                 # the API limits us to 5 requests per minute or 500 requests per day or about 1 request every 173s
-                # The background thread updates the oldest price every 5 minutes. Here, we allow even very stale quotes
-                # because it's simply impossible to request fresh data for every stock right now. Recommended rcachesecs
-                # is 86400 (1 day)
+                # The background thread refreshes the most valuable stale quote every bginterval seconds. Here, we allow
+                # even very stale quotes because it's simply impossible to request fresh data for every stock right now.
+                # Recommended rcachesecs is 86400 (1 day)
                 symprice = Decimal(self.get_price(row["symbol"], self.config["rcachesecs"]))
                 holding_value += symprice * row["count"]
-                avgbuy = self.calc_user_avgbuy(nick, row["symbol"])
+                avgbuy = calc_avgbuy(row["count"], row["spent"])
                 symbol_count.append((row["symbol"],
                                      row["count"],
                                      symprice,
@@ -379,48 +518,85 @@ class StockPlay(ModuleBase):
 
     def do_tasks(self):
         """
-        Do interval tasks such as recording nightly balances
+        Do interval tasks such as recording nightly balances and ranking players
         """
         now = time()
         if now - 60 < self.task_time:
             return
         self.task_time = now
         self.record_nightly_balances()
+        self.update_leaderboard()
 
-    def get_price(self, symbol, thresh=None):
+    def get_price(self, symbol, thresh=None, stale=True):
         """
         Get symbol price, with quote being at most $thresh seconds old
+        :param stale: see fetch_shared
+        :return: Decimal price, or None if the symbol is invalid
         """
-        return self.get_priceinfo_cached(symbol, thresh or 60)["price"]
+        priceinfo = self.get_priceinfo_cached(symbol, thresh or 60, stale)
+        return priceinfo["price"] if priceinfo else None
 
-    def get_priceinfo_cached(self, symbol, thresh):
+    def get_priceinfo_cached(self, symbol, thresh, stale=True):
         """
-        Return the cached symbol price if it's more recent than the last 15 minutes
-        Otherwise, fetch the price then cache and return it.
+        Return the cached symbol quote if it's at most $thresh seconds old. Otherwise, fetch the quote then cache and
+        return it. Numeric fields of the quote are Decimals. The quote returned is shared and must not be modified.
+        :param stale: see fetch_shared
+        :return: quote dict, or None if the symbol is invalid
         """
-        cached = self._get_cache_priceinfo(symbol, thresh)
-        if not cached:
-            cached = self.fetch_priceinfo(symbol)
-            if cached:
-                self._set_cache_priceinfo(symbol, cached)
+        cached = self.prices.get(symbol)
+        if cached and time() - cached[0] <= thresh:
+            return cached[1]
+        return self.fetch_shared(symbol, stale=stale)
 
-        numfields = set(['open', 'high', 'low', 'price', 'volume', 'change', 'previous close'])
-        return {k: Decimal(v) if k in numfields else v for k, v in cached.items()}
+    def fetch_shared(self, symbol, background=False, stale=True):
+        """
+        Fetch and cache a quote. Callers asking for a symbol that is already being fetched wait for that fetch rather
+        than starting their own. Background fetches leave *api_reserve* requests of the quota for trades.
+        :param stale: if the quota is used up, return the newest quote in memory however old it is. QuotaExceeded is
+                      then only raised for symbols that have never been quoted.
+        :return: quote dict, or None if the symbol is invalid
+        """
+        with self.fetching_lock:
+            pending = self.fetching.get(symbol)
+            if pending is not None:
+                owner = False
+            else:
+                owner = True
+                pending = self.fetching[symbol] = Future()
+        try:
+            if not owner:
+                return pending.result()
+            try:
+                if not self.quota.acquire(reserve=self.config.get("api_reserve", 1) if background else 0):
+                    raise QuotaExceeded("api quota used up, can't fetch {}".format(symbol))
+                data = self.fetch_priceinfo(symbol)
+                priceinfo = self._set_cache_priceinfo(symbol, data) if data else None
+                pending.set_result(priceinfo)
+                return priceinfo
+            except Exception as e:
+                pending.set_exception(e)
+                raise
+            finally:
+                with self.fetching_lock:
+                    del self.fetching[symbol]
+        except QuotaExceeded:
+            cached = self.prices.get(symbol)
+            if not stale or not cached:
+                raise
+            self.log.info("api quota used up, using the quote of {} from {:.0f}s ago"
+                          .format(symbol, time() - cached[0]))
+            return cached[1]
 
     def _set_cache_priceinfo(self, symbol, data):
+        now = time()
         with closing(self.sql.getCursor()) as c:
             c.execute("REPLACE INTO stockplay_prices VALUES (?, ?, ?)",
-                      (symbol, time(), json.dumps(data)))
-
-    def _get_cache_priceinfo(self, symbol, thresh):
-        with closing(self.sql.getCursor()) as c:
-            row = c.execute("SELECT * FROM stockplay_prices WHERE symbol=?",
-                            (symbol, )).fetchone()
-            if not row:
-                return
-            if time() - row["time"] > thresh:
-                return
-            return json.loads(row["data"])
+                      (symbol, now, json.dumps(data)))
+        priceinfo = decode_priceinfo(data)
+        self.prices[symbol] = (now, priceinfo)
+        with self.changes_lock:
+            self.changed_symbols.add(symbol)
+        return priceinfo
 
     def fetch_priceinfo(self, symbol):
         """
@@ -454,11 +630,11 @@ class StockPlay(ModuleBase):
         keys = set(['symbol', 'open', 'high', 'low', 'price', 'volume',
                     'latest trading day', 'previous close', 'change', 'change percent'])
         self.log.info("fetching api quote for symbol: {}".format(symbol))
-        data = get("https://www.alphavantage.co/query",
-                   params={"function": "GLOBAL_QUOTE",
-                           "symbol": symbol,
-                           "apikey": self.config["apikey"]},
-                   timeout=10).json()
+        data = self.http.get(self.config.get("api_url", APIURL),
+                             params={"function": "GLOBAL_QUOTE",
+                                     "symbol": symbol,
+                                     "apikey": self.config["apikey"]},
+                             timeout=10).json()
         data = data["Global Quote"]
         if not data:
             return None
@@ -534,12 +710,39 @@ class StockPlay(ModuleBase):
                                         else message.args[0],
                                         full)))
 
+    @info("top [<count>]", "show the players with the most valuable portfolios", cmds=["top"])
+    @command("top", allow_private=True)
+    def cmd_top(self, message, command):
+        """
+        Leaderboard command
+        """
+        dest = message.args[0] if message.args[0].startswith("#") else message.prefix.nick
+        count = 5
+        if command.args and command.args[0].isdigit():
+            count = max(1, min(int(command.args[0]), 10))
+        leaders = self.get_leaderboard(count)
+        if not leaders:
+            self.bot.act_PRIVMSG(dest, "{}: nobody is playing yet".format(message.prefix.nick))
+            return
+        rows = []
+        for row in leaders:
+            total = Decimal(row["cents"]) / 100
+            start = Decimal(row["day_cents"] if row["day_cents"] is not None else row["cents"]) / 100
+            rows.append(["{}.".format(row["rank"]),
+                         row["nick"],
+                         format_decimal(total),
+                         *format_gainloss_inner(total - start, calc_gain(start, total))])
+        for line in tabulate(rows, justify=[False, True, False, False, False]):
+            self.bot.act_PRIVMSG(dest, line, priority=5)
+
     def check_nick(self, nick):
         """
         Set up a user's account by setting the initial balance
         """
         if not self.nick_exists(nick):
             self.set_bal(nick, self.config["startbalance"] * 100)  # initial balance for user
+            with self.changes_lock:
+                self.changed_nicks.add(nick)
             # TODO welcome message
             # TODO maybe even some random free shares for funzies
 
@@ -580,13 +783,23 @@ class StockPlay(ModuleBase):
                           (nick, symbol, )).fetchone()
             return r["count"] if r else 0
 
-    def set_holding(self, nick, symbol, count):
+    def get_position(self, nick, symbol):
+        """
+        Return the number of stocks of a certain symbol a player has and the cents they've spent on them
+        """
+        assert symbol == symbol.upper()
+        with closing(self.sql.getCursor()) as c:
+            r = c.execute("SELECT * FROM stockplay_holdings WHERE nick=? AND symbol=?",
+                          (nick, symbol, )).fetchone()
+            return (r["count"], r["spent"]) if r else (0, 0)
+
+    def set_holding(self, nick, symbol, count, spent):
         """
-        Set the number of stocks of a certain symbol a player that
+        Set the number of stocks of a certain symbol a player that, and the cents spent on them
         """
         with closing(self.sql.getCursor()) as c:
-            c.execute("REPLACE INTO stockplay_holdings VALUES (?, ?, ?)",
-                      (nick, symbol, count, ))
+            c.execute("REPLACE INTO stockplay_holdings (nick, symbol, count, spent) VALUES (?, ?, ?, ?)",
+                      (nick, symbol, count, spent, ))
 
     def log_trade(self, nick, time, type, symbol, count, price):
         """
@@ -604,15 +817,145 @@ class StockPlay(ModuleBase):
             return c.execute("SELECT * FROM stockplay_balance_history WHERE nick=? ORDER BY DAY DESC LIMIT 1",
                              (nick, )).fetchone()
 
+    def _select_in(self, query, args, column, values):
+        """
+        Run a query once per chunk of values, restricted with ``column IN (...)``, staying under sqlite's limit on
+        query parameters
+        :return: list of all rows
+        """
+        values = sorted(values)
+        rows = []
+        with closing(self.sql.getCursor()) as c:
+            for i in range(0, len(values), 500):
+                chunk = values[i:i + 500]
+                rows += c.execute(query.format("{} IN ({})".format(column, ",".join(["?"] * len(chunk)))),
+                                  args + tuple(chunk)).fetchall()
+        return rows
+
+    def value_players(self, day=None, nicks=None, complete=False):
+        """
+        Calculate the total value, cash plus holdings, of every player at once. Holdings are valued at the newest quote
+        in memory no matter its age, so only symbols that have never been quoted are fetched. Holdings of delisted
+        symbols are valued at zero.
+
+        :param day: if set, only value players with no balance history recorded for this day
+        :param nicks: if set, only value these players
+        :param complete: leave out players holding symbols that can't be quoted right now, because the api quota is
+                         used up or the api failed. Otherwise these holdings are valued at zero.
+        :return: dict of nick -> value in cents
+        """
+        query = """SELECT b.nick, b.cents, h.symbol, h.count FROM stockplay_balances b
+                     LEFT JOIN stockplay_holdings h ON h.nick=b.nick AND h.count>0 WHERE 1"""
+        args = ()
+        if day:
+            query += " AND b.nick NOT IN (SELECT nick FROM stockplay_balance_history WHERE day=?)"
+            args = (day, )
+        query += " AND {}"
+        if nicks is None:
+            with closing(self.sql.getCursor()) as c:
+                rows = c.execute(query.format("1"), args).fetchall()
+        else:
+            rows = self._select_in(query, args, "b.nick", nicks)
+        prices = {}
+        unquoted = set()
+        for symbol in sorted(set(row["symbol"] for row in rows if row["symbol"])):
+            cached = self.prices.get(symbol)
+            if cached:
+                prices[symbol] = cached[1]["price"]
+                continue
+            try:
+                priceinfo = self.fetch_shared(symbol, background=True)
+            except QuotaExceeded:
+                self.log.info("value_players: api quota used up, can't value {}".format(symbol))
+                unquoted.add(symbol)
+                continue
+            except Exception:
+                self.log.exception("value_players: can't fetch {}".format(symbol))
+                unquoted.add(symbol)
+                continue
+            if priceinfo:
+                prices[symbol] = priceinfo["price"]
+            else:
+                self.log.info("value_players: invalid symbol {}, valuing it at zero".format(symbol))
+        totals = {}
+        incomplete = set()
+        for row in rows:
+            if row["nick"] not in totals:
+                totals[row["nick"]] = Decimal(row["cents"]) / 100
+            if row["symbol"] in prices:
+                totals[row["nick"]] += prices[row["symbol"]] * row["count"]
+            elif row["symbol"] in unquoted:
+                incomplete.add(row["nick"])
+        if complete:
+            for nick in incomplete:
+                del totals[nick]
+        return {nick: int(total * 100) for nick, total in totals.items()}
+
     def record_nightly_balances(self):
         """
-        Create a record for each user's balance at the start of each day.
+        Create a record for each user's balance at the start of each day. Players holding symbols that can't be quoted
+        right now are left for a later run, as a recorded balance is never corrected.
         """
         now = (datetime.now() + timedelta(seconds=self.config.get("midnight_offset", 0))).strftime("%Y-%m-%d")
+        totals = self.value_players(day=now, complete=True)
+        if not totals:
+            return
+        self.log.info("Recording {} daily balance for {} players".format(now, len(totals)))
+        with self.transaction() as c:
+            c.executemany("INSERT OR IGNORE INTO stockplay_balance_history VALUES (?, ?, ?)",
+                          ((nick, now, total) for nick, total in totals.items()))
+            # the values just recorded are also the players' current values
+            c.executemany("REPLACE INTO stockplay_leaderboard VALUES (?, ?, ?)",
+                          ((nick, total, total) for nick, total in totals.items() if nick != DUSTACCT))
+
+    def update_leaderboard(self):
+        """
+        Keep every player's current value in the stockplay_leaderboard table, along with their value at the start of
+        the day. The first update values every player. Later updates only value the players who traded or hold a
+        symbol requoted since the last one.
+        """
+        with self.changes_lock:
+            nicks, symbols = self.changed_nicks, self.changed_symbols
+            self.changed_nicks, self.changed_symbols = set(), set()
+            full = not self.leaderboard_built
+            self.leaderboard_built = True
+        try:
+            day_start_query = """SELECT nick, cents FROM stockplay_balance_history h WHERE {} AND day=
+                                   (SELECT MAX(day) FROM stockplay_balance_history WHERE nick=h.nick)"""
+            if full:
+                totals = self.value_players()
+                with closing(self.sql.getCursor()) as c:
+                    day_start_rows = c.execute(day_start_query.format("1")).fetchall()
+            else:
+                if symbols:
+                    nicks |= set(row["nick"] for row in
+                                 self._select_in("SELECT DISTINCT nick FROM stockplay_holdings WHERE count>0 AND {}",
+                                                 (), "symbol", symbols))
+                nicks.discard(DUSTACCT)
+                if not nicks:
+                    return
+                totals = self.value_players(nicks=nicks)
+                day_start_rows = self._select_in(day_start_query, (), "nick", nicks)
+            totals.pop(DUSTACCT, None)
+            day_start = {row["nick"]: row["cents"] for row in day_start_rows}
+            with self.transaction() as c:
+                if full:
+                    c.execute("DELETE FROM stockplay_leaderboard")
+                c.executemany("REPLACE INTO stockplay_leaderboard VALUES (?, ?, ?)",
+                              ((nick, total, day_start.get(nick)) for nick, total in totals.items()))
+        except Exception:
+            with self.changes_lock:  # try again next time
+                self.changed_nicks |= nicks
+                self.changed_symbols |= symbols
+                if full:
+                    self.leaderboard_built = False
+            raise
+
+    def get_leaderboard(self, count):
+        """
+        Return the top $count rows of the leaderboard, with their rank
+        """
         with closing(self.sql.getCursor()) as c:
-            for row in c.execute("""SELECT * FROM stockplay_balances WHERE nick NOT IN
-                                 (SELECT nick FROM stockplay_balance_history WHERE day=?)""", (now, )).fetchall():
-                data = self.build_report(row["nick"])
-                total = int((data["cash"] + data["holding_value"]) * 100)
-                self.log.info("Recording {} daily balance for {}".format(now, row["nick"]))
-                c.execute("INSERT INTO stockplay_balance_history VALUES (?, ?, ?)", (row["nick"], now, total))
+            return c.execute("""SELECT ROW_NUMBER() OVER (ORDER BY cents DESC, nick) AS rank, nick, cents, day_cents
+                                FROM (SELECT * FROM stockplay_leaderboard ORDER BY cents DESC, nick LIMIT ?)""",
+                             (count, )).fetchall()
@@ -32,19 +32,47 @@ class Tell(ModuleBase):
             `channel` varchar(64),
             `when` INTEGER,
             `recip` varchar(64),
+            `recip_key` varchar(64),
             `message` varchar(2048)
             ) ;""").close()
+        elif "recip_key" not in [col["name"] for col in self.db.query("PRAGMA table_info(`tells`)").fetchall()]:
+            self.log.info("Tell: Adding column: tells.recip_key")
+            self.db.query("ALTER TABLE `tells` ADD COLUMN `recip_key` varchar(64)").close()
+            c = self.db.query("SELECT `id`, `recip` FROM `tells`")
+            keys = [(row["recip"].lower(), row["id"]) for row in c.fetchall()]
+            c.close()
+            c = self.db.getCursor()
+            c.executemany("UPDATE `tells` SET `recip_key`=? WHERE `id`=?", keys)
+            c.close()
+
+        # recip_key is the recipient lowercased by python, which unlike sqlite's lower() handles non-ascii nicks
+        self.db.query("DROP INDEX IF EXISTS `tells_recip`").close()
+        self.db.query("CREATE INDEX IF NOT EXISTS `tells_recip_key` ON `tells` (`recip_key`)").close()
 
         # Purge expired tells
         self.db.query("DELETE FROM `tells` WHERE `when`<?",
                       (int(mktime(datetime.datetime.now().timetuple())) - self.config["maxage"],)).close()
 
+        # Lowercased nicks that have tells waiting. Nearly every message is from someone not in here, which saves a
+        # query for each.
+        c = self.db.query("SELECT DISTINCT `recip_key` FROM `tells`")
+        self.pending = set(row["recip_key"] for row in c.fetchall())
+        c.close()
+
     @hook("PRIVMSG", "JOIN")
     def showtell(self, msg, cmd):
+        nick = msg.prefix.nick.lower()
+        if nick not in self.pending:
+            return
+        self.pending.discard(nick)
         # Look for tells for this person
-        c = self.db.query("SELECT * FROM `tells` WHERE `recip`=?", (msg.prefix.nick,))
+        c = self.db.query("SELECT * FROM `tells` WHERE `recip_key`=?", (nick,))
         tells = c.fetchall()
         c.close()
+        if tells:
+            # deleted right away, a new .tell puts the nick back in self.pending and these mustn't be found again
+            self.db.query("DELETE FROM `tells` WHERE `id` IN ({})".format(",".join(["?"] * len(tells))),
+                          tuple(tell["id"] for tell in tells)).close()
         for tell in tells:
             agostr = Tell.timesince(datetime.datetime.fromtimestamp(tell["when"]))
             recip = None
@@ -58,8 +86,6 @@ class Tell(ModuleBase):
                 agostr,
                 tell["message"]
             ))
-            # Delete
-            self.db.query("DELETE FROM `tells` WHERE `id`=?", (tell["id"],))
 
     @info("tell <person> <message>", "relay a message when the target is online", cmds=["tell"])
     @command("tell", allow_private=True)
@@ -72,22 +98,27 @@ class Tell(ModuleBase):
         recip = cmd.args[0]
         message = ' '.join(cmd.args[1:]).strip()
 
-        c = self.db.query("SELECT COUNT(*) as `cnt` FROM `tells` WHERE `recip`=?;", (recip, ))
+        c = self.db.query("SELECT COUNT(*) as `cnt` FROM `tells` WHERE `recip_key`=?;", (recip.lower(), ))
         user_total = c.fetchall()[0]['cnt']
         c.close()
 
         if user_total >= self.config.get("max", 3):
             return
 
-        self.db.query("INSERT INTO `tells` (`sender`, `channel`, `when`, `recip`, `message`) VALUES "
-                      "(?, ?, ?, ?, ?);", (msg.prefix.nick,
-                                           msg.args[0] if "#" in msg.args[0] else "",
-                                           int(mktime(datetime.datetime.now().timetuple())),
-                                           recip,
-                                           message)).close()
+        self.db.query("INSERT INTO `tells` (`sender`, `channel`, `when`, `recip`, `recip_key`, `message`) VALUES "
+                      "(?, ?, ?, ?, ?, ?);", (msg.prefix.nick,
+                                              msg.args[0] if "#" in msg.args[0] else "",
+                                              int(mktime(datetime.datetime.now().timetuple())),
+                                              recip,
+                                              recip.lower(),
+                                              message)).close()
+        self.pending.add(recip.lower())
 
         self.bot.act_PRIVMSG(msg.args[0], "%s: I'll pass that along." % msg.prefix.nick)
 
+    def ondisable(self):
+        self.db.close()
+
     # Copyright (c) Django Software Foundation and individual contributors.
     # All rights reserved.
     #
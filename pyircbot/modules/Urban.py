@@ -7,18 +7,22 @@
 
 """
 
-from pyircbot.modulebase import ModuleBase, command
-import requests
+from pyircbot.modulebase import ModuleBase, MissingDependancyException, command
 from pyircbot.modules.ModInfo import info
 
 
 class Urban(ModuleBase):
+    def __init__(self, bot, moduleName):
+        ModuleBase.__init__(self, bot, moduleName)
+        self.http = self.bot.getBestModuleForService("http")
+        if self.http is None:
+            raise MissingDependancyException("Urban: HTTP service is required.")
 
     @info("urban <term>", "lookup an urban dictionary definition", cmds=["urban", "u"])
     @command("urban", "u")
     def urban(self, msg, cmd):
-        definitions = requests.get("http://www.urbandictionary.com/iphone/search/define",
-                                   params={"term": cmd.args_str}).json()["list"]
+        definitions = self.http.get("http://www.urbandictionary.com/iphone/search/define",
+                                    params={"term": cmd.args_str}).json()["list"]
         if len(definitions) == 0:
             self.bot.act_PRIVMSG(msg.args[0], "Urban definition: no results!")
         else:
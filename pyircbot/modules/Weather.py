@@ -7,9 +7,12 @@
 
 """
 
-from pyircbot.modulebase import ModuleBase, command
-from requests import get
+from pyircbot.modulebase import ModuleBase, MissingDependancyException, command
 from pyircbot.modules.ModInfo import info
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Event, Lock, Thread
+from time import time
 
 
 class Weather(ModuleBase):
@@ -18,6 +21,18 @@ class Weather(ModuleBase):
 
         assert "get an API key" not in self.config["apikey"]
 
+        self.http = self.bot.getBestModuleForService("http")
+        if self.http is None:
+            raise MissingDependancyException("Weather: HTTP service is required.")
+
+        # normalized location -> ForecastEntry, least recently used first
+        self.cache = OrderedDict()
+        self.cache_lock = Lock()
+        self.inflight = {}  # normalized location -> Future of the forecast data
+        self.disabled = Event()
+        self.refresher = Thread(target=self.refresh_thread, daemon=True)
+        self.refresher.start()
+
         self.login = self.bot.getBestModuleForService("login")
         try:
             assert self.login is not None
@@ -32,10 +47,15 @@ class Weather(ModuleBase):
             self.log.error("Weather: An 'attributes' service is required")
             return
 
+    def ondisable(self):
+        self.disabled.set()
+        self.refresher.join()
+
     @info("weather [location]", "display the forecast", cmds=["weather", "w"])
     @command("weather", "w")
     def cmd_weather(self, msg, cmd):
-        hasUnit = self.attr.get(msg.prefix.nick, "weather-unit")
+        prefs = self.attr.getKeys(msg.prefix.nick, ["weather-unit", "weather-zip"])
+        hasUnit = prefs["weather-unit"]
         if hasUnit:
             hasUnit = hasUnit.upper()
 
@@ -43,7 +63,7 @@ class Weather(ModuleBase):
             self.send_weather(msg.args[0], msg.prefix.nick, cmd.args_str, hasUnit)
             return
 
-        weatherZip = self.attr.get(msg.prefix.nick, "weather-zip")
+        weatherZip = prefs["weather-zip"]
         if weatherZip is None:
             self.bot.act_PRIVMSG(msg.args[0], "%s: you must set a location with .setloc" % (msg.prefix.nick,))
             return
@@ -117,18 +137,95 @@ class Weather(ModuleBase):
             pieces.append(', '.join(item_pieces))
         return ' -- '.join(pieces)
 
-    def getWeather(self, zipcode, unit=None):
-        if unit is None:
-            unit = self.config["defaultUnit"]
-        unit = unit.lower()
-        # Get data
-        data = get("http://api.wunderground.com/api/%s/geolookup/conditions/forecast10day/q/%s.json" %
-                   (self.config["apikey"], zipcode)).json()
+    def getForecast(self, location):
+        """
+        Return the forecast data for a location. Forecasts are cached for ``cache_ttl`` seconds. After that, for up to
+        ``stale_ttl`` seconds, the old forecast is returned while a new one is fetched in the background. Concurrent
+        requests for the same location share one fetch.
+        """
+        key = normalize_location(location)
+        now = time()
+        with self.cache_lock:
+            entry = self.cache.get(key)
+            if entry is not None and now - entry.fetched < self.config.get("stale_ttl", 3600):
+                self.cache.move_to_end(key)
+                entry.uses += 1
+                if now - entry.fetched >= self.config.get("cache_ttl", 600) and key not in self.inflight:
+                    Thread(target=self.refresh_quietly, args=(key, location), daemon=True).start()
+                return entry.data
+        return self.refresh(key, location)
+
+    def refresh(self, key, location):
+        """
+        Fetch a location's forecast into the cache, or wait for the fetch already in progress
+        """
+        with self.cache_lock:
+            pending = self.inflight.get(key)
+            owner = pending is None
+            if owner:
+                pending = self.inflight[key] = Future()
+        if not owner:
+            return pending.result()
+
+        try:
+            data = self.fetchForecast(location)
+            with self.cache_lock:
+                entry = self.cache.get(key)
+                self.cache[key] = ForecastEntry(location, data, entry.uses if entry else 1)
+                self.cache.move_to_end(key)
+                while len(self.cache) > self.config.get("cache_size", 256):
+                    self.cache.popitem(last=False)
+            pending.set_result(data)
+            return data
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self.cache_lock:
+                del self.inflight[key]
+
+    def refresh_thread(self):
+        """
+        Keep popular locations fresh. Every ``refresh_interval`` seconds, locations asked for at least
+        ``popular_uses`` times since the last check are refetched if they'd go stale before the next check.
+        """
+        interval = self.config.get("refresh_interval", 300)
+        while not self.disabled.wait(interval):
+            now = time()
+            with self.cache_lock:
+                due = []
+                for key, entry in self.cache.items():
+                    if entry.uses >= self.config.get("popular_uses", 3) and \
+                            now + interval - entry.fetched >= self.config.get("cache_ttl", 600):
+                        due.append((key, entry.location))
+                    entry.uses = 0
+            for key, location in due:
+                if self.disabled.is_set():
+                    break
+                self.refresh_quietly(key, location)
+
+    def refresh_quietly(self, key, location):
+        try:
+            self.refresh(key, location)
+        except Exception:
+            self.log.exception("could not refresh forecast for %s", location)
+
+    def fetchForecast(self, location):
+        data = self.http.get("http://api.wunderground.com/api/%s/geolookup/conditions/forecast10day/q/%s.json" %
+                             (self.config["apikey"], location)).json()
 
         if "results" in data["response"]:
             raise LocationNotSpecificException(data["response"]["results"])
         if "error" in data["response"] and data["response"]["error"]["type"] == "querynotfound":
             raise LocationException
+        return data
+
+    def getWeather(self, zipcode, unit=None):
+        if unit is None:
+            unit = self.config["defaultUnit"]
+        unit = unit.lower()
+        # Get data
+        data = self.getForecast(zipcode)
 
         # Build 5day
         fiveday = ""
@@ -206,6 +303,29 @@ class Weather(ModuleBase):
             return "⇗"
 
 
+class ForecastEntry(object):
+    """
+    A cached forecast
+
+    :param location: the location as it was first asked for
+    :param data: forecast data from the api
+    :param uses: times the forecast was asked for since the last refresh check
+    """
+    def __init__(self, location, data, uses):
+        self.location = location
+        self.data = data
+        self.fetched = time()
+        self.uses = uses
+
+
+def normalize_location(location):
+    """
+    Normalize a location so different spellings of one share a cache entry: lowercased, with whitespace collapsed and
+    none around commas
+    """
+    return ",".join(" ".join(part.split()) for part in location.lower().split(","))
+
+
 class LocationException(Exception):
     pass
 
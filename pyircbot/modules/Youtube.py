@@ -7,10 +7,9 @@
 
 """
 
-from pyircbot.modulebase import ModuleBase, command
+from pyircbot.modulebase import ModuleBase, MissingDependancyException, command
 from pyircbot.modules.ModInfo import info
 from random import shuffle
-from requests import get
 import time
 import re
 
@@ -18,6 +17,12 @@ import re
 class Youtube(ModuleBase):
     def __init__(self, bot, moduleName):
         ModuleBase.__init__(self, bot, moduleName)
+        self.http = self.bot.getBestModuleForService("http")
+        if self.http is None:
+            raise MissingDependancyException("Youtube: HTTP service is required.")
+        self.info = self.bot.getBestModuleForService("youtubeinfo")
+        if self.info is None:
+            raise MissingDependancyException("Youtube: YoutubeInfo service is required.")
 
     def getISOdurationseconds(self, stamp):
         ISO_8601_period_rx = re.compile(
@@ -37,13 +42,13 @@ class Youtube(ModuleBase):
     @info("yt", "search for youtube videos", cmds=["yt", "youtube"])
     @command("yt", "youtube")
     def youtube(self, msg, cmd):
-        j = get("https://www.googleapis.com/youtube/v3/search",
-                params={"key": self.config["api_key"],
-                        "part": "snippet",
-                        "type": "video",
-                        "maxResults": "25",
-                        "safeSearch": self.config.get("safe_search", "none"),
-                        "q": cmd.args_str}).json()
+        j = self.http.get("https://www.googleapis.com/youtube/v3/search",
+                          params={"key": self.config["api_key"],
+                                  "part": "snippet",
+                                  "type": "video",
+                                  "maxResults": "25",
+                                  "safeSearch": self.config.get("safe_search", "none"),
+                                  "q": cmd.args_str}).json()
 
         if 'error' in j or len(j["items"]) == 0:
             self.bot.act_PRIVMSG(msg.args[0], "No results found.")
@@ -54,13 +59,10 @@ class Youtube(ModuleBase):
                                                                                 self.get_video_description(vid_id)))
 
     def get_video_description(self, vid_id):
-        apidata = get('https://www.googleapis.com/youtube/v3/videos?part=snippet,contentDetails,statistics&id=%s'
-                      '&key=%s' % (vid_id, self.config["api_key"])).json()
-
-        if not apidata['pageInfo']['totalResults']:
+        video = self.info.video(vid_id)
+        if video is None:
             return
 
-        video = apidata['items'][0]
         snippet = video["snippet"]
         duration = self.getISOdurationseconds(video["contentDetails"]["duration"])
 
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+.. module:: YoutubeInfo
+    :synopsis: Module providing a shared, batched youtube video info service
+
+"""
+
+from pyircbot.modulebase import ModuleBase, MissingDependancyException
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock, Timer
+from time import time
+
+
+APIURL = "https://www.googleapis.com/youtube/v3/videos"
+# Most ids the videos api accepts in one call
+BATCH_SIZE = 50
+
+
+class YoutubeInfo(ModuleBase):
+    """
+    Looks up youtube videos for other modules. Ids asked for within ``batch_window`` seconds of each other (default
+    0.2), from any thread, are looked up together in one api call of up to 50 ids. Videos found, and ids that turned out
+    not to exist, are cached for ``cache_ttl`` seconds (default 3600).
+
+    Videos are the api's ``items`` entries, with the snippet, contentDetails and statistics parts.
+    """
+    def __init__(self, bot, moduleName):
+        ModuleBase.__init__(self, bot, moduleName)
+        self.services = ["youtubeinfo"]
+        self.http = self.bot.getBestModuleForService("http")
+        if self.http is None:
+            raise MissingDependancyException("YoutubeInfo: HTTP service is required.")
+        self.api_url = self.config.get("api_url", APIURL)
+        self.batch_window = self.config.get("batch_window", 0.2)
+        self.cache_ttl = self.config.get("cache_ttl", 3600)
+        self.cache_size = self.config.get("cache_size", 1024)
+        self.cache = OrderedDict()  # id -> (expires, video or None), least recently used first
+        self.pending = OrderedDict()  # id -> Future of the video, waiting for the next batch
+        self.timer = None
+        self.lock = Lock()
+        self.calls = 0
+
+    def ondisable(self):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+        self.flush()
+
+    def video(self, vid_id):
+        """
+        Look up one video
+
+        :param vid_id: youtube video id
+        :type vid_id: str
+        :returns: dict -- the video, or None if there's no such video
+        """
+        return self.videos([vid_id])[vid_id]
+
+    def videos(self, vid_ids):
+        """
+        Look up several videos. Ids not in the cache are added to the next batch, and this waits for it.
+
+        :param vid_ids: youtube video ids
+        :type vid_ids: list
+        :returns: dict -- id -> the video, or None if there's no such video
+        """
+        result = {}
+        waiting = {}
+        full = False
+        now = time()
+        with self.lock:
+            for vid_id in vid_ids:
+                entry = self.cache.get(vid_id)
+                if entry is not None and entry[0] > now:
+                    self.cache.move_to_end(vid_id)
+                    result[vid_id] = entry[1]
+                    continue
+                if vid_id not in self.pending:
+                    self.pending[vid_id] = Future()
+                waiting[vid_id] = self.pending[vid_id]
+            if self.pending:
+                full = len(self.pending) >= BATCH_SIZE
+                if not full and self.timer is None:
+                    self.timer = Timer(self.batch_window, self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+        if full:
+            self.flush()
+        for vid_id, future in waiting.items():
+            result[vid_id] = future.result()
+        return result
+
+    def flush(self):
+        """
+        Look up every id waiting for a batch now
+        """
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            pending = self.pending
+            self.pending = OrderedDict()
+        ids = list(pending.keys())
+        for i in range(0, len(ids), BATCH_SIZE):
+            batch = ids[i:i + BATCH_SIZE]
+            try:
+                found = self.fetch(batch)
+            except Exception as e:
+                self.log.error("youtube lookup failed: %s", e)
+                for vid_id in batch:
+                    pending[vid_id].set_exception(e)
+                continue
+            expires = time() + self.cache_ttl
+            with self.lock:
+                for vid_id in batch:
+                    self.cache[vid_id] = (expires, found.get(vid_id))
+                    self.cache.move_to_end(vid_id)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            for vid_id in batch:
+                pending[vid_id].set_result(found.get(vid_id))
+
+    def fetch(self, vid_ids):
+        """
+        Call the videos api for up to 50 ids
+
+        :returns: dict -- id -> video, for the ids that exist
+        """
+        self.calls += 1
+        data = self.http.get(self.api_url,
+                             params={"part": "snippet,contentDetails,statistics",
+                                     "id": ",".join(vid_ids),
+                                     "maxResults": BATCH_SIZE,
+                                     "key": self.config["api_key"]}).json()
+        if "error" in data:
+            raise Exception(data["error"].get("message", "api error"))
+        return {item["id"]: item for item in data.get("items", [])}
@@ -6,9 +6,12 @@
 
 """
 
+import re
 import logging
 from pyircbot import jsonrpc
-from threading import Thread
+from threading import Thread, Lock, Condition
+from collections import deque
+from time import time
 
 
 class BotRPC(Thread):
@@ -26,8 +29,13 @@ class BotRPC(Thread):
                 addr=(
                     self.bot.botconfig["bot"]["rpcbind"],
                     self.bot.botconfig["bot"]["rpcport"]
-                )
-            )
+                ),
+                threads=self.bot.botconfig["bot"].get("rpcthreads", 4),
+                max_connections=self.bot.botconfig["bot"].get("rpcmaxconns", 64),
+                conn_timeout=self.bot.botconfig["bot"].get("rpctimeout", 10.0)
+            ),
+            batch_threads=self.bot.botconfig["bot"].get("rpcbatchthreads"),
+            max_streams=self.bot.botconfig["bot"].get("rpcmaxstreams", 16)
         )
 
         self.server.register_function(self.importModule)
@@ -43,6 +51,11 @@ class BotRPC(Thread):
         self.server.register_function(self.quit)
         self.server.register_function(self.eval)
         self.server.register_function(self.exec)
+        self.server.register_function(self.streamEvents)
+
+        self.subscribers = []
+        """Active event subscriptions. Replaced, never modified, so the IRC thread can iterate it without locking"""
+        self.subscribers_lock = Lock()
 
         self.start()
 
@@ -181,3 +194,136 @@ class BotRPC(Thread):
         self.bot.kill(message=message)
         return (True, "Shutdown ordered")
 
+    def streamEvents(self, commands=None, channels=None, regex=None, buffer_size=1000, heartbeat=15.0):
+        """Stream IRC events to the client. This is a streaming method: the reply contains the subscription's settings,
+        then an ``event`` notification is sent for every matching IRC event, and a ``heartbeat`` notification when no
+        event arrived for `heartbeat` seconds. :py:func:`pyircbot.rpcclient.subscribe` consumes such a stream.
+
+        Each subscriber has its own buffer of `buffer_size` events. If the client can't keep up, the oldest events are
+        dropped. Notifications carry a ``dropped`` counter of the events lost so far.
+
+        :param commands: only stream these IRC commands, like PRIVMSG or JOIN. Default all
+        :type commands: list
+        :param channels: only stream events whose target is one of these channels. Default all
+        :type channels: list
+        :param regex: only stream events whose trailing data matches this regular expression
+        :type regex: str
+        :param buffer_size: number of events buffered for the client
+        :type buffer_size: int
+        :param heartbeat: seconds between heartbeats of an idle stream
+        :type heartbeat: float"""
+        try:
+            sub = EventSubscription(commands, channels, regex, buffer_size)
+        except (re.error, TypeError, ValueError) as e:
+            raise jsonrpc.RPCInvalidParamValues(str(e))
+        self.log.info("RPC: streaming events (commands=%s channels=%s regex=%s)" % (commands, channels, regex))
+        return self._stream(sub, heartbeat)
+
+    def _stream(self, sub, heartbeat):
+        self._subscribe(sub)
+        try:
+            yield {"commands": sub.commands and sorted(sub.commands),
+                   "channels": sub.channels and sorted(sub.channels),
+                   "regex": sub.regex and sub.regex.pattern,
+                   "buffer_size": sub.events.maxlen}
+            while True:
+                events = sub.get(heartbeat)
+                if not events:
+                    yield ("heartbeat", {"dropped": sub.dropped})
+                for event in events:
+                    yield ("event", event)
+        finally:
+            self._unsubscribe(sub)
+
+    def _subscribe(self, sub):
+        with self.subscribers_lock:
+            if not self.subscribers:
+                self.bot.loop.call_soon_threadsafe(self.bot.irc.addHook, "_ALL", self._irchook_stream)
+            self.subscribers = self.subscribers + [sub]
+
+    def _unsubscribe(self, sub):
+        with self.subscribers_lock:
+            self.subscribers = [i for i in self.subscribers if i is not sub]
+            if not self.subscribers:
+                self.bot.loop.call_soon_threadsafe(self.bot.irc.removeHook, "_ALL", self._irchook_stream)
+
+    def _irchook_stream(self, msg):
+        """IRC hook handler feeding event subscriptions. Only hooked while there are subscribers."""
+        for sub in self.subscribers:
+            sub.offer(msg)
+
+
+class EventSubscription(object):
+    """
+    Filter and buffer of IRC events for one :py:meth:`BotRPC.streamEvents` client.
+
+    :param commands: IRC commands to accept, None for all
+    :type commands: list
+    :param channels: channels to accept, None for all
+    :type channels: list
+    :param regex: regular expression the trailing data must match, None for any
+    :type regex: str
+    :param buffer_size: number of events to buffer before the oldest are dropped
+    :type buffer_size: int
+    """
+    def __init__(self, commands=None, channels=None, regex=None, buffer_size=1000):
+        if int(buffer_size) < 1:
+            raise ValueError("buffer_size must be positive")
+        self.commands = {c.upper() for c in commands} if commands else None
+        self.channels = {c.lower() for c in channels} if channels else None
+        self.regex = re.compile(regex) if regex else None
+        self.events = deque(maxlen=int(buffer_size))
+        self.dropped = 0
+        self.cond = Condition()
+
+    def match(self, msg):
+        """
+        Test an event against the filters
+
+        :param msg: the event
+        :type msg: pyircbot.irccore.IRCEvent
+        """
+        if self.commands is None:
+            if msg.command.startswith("_"):  # internal pseudo-events
+                return False
+        elif msg.command not in self.commands:
+            return False
+        if self.channels is not None and (not msg.args or msg.args[0].lower() not in self.channels):
+            return False
+        if self.regex is not None and (msg.trailing is None or not self.regex.search(msg.trailing)):
+            return False
+        return True
+
+    def offer(self, msg):
+        """
+        Buffer an event if it matches the filters
+
+        :param msg: the event
+        :type msg: pyircbot.irccore.IRCEvent
+        """
+        if not self.match(msg):
+            return
+        with self.cond:
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1
+            self.events.append({"command": msg.command,
+                                "args": msg.args,
+                                "prefix": msg.prefix,
+                                "trailing": msg.trailing,
+                                "time": time(),
+                                "dropped": self.dropped})
+            self.cond.notify()
+
+    def get(self, timeout):
+        """
+        Wait for events and take them from the buffer
+
+        :param timeout: seconds to wait
+        :returns: list -- the buffered events, empty if none arrived before the timeout
+        """
+        with self.cond:
+            if not self.events:
+                self.cond.wait(timeout)
+            events = list(self.events)
+            self.events.clear()
+        return events
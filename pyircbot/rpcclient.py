@@ -2,8 +2,38 @@ from sys import argv, exit
 from pyircbot import jsonrpc
 
 
-def connect(host, port):
-    return jsonrpc.ServerProxy(jsonrpc.JsonRpc20(), jsonrpc.TransportTcpIp(addr=(host, port), timeout=60.0))
+def connect(host, port, pool_size=4):
+    """
+    Create an RPC client. Connections to the bot are kept open and shared by the threads using the client.
+
+    :param pool_size: number of idle connections to keep open
+    """
+    return jsonrpc.ServerProxy(jsonrpc.JsonRpc20(),
+                               jsonrpc.TransportPool(lambda: jsonrpc.TransportTcpIp(addr=(host, port), timeout=60.0),
+                                                     pool_size))
+
+
+def subscribe(host, port, commands=None, channels=None, regex=None, buffer_size=1000, heartbeat=15.0):
+    """
+    Stream IRC events from the bot. Yields a dict for each event, with the keys "command", "args", "prefix",
+    "trailing", "time" and "dropped", the number of events the bot dropped because the client didn't keep up. See
+    :py:meth:`pyircbot.rpc.BotRPC.streamEvents` for the filter parameters.
+    """
+    serializer = jsonrpc.JsonRpc20()
+    transport = jsonrpc.TransportTcpIp(addr=(host, port), timeout=heartbeat * 4)
+    try:
+        transport.send(serializer.dumps_request("streamEvents", {"commands": commands,
+                                                                 "channels": channels,
+                                                                 "regex": regex,
+                                                                 "buffer_size": buffer_size,
+                                                                 "heartbeat": heartbeat}))
+        serializer.loads_response(transport.recv())
+        while True:
+            method, params = serializer.loads_request(transport.recv())[0:2]
+            if method == "event":
+                yield params
+    finally:
+        transport.close()
 
 
 if __name__ == "__main__":
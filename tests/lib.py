@@ -1,6 +1,8 @@
 import os
 import sys
+import asyncio
 import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from threading import Thread
 from random import randint
 from pyircbot import PyIRCBot
@@ -22,6 +24,9 @@ class FakeBaseBot(PrimitiveBot):
         super().__init__(config)
         self.act_PRIVMSG = MagicMock()
         self._modules = []
+        # like PyIRCBot.loop, but running in its own thread
+        self.loop = asyncio.new_event_loop()
+        Thread(target=self.loop.run_forever, daemon=True).start()
 
     def feed_line(self, trailing, cmd="PRIVMSG", args=["#test"], sender=("chatter", "root", "cia.gov")):
         """
@@ -39,8 +44,9 @@ class FakeBaseBot(PrimitiveBot):
                     hook.method(msg, validation)
 
     def closeAllModules(self):
-        for modname in self._modules:
+        for modname in list(self._modules):
             self.unloadmodule(modname)
+        self.loop.call_soon_threadsafe(self.loop.stop)
 
     def loadmodule(self, module_name):
         super().loadmodule(module_name)
@@ -100,6 +106,49 @@ def ircserver():
     server.stop()
 
 
+class WebHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the httpd fixture. Passes each GET request to the server's ``handle`` function.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.handle(self)
+
+    def reply(self, body, content_type=None, status=200, headers={}):
+        """
+        Send a complete response
+        """
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def httpd():
+    """
+    Fixture providing a local http server, for faking web apis. Set ``server.handle`` to a function answering the GET
+    requests, it's passed the :py:class:`WebHandler` of each. ``server.url`` is the server's base url.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), WebHandler)
+    server.handle = lambda request: request.send_error(404)
+    server.url = "http://127.0.0.1:{}".format(server.server_port)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
 @pytest.fixture
 def livebot(ircserver, tmpdir):
     """
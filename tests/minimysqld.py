@@ -0,0 +1,223 @@
+"""
+A small stand-in for a MySQL server, for tests. It speaks enough of the MySQL client/server protocol for pymysql to
+connect, ping and run text queries. Queries are run on an in-memory sqlite database after rewriting the bits of MySQL
+syntax that pyircbot's modules use. Any username and password are accepted.
+"""
+
+import os
+import re
+import socket
+import sqlite3
+import struct
+from threading import Lock, Thread
+
+
+CAPABILITIES = 0x1 | 0x2 | 0x4 | 0x8 | 0x200 | 0x2000 | 0x8000 | 0x20000 | 0x80000
+STATUS = 0x0002 | 0x0200  # autocommit, no backslash escapes - so quoting is the same as sqlite's
+
+COM_QUIT = 0x01
+COM_INIT_DB = 0x02
+COM_QUERY = 0x03
+COM_PING = 0x0e
+
+TYPE_DOUBLE = 0x05
+TYPE_LONGLONG = 0x08
+TYPE_VAR_STRING = 0xfd
+
+REWRITES = [(re.compile(pattern, re.I | re.S), replacement) for pattern, replacement in (
+    (r"\bint\(\d+\)", "INTEGER"),
+    (r"\bAUTO_INCREMENT\b", ""),
+    (r"^INSERT IGNORE\b", "INSERT OR IGNORE"),
+    (r"\bCHARACTER SET \w+", ""),
+    (r"\bUNIQUE KEY `\w+` \(", "UNIQUE ("),
+    (r"\)\s*ENGINE=[^;]*", ")"),
+    (r"\bON DUPLICATE KEY UPDATE\b", "ON CONFLICT DO UPDATE SET"),
+    (r"\bVALUES\((`\w+`)\)", r"excluded.\1"),
+)]
+
+
+def lenenc_int(i):
+    if i < 251:
+        return struct.pack("<B", i)
+    elif i < 2 ** 16:
+        return b"\xfc" + struct.pack("<H", i)
+    elif i < 2 ** 24:
+        return b"\xfd" + struct.pack("<I", i)[:3]
+    return b"\xfe" + struct.pack("<Q", i)
+
+
+def lenenc_str(s):
+    if isinstance(s, str):
+        s = s.encode("UTF-8")
+    return lenenc_int(len(s)) + s
+
+
+class MySQLError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class Server(object):
+    """
+    :param port: port to listen on, 0 picks a free one. The chosen port is in ``self.port``.
+    """
+    def __init__(self, port=0):
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", port))
+        self.sock.listen(16)
+        self.port = self.sock.getsockname()[1]
+        self.db = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+        self.dblock = Lock()
+        self.databases = {"information_schema"}
+        self.clients = []
+        self.accepted = 0
+        self.pings = 0
+        self.queries = []
+        self.running = True
+        Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while self.running:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            self.accepted += 1
+            self.clients.append(client)
+            Thread(target=self.handle, args=(client, self.accepted), daemon=True).start()
+
+    def drop_clients(self):
+        """
+        Disconnect every client, like a server restart or an expired wait_timeout would
+        """
+        for client in self.clients:
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            client.close()
+        self.clients = []
+
+    def close(self):
+        self.running = False
+        self.sock.close()
+        self.drop_clients()
+
+    def handle(self, client, connid):
+        try:
+            salt = os.urandom(20).replace(b"\0", b"\1")
+            self.send(client, 0, b"\x0a" + b"5.7.0-minimysqld\0" + struct.pack("<I", connid) + salt[:8] + b"\0" +
+                      struct.pack("<HBHHB", CAPABILITIES & 0xffff, 33, STATUS, CAPABILITIES >> 16, 21) +
+                      b"\0" * 10 + salt[8:] + b"\0" + b"mysql_native_password\0")
+            self.recv(client)  # handshake response, any credentials are fine
+            self.send(client, 2, self.ok())
+            while True:
+                seq, packet = self.recv(client)
+                command, data = packet[0], packet[1:]
+                if command == COM_QUIT:
+                    return
+                elif command == COM_PING:
+                    self.pings += 1
+                    self.send(client, 1, self.ok())
+                elif command == COM_INIT_DB:
+                    self.send(client, 1, self.ok())
+                elif command == COM_QUERY:
+                    self.query(client, data.decode("UTF-8"))
+                else:
+                    self.send(client, 1, self.error(1047, "Unknown command"))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            client.close()
+
+    def query(self, client, sql):
+        self.queries.append(sql)
+        try:
+            result = self.execute(sql)
+        except MySQLError as e:
+            self.send(client, 1, self.error(e.code, str(e)))
+            return
+        if isinstance(result, bytes):
+            self.send(client, 1, result)
+            return
+        columns, rows = result
+        seq = 1
+        packets = [lenenc_int(len(columns))]
+        for i, name in enumerate(columns):
+            values = [row[i] for row in rows if row[i] is not None]
+            kind = TYPE_VAR_STRING
+            if values and all(isinstance(v, int) for v in values):
+                kind = TYPE_LONGLONG
+            elif values and all(isinstance(v, (int, float)) for v in values):
+                kind = TYPE_DOUBLE
+            packets.append(b"".join(lenenc_str(s) for s in ("def", "", "", "", name, name)) + b"\x0c" +
+                           struct.pack("<HIBHBH", 33, 1024, kind, 0, 0, 0))
+        packets.append(self.eof())
+        for row in rows:
+            packets.append(b"".join(b"\xfb" if v is None else lenenc_str(str(v)) for v in row))
+        packets.append(self.eof())
+        for packet in packets:
+            self.send(client, seq, packet)
+            seq += 1
+
+    def execute(self, sql):
+        """
+        Run a query, returning an OK packet or a tuple of (column names, rows)
+        """
+        statement = sql.strip().rstrip(";").strip()
+        word = statement.split(None, 1)[0].upper() if statement else ""
+        if word in ("SET", "USE"):
+            return self.ok()
+        if statement.upper().startswith("CREATE DATABASE"):
+            self.databases.add(statement.split()[-1].strip("`"))
+            return self.ok(affected=1)
+        if statement.upper() == "SHOW DATABASES":
+            return ["Database"], [(name, ) for name in sorted(self.databases)]
+        if statement.upper() == "SHOW TABLES":
+            statement = "SELECT `name` AS `Tables_in_db` FROM sqlite_master WHERE `type`='table'"
+        for pattern, replacement in REWRITES:
+            statement = pattern.sub(replacement, statement)
+        with self.dblock:
+            try:
+                c = self.db.execute(statement)
+            except sqlite3.IntegrityError as e:
+                raise MySQLError(1062, str(e))
+            except sqlite3.Error as e:
+                raise MySQLError(1064, "{}: {}".format(e, statement))
+            if c.description is None:
+                return self.ok(affected=max(c.rowcount, 0), insert_id=c.lastrowid or 0)
+            return [d[0] for d in c.description], c.fetchall()
+
+    @staticmethod
+    def ok(affected=0, insert_id=0):
+        return b"\x00" + lenenc_int(affected) + lenenc_int(insert_id) + struct.pack("<HH", STATUS, 0)
+
+    @staticmethod
+    def eof():
+        return b"\xfe" + struct.pack("<HH", 0, STATUS)
+
+    @staticmethod
+    def error(code, message):
+        return b"\xff" + struct.pack("<H", code) + b"#HY000" + message.encode("UTF-8")
+
+    @staticmethod
+    def send(client, seq, payload):
+        client.sendall(struct.pack("<I", len(payload))[:3] + bytes([seq & 0xff]) + payload)
+
+    @staticmethod
+    def recv(client):
+        header = Server.read(client, 4)
+        length = struct.unpack("<I", header[:3] + b"\0")[0]
+        return header[3], Server.read(client, length)
+
+    @staticmethod
+    def read(client, length):
+        data = b""
+        while len(data) < length:
+            chunk = client.recv(length - len(data))
+            if not chunk:
+                raise ConnectionError("client disconnected")
+            data += chunk
+        return data
@@ -0,0 +1,144 @@
+import pytest
+from contextlib import closing
+from time import time
+from unittest.mock import MagicMock
+from pyircbot.irccore import IRCEvent, UserPrefix
+from pyircbot.modules.NickUser import protected
+from tests.lib import *  # NOQA - fixtures
+from tests.lib import pm
+
+
+@pytest.fixture
+def attrbot(fakebot):
+    """
+    Provide a bot loaded with the AttributeStorageLite module. Clear the database.
+    """
+    fakebot.loadmodule("SQLite")
+    with closing(fakebot.moduleInstances["SQLite"].opendb("attributes.db")) as db:
+        for table in ["attribute", "items", "values"]:
+            db.query("DROP TABLE IF EXISTS `{}`;".format(table))
+    fakebot.loadmodule("AttributeStorageLite")
+    return fakebot
+
+
+@pytest.fixture
+def attr(attrbot):
+    return attrbot.moduleInstances["AttributeStorageLite"]
+
+
+def test_get_set(attr):
+    assert attr.getKey("Chatter", "foo") is None
+    attr.setKey("Chatter", "Foo", "bar")
+    assert attr.getKey("chatter", "foo") == "bar"
+    attr.setKey("chatter", "foo", "baz")
+    assert attr.get("chatter", "FOO") == "baz"
+    attr.set("chatter", "foo", None)
+    assert attr.getKey("chatter", "foo") is None
+
+
+def test_get_set_keys(attr):
+    attr.setKeys("chatter", {"a": "1", "b": "2"})
+    assert attr.getKeys("chatter", ["a", "B", "c"]) == {"a": "1", "b": "2", "c": None}
+    assert attr.getItem("chatter") == {"a": "1", "b": "2"}
+
+
+def test_persisted(attrbot, attr):
+    attr.setKeys("chatter", {"a": "1", "b": None})
+    attrbot.unloadmodule("AttributeStorageLite")
+    attrbot.loadmodule("AttributeStorageLite")
+    attr = attrbot.moduleInstances["AttributeStorageLite"]
+    assert attr.cache == {}
+    assert attr.getKeys("chatter", ["a", "b"]) == {"a": "1", "b": None}
+
+
+def test_cached(attr):
+    attr.setKey("chatter", "foo", "bar")
+    attr.getKey("other", "foo")
+    attr.db.query = MagicMock(side_effect=attr.db.query)
+    assert attr.getKey("chatter", "foo") == "bar"
+    assert attr.getKey("other", "foo") is None
+    attr.db.query.assert_not_called()
+
+
+def test_cache_lru(attr):
+    attr.cache_size = 2
+    attr.setKeys("chatter", {"a": "1", "b": "2"})
+    attr.getKey("chatter", "a")
+    attr.setKey("chatter", "c", "3")
+    assert list(attr.cache) == [("chatter", "a"), ("chatter", "c")]
+    assert attr.getKey("chatter", "b") == "2"
+
+
+def test_cache_read_racing_write(attr, monkeypatch):
+    attr.setKey("chatter", "foo", "bar")
+    attr.db.flush()
+    attr.cache.clear()
+    query = attr.db.query
+
+    class Racing(object):
+        """Rows read before a concurrent setKey changes the key"""
+        def __init__(self, c):
+            self.rows = c.fetchall()
+            c.close()
+            monkeypatch.setattr(attr.db, "query", query)
+            attr.setKey("chatter", "foo", "baz")
+
+        def fetchall(self):
+            return self.rows
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(attr.db, "query", lambda *args: Racing(query(*args)))
+    assert attr.getKey("chatter", "foo") == "bar"
+    assert attr.getKey("chatter", "foo") == "baz"
+
+
+def test_unwritten_not_evicted(attr):
+    attr.cache_size = 0
+    attr.db.write_delay = 60
+    attr.setKeys("chatter", {"a": "1", "b": "2"})
+    attr.setKey("chatter", "b", None)
+    assert attr.getKeys("chatter", ["a", "b"]) == {"a": "1", "b": None}
+    assert attr.getItem("chatter") == {"a": "1"}
+    attr.db.flush()
+    assert attr.unwritten == {}
+    assert attr.getKeys("chatter", ["a", "b"]) == {"a": "1", "b": None}
+
+
+def test_cache_failed_write(attr):
+    attr.setKey("chatter", "foo", "bar")
+    attr.setKey("chatter", "foo", {"not": "storable"})
+    attr.db.flush()
+    assert attr.getKey("chatter", "foo") == "bar"
+
+
+@pytest.mark.slow
+def test_bench_protected(attrbot):
+    attrbot.loadmodule("NickUser")
+    pm(attrbot, ".setpass foobar")
+
+    class Module(object):
+        def __init__(self, bot):
+            self.bot = bot
+
+        @protected()
+        def cmd(self, msg, cmd):
+            pass
+
+    mod = Module(attrbot)
+    msg = IRCEvent("PRIVMSG", ["#test"], UserPrefix("chatter", "root", "cia.gov"), ".cmd")
+    attr = attrbot.moduleInstances["AttributeStorageLite"]
+    attr.db.flush()
+    count = 5000
+    rates = {}
+    for cache_size in (0, 4096):
+        attr.cache_size = cache_size
+        attr.cache.clear()
+        start = time()
+        for i in range(count):
+            mod.cmd(msg, None)
+        rates[cache_size] = count / (time() - start)
+        print("\ncache_size {}: {:.0f} protected commands/s".format(cache_size, rates[cache_size]))
+    attrbot.act_PRIVMSG.assert_called_once()  # only the .setpass reply, every command was allowed
+    assert rates[4096] > rates[0]
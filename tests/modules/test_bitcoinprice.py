@@ -0,0 +1,46 @@
+import json
+import pytest
+from time import sleep
+from tests.lib import *  # NOQA - fixtures
+
+
+@pytest.fixture
+def tickerapi(httpd):
+    """
+    Provide a local stand-in for the ticker api. Set ``server.price`` to the price to report.
+    """
+    httpd.handle = lambda request: request.reply(json.dumps([{"price_usd": httpd.price, "percent_change_24h": "1.5",
+                                                              "24h_volume_usd": "2000000000"}]), "application/json")
+    httpd.price = "10000.00"
+    return httpd
+
+
+@pytest.fixture
+def btcbot(fakebot, tickerapi):
+    fakebot.botconfig["module_configs"]["BitcoinPrice"] = {
+        "interval": 0.1,
+        "api_url": tickerapi.url + "/",
+        "announce_channels": ["#btc"],
+        "announce_percent": 5}
+    fakebot.loadmodule("HTTP")
+    fakebot.loadmodule("BitcoinPrice")
+    fakebot.moduleInstances["BitcoinPrice"].poller.get(timeout=5)
+    return fakebot
+
+
+def test_btc(btcbot):
+    btcbot.feed_line(".btc")
+    btcbot.act_PRIVMSG.assert_called_once_with(
+        "#test", "chatter: \x02\x0307Bitcoin:\x03\x02 \x0307$10000.00\x0f - 24h change: \x0307$1.50\x0f - "
+                 "24h volume: \x0307$2000M\x0f")
+
+
+def test_announce_move(btcbot, tickerapi):
+    tickerapi.price = "10200.00"  # too small to announce
+    sleep(0.3)
+    btcbot.act_PRIVMSG.assert_not_called()
+    tickerapi.price = "10600.00"
+    sleep(0.3)
+    btcbot.act_PRIVMSG.assert_called_once()
+    assert btcbot.act_PRIVMSG.call_args[0][0] == "#btc"
+    assert btcbot.act_PRIVMSG.call_args[0][1].endswith("(+6.0%)")
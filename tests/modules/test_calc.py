@@ -1,5 +1,7 @@
 import pytest
 from contextlib import closing
+from time import time
+from unittest.mock import MagicMock
 from tests.lib import *  # NOQA - fixtures
 
 
@@ -15,7 +17,7 @@ def calcbot(fakebot):
         "delayCalcSpecific": 0,
         "delayMatch": 0}
     fakebot.loadmodule("SQLite")
-    tables = ["calc_addedby", "calc_channels", "calc_definitions", "calc_words"]
+    tables = ["calc_words_fts", "calc_addedby", "calc_channels", "calc_definitions", "calc_words"]
     with closing(fakebot.moduleInstances["SQLite"].opendb("calc.db")) as db:
         for t in tables:
             db.query("DROP TABLE IF EXISTS `{}`;".format(t))
@@ -79,3 +81,116 @@ def test_delete_disable(calcbot):
     _add_fact(calcbot, "yyy", "bar2")
     calcbot.feed_line("calc xxx =")
     calcbot.act_PRIVMSG.assert_not_called()
+
+
+def test_newest_definition(calcbot):
+    _add_fact(calcbot, "foo", "bar")
+    _add_fact(calcbot, "foo", "baz")
+    calcbot.feed_line(".calc FOO")
+    calcbot.act_PRIVMSG.assert_called_once_with('#test', 'foo \x03= baz \x0314[added by: chatter]')
+
+
+def test_channels_separate(calcbot):
+    _add_fact(calcbot, "foo", "bar")
+    calcbot.feed_line("calc", args=["#other"])
+    calcbot.act_PRIVMSG.assert_called_once_with('#other', 'This channel has no calcs, chatter :(')
+
+
+def test_random_after_delete(calcbot):
+    _add_fact(calcbot, "xxx", "bar")
+    _add_fact(calcbot, "yyy", "bar2")
+    calcbot.feed_line(".calc xxx =")
+    calcbot.act_PRIVMSG.reset_mock()
+    for i in range(10):
+        calcbot.feed_line(".calc")
+    assert {c[1][1] for c in calcbot.act_PRIVMSG.mock_calls} == {'yyy \x03= bar2 \x0314[added by: chatter]'}
+
+
+def test_index_loaded(calcbot):
+    _add_fact(calcbot, "xxx", "bar")
+    _add_fact(calcbot, "xxx", "bar2")
+    _add_fact(calcbot, "yyy", "bar3")
+    calcbot.feed_line(".calc yyy =")
+    calcbot.act_PRIVMSG.reset_mock()
+    calcbot.unloadmodule("Calc")
+    calcbot.loadmodule("Calc")
+    calc = calcbot.moduleInstances["Calc"]
+    assert calc.getRandomCalc("#test") == {"word": "xxx", "definition": "bar2", "by": "chatter"}
+    assert calc.getSpecificCalc("#test", "yyy") is None
+    assert calc.channelIds == {"#test": 1}
+
+
+def test_lookups_query_once(calcbot):
+    _add_fact(calcbot, "foo", "bar")
+    calc = calcbot.moduleInstances["Calc"]
+    calc.sql.query = MagicMock(side_effect=calc.sql.query)
+    calc.getSpecificCalc("#test", "foo")
+    calc.getRandomCalc("#test")
+    assert calc.sql.query.call_count == 2
+
+
+def test_match_many(calcbot):
+    for i in range(12):
+        _add_fact(calcbot, "word{:02}".format(i), "def")
+    _add_fact(calcbot, "other", "def")
+    calcbot.feed_line(".match WORD")
+    calcbot.act_PRIVMSG.assert_called_once_with(
+        '#test', 'chatter: 10 matches ({}\x03)'.format(", \x03".join("word{:02}".format(i) for i in range(10))))
+    calcbot.act_PRIVMSG.reset_mock()
+    calcbot.feed_line(".match nothing")
+    calcbot.act_PRIVMSG.assert_called_once_with('#test', 'chatter: Sorry, no matches')
+
+
+def test_match_fts_fallback(calcbot):
+    _add_fact(calcbot, "xxx", "bar")
+    calc = calcbot.moduleInstances["Calc"]
+    assert calc.fts
+    calc.fts = False
+    calcbot.feed_line(".match xx")
+    calcbot.act_PRIVMSG.assert_called_once_with('#test', 'chatter: 1 match (xxx\x03)')
+
+
+def _fill(calcbot, count):
+    tables = ["calc_words_fts", "calc_addedby", "calc_channels", "calc_definitions", "calc_words"]
+    calcbot.unloadmodule("Calc")
+    with closing(calcbot.moduleInstances["SQLite"].opendb("calc.db")) as db:
+        for t in tables:
+            db.query("DROP TABLE IF EXISTS `{}`;".format(t))
+    calcbot.loadmodule("Calc")
+    calcbot.unloadmodule("Calc")
+    with closing(calcbot.moduleInstances["SQLite"].opendb("calc.db")) as db:
+        db.query("BEGIN")
+        db.query("INSERT INTO `calc_channels` (`id`, `channel`) VALUES (1, '#test')")
+        db.query("INSERT INTO `calc_addedby` (`id`, `username`, `userhost`) VALUES (1, 'chatter', 'cia.gov')")
+        db.connection.executemany("INSERT INTO `calc_words` (`id`, `channel`, `word`, `status`) "
+                                  "VALUES (?, 1, ?, 'approved')", ((i, "word{:06}".format(i)) for i in range(count)))
+        db.connection.executemany("INSERT INTO `calc_definitions` (`word`, `definition`, `addedby`, `date`, `status`) "
+                                  "VALUES (?, 'definition', 1, '2020-01-01', 'approved')",
+                                  ((i, ) for i in range(count)))
+        db.query("COMMIT")
+    calcbot.loadmodule("Calc")
+    return calcbot.moduleInstances["Calc"]
+
+
+@pytest.mark.slow
+def test_bench_calc(calcbot):
+    lookups = 2000
+    results = {}
+    for count in (1000, 100000):
+        calc = _fill(calcbot, count)
+        start = time()
+        for i in range(lookups):
+            assert calc.getRandomCalc("#test")
+        random = (time() - start) / lookups
+        start = time()
+        for i in range(lookups):
+            assert calc.getSpecificCalc("#test", "word{:06}".format(i % count))
+        specific = (time() - start) / lookups
+        start = time()
+        for i in range(lookups):
+            assert len(calc.matchWords(1, "{:06}".format(i % count))) == 1
+        match = (time() - start) / lookups
+        results[count] = random + specific + match
+        print("\n{} words: {:.1f}us per random, {:.1f}us per specific, {:.1f}us per match".format(
+            count, random * 1000000, specific * 1000000, match * 1000000))
+    assert results[100000] < results[1000] * 5
@@ -0,0 +1,147 @@
+import asyncio
+import pytest
+from threading import Lock, Thread
+from time import sleep, time
+from unittest.mock import MagicMock
+from pyircbot.modules.HTTP import ResponseCache, freshness
+from tests.lib import *  # NOQA - fixtures
+
+
+@pytest.fixture
+def webserver(httpd):
+    """
+    Provide a local http server. Set ``server.headers`` to extra response headers and ``server.status`` to the response
+    status. Requests are counted per path in ``server.requests`` and the most running at once is kept in
+    ``server.peak``.
+    """
+    def handle(request):
+        with httpd.lock:
+            httpd.requests[request.path] = httpd.requests.get(request.path, 0) + 1
+            httpd.running += 1
+            httpd.peak = max(httpd.peak, httpd.running)
+        sleep(httpd.delay)
+        with httpd.lock:
+            httpd.running -= 1
+        request.reply("{} {}".format(request.path, httpd.requests[request.path]), status=httpd.status,
+                      headers=httpd.headers)
+
+    httpd.handle = handle
+    httpd.headers = {}
+    httpd.status = 200
+    httpd.requests = {}
+    httpd.running = 0
+    httpd.peak = 0
+    httpd.delay = 0
+    httpd.lock = Lock()
+    return httpd
+
+
+@pytest.fixture
+def http(fakebot):
+    fakebot.botconfig["module_configs"]["HTTP"] = {"per_host": 2}
+    fakebot.loadmodule("HTTP")
+    return fakebot.moduleInstances["HTTP"]
+
+
+def _response(status=200, body=b"", **headers):
+    response = MagicMock()
+    response.status_code = status
+    response.content = body
+    response.headers = {name.replace("_", "-"): value for name, value in headers.items()}
+    return response
+
+
+def test_freshness():
+    assert freshness(_response()) == 0
+    assert freshness(_response(Cache_Control="max-age=60")) == 60
+    assert freshness(_response(Cache_Control="public, max-age=60", Age="20")) == 40
+    assert freshness(_response(Cache_Control="no-cache, max-age=60")) == 0
+    assert freshness(_response(Cache_Control="no-store"), ttl=60) == 0
+    assert freshness(_response(Cache_Control="no-cache"), ttl=60) == 60
+    assert freshness(_response(503), ttl=60) == 0
+    assert freshness(_response(404), ttl=60) == 0
+    assert freshness(_response(500, Cache_Control="max-age=60")) == 0
+    assert freshness(_response(Expires="Thu, 01 Jan 2015 00:01:00 GMT", Date="Thu, 01 Jan 2015 00:00:00 GMT")) == 60
+    assert freshness(_response(Expires="0")) == 0
+
+
+def test_cache_eviction():
+    cache = ResponseCache(10)
+    cache.put("a", _response(body=b"aaaa"), time() + 60)
+    cache.put("b", _response(body=b"bbbb"), time() + 60)
+    assert cache.get("a") is not None  # b is now least recently used
+    cache.put("c", _response(body=b"cccc"), time() + 60)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.size == 8
+    cache.put("d", _response(body=b"d" * 11), time() + 60)
+    assert cache.get("d") is None
+    cache.put("e", _response(body=b"e"), time() - 1)
+    assert cache.get("e") is None
+
+
+def test_cached_by_header(http, webserver):
+    webserver.headers = {"Cache-Control": "max-age=60"}
+    assert http.get(webserver.url + "/a").text == "/a 1"
+    assert http.get(webserver.url + "/a").text == "/a 1"
+    assert webserver.requests["/a"] == 1
+
+
+def test_not_cached(http, webserver):
+    assert http.get(webserver.url + "/a").text == "/a 1"
+    assert http.get(webserver.url + "/a").text == "/a 2"
+
+
+def test_cached_by_ttl(http, webserver):
+    assert http.get(webserver.url + "/a", params={"q": "x"}, ttl=60).text == "/a?q=x 1"
+    assert http.get(webserver.url + "/a", params={"q": "x"}, ttl=60).text == "/a?q=x 1"
+    assert http.get(webserver.url + "/a", params={"q": "y"}, ttl=60).text == "/a?q=y 1"
+
+
+def test_error_not_cached_by_ttl(http, webserver):
+    webserver.status = 503
+    assert http.get(webserver.url + "/a", ttl=60).status_code == 503
+    assert http.get(webserver.url + "/a", ttl=60).status_code == 503
+    assert webserver.requests["/a"] == 2
+
+
+def test_inflight_shared(http, webserver):
+    webserver.delay = 0.3
+    results = []
+    threads = [Thread(target=lambda: results.append(http.get(webserver.url + "/a").text)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ["/a 1"] * 4
+    assert webserver.requests["/a"] == 1
+
+
+def test_per_host_limit(http, webserver):
+    webserver.delay = 0.2
+    threads = [Thread(target=http.get, args=(webserver.url + "/{}".format(i), )) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(webserver.requests) == 6
+    assert webserver.peak == 2
+
+
+def test_rate_limit(fakebot, webserver):
+    fakebot.botconfig["module_configs"]["HTTP"] = {"per_host_rate": 10}
+    fakebot.loadmodule("HTTP")
+    http = fakebot.moduleInstances["HTTP"]
+    start = time()
+    for i in range(4):
+        http.get(webserver.url + "/{}".format(i))
+    assert time() - start >= 0.3
+
+
+def test_async(http, webserver):
+    async def fetch():
+        return await asyncio.gather(http.aget(webserver.url + "/a"), http.aget(webserver.url + "/b"))
+    a, b = asyncio.new_event_loop().run_until_complete(fetch())
+    assert a.text == "/a 1"
+    assert b.text == "/b 1"
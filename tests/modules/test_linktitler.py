@@ -1,9 +1,38 @@
 import pytest
 from time import sleep
+from threading import Thread
 from unittest.mock import MagicMock
+from pyircbot.modules.LinkTitler import normalize_url
 from tests.lib import *  # NOQA - fixtures
 
 
+@pytest.fixture
+def webserver(httpd):
+    """
+    Provide a local http server. Set ``server.pages`` to path -> (content type, body bytes). ``server.sent`` counts the
+    body bytes the client actually took.
+    """
+    def handle(request):
+        content_type, body = httpd.pages[request.path]
+        request.send_response(200)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        try:
+            for i in range(0, len(body), 1024):
+                request.wfile.write(body[i:i + 1024])
+                request.wfile.flush()
+                httpd.sent += len(body[i:i + 1024])
+                sleep(0.01)
+        except OSError:  # client hung up
+            request.close_connection = True
+
+    httpd.handle = handle
+    httpd.pages = {}
+    httpd.sent = 0
+    return httpd
+
+
 @pytest.fixture
 def linkbot(fakebot):
     """
@@ -16,25 +45,103 @@ def linkbot(fakebot):
             "client_secret": "test",
             "username": "test",
             "password": "test"
-        },
-        "youtube_api_key": "test"
+        }
     }
+    fakebot.botconfig["module_configs"]["YoutubeInfo"] = {"api_key": "test", "batch_window": 0.01}
 
+    fakebot.loadmodule("HTTP")
+    fakebot.loadmodule("YoutubeInfo")
     fakebot.loadmodule("LinkTitler")
     return fakebot
 
 
 def test_link_html_title(linkbot, monkeypatch):
-    monkeypatch.setattr(linkbot.moduleInstances["LinkTitler"], "url_headers", lambda url: {"Content-Type": "text/html"})
-    monkeypatch.setattr(linkbot.moduleInstances["LinkTitler"], "url_htmltitle", lambda url: "foo bar title")
+    monkeypatch.setattr(linkbot.moduleInstances["LinkTitler"], "fetch_description",
+                        lambda url: "\x02foo bar title\x02")
     linkbot.feed_line("http://example.com/")
     sleep(0.1)
     linkbot.act_PRIVMSG.assert_called_once_with('#test', 'chatter: \x02foo bar title\x02')
 
 
+def test_fetch_title(linkbot, webserver):
+    titler = linkbot.moduleInstances["LinkTitler"]
+    webserver.pages["/"] = ("text/html", b"<html><head><title>\n  foo &amp; bar\n</title></head><body>" +
+                            b"x" * 100000 + b"</body></html>")
+    assert titler.fetch_description(webserver.url + "/") == "\x02foo & bar\x02"
+    sleep(0.1)
+    assert webserver.sent < 10 * 1024
+
+
+def test_fetch_charset(linkbot, webserver):
+    titler = linkbot.moduleInstances["LinkTitler"]
+    title = "caf\u00e9 \u2014 menu"
+    webserver.pages["/header"] = ("text/html; charset=iso-8859-15",
+                                  "<title>caf\u00e9</title>".encode("iso-8859-15"))
+    webserver.pages["/meta"] = ("text/html", '<meta charset="utf-8"><title>{}</title>'.format(title).encode())
+    webserver.pages["/equiv"] = ("text/html", '<meta http-equiv="Content-Type" content="text/html; charset=cp1252">'
+                                              '<title>{}</title>'.format(title).encode("cp1252"))
+    assert titler.fetch_description(webserver.url + "/header") == "\x02caf\u00e9\x02"
+    assert titler.fetch_description(webserver.url + "/meta") == "\x02{}\x02".format(title)
+    assert titler.fetch_description(webserver.url + "/equiv") == "\x02{}\x02".format(title)
+
+
+def test_fetch_other_type(linkbot, webserver):
+    titler = linkbot.moduleInstances["LinkTitler"]
+    webserver.pages["/a.png"] = ("image/png", b"x" * 100000)
+    assert titler.fetch_description(webserver.url + "/a.png") == "\x02image/png\x02, 97kb"
+    sleep(0.1)
+    assert webserver.sent < 100000
+
+
+def test_no_link(linkbot, monkeypatch):
+    submit = MagicMock()
+    monkeypatch.setattr(linkbot.moduleInstances["LinkTitler"].executor, "submit", submit)
+    linkbot.feed_line("nothing to see here")
+    submit.assert_not_called()
+
+
+def test_normalize_url():
+    assert normalize_url("HTTP://Example.COM") == "http://example.com/"
+    assert normalize_url("https://example.com:443/a?b=c#d") == "https://example.com/a?b=c"
+    assert normalize_url("http://example.com:8080/A") == "http://example.com:8080/A"
+
+
+def test_title_cached(linkbot, monkeypatch):
+    titler = linkbot.moduleInstances["LinkTitler"]
+    fetches = []
+    monkeypatch.setattr(titler, "fetch_description", lambda url: fetches.append(url) or "\x02foo bar title\x02")
+    linkbot.feed_line("http://example.com/")
+    sleep(0.1)
+    linkbot.feed_line("look http://example.com:80/#top", args=["#other"])
+    sleep(0.1)
+    assert fetches == ["http://example.com/"]
+    linkbot.act_PRIVMSG.assert_called_with('#other', 'chatter: \x02foo bar title\x02')
+    assert titler.cache_stats() == {"size": 1, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_fetch_shared(linkbot, monkeypatch):
+    titler = linkbot.moduleInstances["LinkTitler"]
+    fetches = []
+
+    def slow_fetch(url):
+        fetches.append(url)
+        sleep(0.2)
+        return "\x02image/png\x02, 4kb"
+    monkeypatch.setattr(titler, "fetch_description", slow_fetch)
+    results = []
+    threads = [Thread(target=lambda: results.append(titler.describe_url("http://example.com/a.png")))
+               for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert fetches == ["http://example.com/a.png"]
+    assert results == ["\x02image/png\x02, 4kb"] * 3
+
+
 def test_youtube(linkbot, monkeypatch):
-    monkeypatch.setattr(linkbot.moduleInstances["LinkTitler"], "_get_video_description_api",
-                        lambda vid_id: {"kind": "youtube#videoListResponse", "etag": "\"xxxx\"", "pageInfo": {"totalResults": 1, "resultsPerPage": 1}, "items": [{"kind": "youtube#video", "etag": "\"xxxx\"", "id": "SvArQjKr488", "snippet": {"publishedAt": "2009-06-16T06:12:24.000Z", "channelId": "UCgeRcbMDaVTwEHJvO6-hFjQ", "title": "Liquid X - RIoT Rich", "description": "blah", "thumbnails": {"default": {"url": "https://i.ytimg.com/vi/SvArQjKr488/default.jpg", "width": 120, "height": 90}, "medium": {"url": "https://i.ytimg.com/vi/SvArQjKr488/mqdefault.jpg", "width": 320, "height": 180}, "high": {"url": "https://i.ytimg.com/vi/SvArQjKr488/hqdefault.jpg", "width": 480, "height": 360}}, "channelTitle": "Bieji", "tags": ["liquid", "riot", "rich", "digital", "gangster", "nerd", "life", "rit", "Rochester", "Institute", "of", "Technology"], "categoryId": "10", "liveBroadcastContent": "none", "localized": {"title": "Liquid X - RIoT Rich", "description": "blah"}}, "contentDetails": {"duration": "PT5M39S", "dimension": "2d", "definition": "sd", "caption": "false", "licensedContent": False, "projection": "rectangular"}, "statistics": {"viewCount": "17141", "likeCount": "193", "dislikeCount": "8", "favoriteCount": "0", "commentCount": "31"}}]})
+    monkeypatch.setattr(linkbot.moduleInstances["YoutubeInfo"], "fetch",
+                        lambda vid_ids: {"SvArQjKr488": {"kind": "youtube#video", "etag": "\"xxxx\"", "id": "SvArQjKr488", "snippet": {"publishedAt": "2009-06-16T06:12:24.000Z", "channelId": "UCgeRcbMDaVTwEHJvO6-hFjQ", "title": "Liquid X - RIoT Rich", "description": "blah", "thumbnails": {"default": {"url": "https://i.ytimg.com/vi/SvArQjKr488/default.jpg", "width": 120, "height": 90}, "medium": {"url": "https://i.ytimg.com/vi/SvArQjKr488/mqdefault.jpg", "width": 320, "height": 180}, "high": {"url": "https://i.ytimg.com/vi/SvArQjKr488/hqdefault.jpg", "width": 480, "height": 360}}, "channelTitle": "Bieji", "tags": ["liquid", "riot", "rich", "digital", "gangster", "nerd", "life", "rit", "Rochester", "Institute", "of", "Technology"], "categoryId": "10", "liveBroadcastContent": "none", "localized": {"title": "Liquid X - RIoT Rich", "description": "blah"}}, "contentDetails": {"duration": "PT5M39S", "dimension": "2d", "definition": "sd", "caption": "false", "licensedContent": False, "projection": "rectangular"}, "statistics": {"viewCount": "17141", "likeCount": "193", "dislikeCount": "8", "favoriteCount": "0", "commentCount": "31"}}})
     linkbot.feed_line("blah blah https://www.youtube.com/watch?v=SvArQjKr488 blah blah")
     sleep(0.1)
     linkbot.act_PRIVMSG.assert_called_once_with('#test', '\x02\x031,0You\x0f\x030,4Tube\x02\x0f :: \x02Liquid X - RIoT Rich\x02 - length \x025m 39s\x02 - rated \x024.80/5\x02 - \x0217,141\x02 views - by \x02Bieji\x02 on \x022009.06.16\x02')
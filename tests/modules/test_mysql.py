@@ -0,0 +1,161 @@
+import pytest
+import socket
+from threading import Thread
+from unittest.mock import MagicMock
+from tests.lib import *  # NOQA - fixtures
+from tests.minimysqld import Server as MiniMySQLServer
+
+
+@pytest.fixture
+def mysqlserver():
+    server = MiniMySQLServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def mysqlbot(fakebot, mysqlserver):
+    """
+    Provide a bot loaded with the MySQL module, connected to a stand-in mysql server.
+    """
+    fakebot.botconfig["module_configs"]["MySQL"] = {"host": "127.0.0.1", "port": mysqlserver.port,
+                                                    "username": "root", "password": "root", "database": "pyircbot"}
+    fakebot.loadmodule("MySQL")
+    return fakebot
+
+
+@pytest.fixture
+def db(mysqlbot):
+    return mysqlbot.moduleInstances["MySQL"].connection
+
+
+def _in_thread(func):
+    """
+    Run func in a new thread, returning its result or raising its exception
+    """
+    result = []
+    error = []
+
+    def run():
+        try:
+            result.append(func())
+        except Exception as e:
+            error.append(e)
+    t = Thread(target=run)
+    t.start()
+    t.join()
+    if error:
+        raise error[0]
+    return result[0]
+
+
+def test_database_created(db, mysqlserver):
+    assert "pyircbot" in mysqlserver.databases
+
+
+def test_query(db):
+    db.query("CREATE TABLE `test` (`id` int(11) NOT NULL AUTO_INCREMENT, `name` varchar(64), PRIMARY KEY (`id`));")
+    assert db.tableExists("test")
+    assert not db.tableExists("other")
+    c = db.query("INSERT INTO `test` (`name`) VALUES (%s);", ("it's",))
+    assert c.lastrowid == 1
+    assert db.query("SELECT * FROM `test`;").fetchall() == [{"id": 1, "name": "it's"}]
+
+
+def test_no_ping_per_query(db, mysqlserver):
+    for i in range(20):
+        db.query("SELECT 1;").close()
+    assert mysqlserver.pings == 0
+    assert not any(q.upper().startswith("USE") for q in mysqlserver.queries)
+
+
+def test_thread_connections(db, mysqlserver):
+    db.query("SELECT 1;").close()
+    mine = db.ensureConnected()
+    other = _in_thread(db.ensureConnected)
+    assert other is not mine
+    # the exited thread's connection is reused by the next thread
+    assert _in_thread(db.ensureConnected) is other
+    assert mysqlserver.accepted == 2
+
+
+def test_release(db, mysqlserver):
+    mine = db.ensureConnected()
+    db.release()
+    assert _in_thread(db.ensureConnected) is mine
+    assert mysqlserver.accepted == 1
+
+
+def test_pool_size(mysqlbot, db):
+    db.pool_size = 1
+    db.pool_timeout = 0.1
+    db.ensureConnected()
+    with pytest.raises(Exception, match="no connection became free within 0.1s"):
+        _in_thread(lambda: db.query("SELECT 1;"))
+
+
+def test_idle_reconnect(db, mysqlserver):
+    db.query("SELECT 1;").close()
+    db.idle_check = 0
+    mysqlserver.drop_clients()
+    assert db.query("SELECT 1 AS `one`;").fetchone() == {"one": 1}
+    assert mysqlserver.accepted == 2
+
+
+def test_lost_connection_retried(db, mysqlserver):
+    db.query("SELECT 1;").close()
+    mysqlserver.drop_clients()
+    # without an idle check the lost connection is only noticed by the query itself
+    with pytest.raises(Exception):
+        db.query("SELECT 1 AS `one`;")
+    assert db.query("SELECT 1 AS `one`;").fetchone() == {"one": 1}
+
+
+def test_lost_connection_query_many(db, mysqlserver):
+    db.query("CREATE TABLE `test` (`id` int(11) NOT NULL AUTO_INCREMENT, `name` varchar(64), PRIMARY KEY (`id`));")
+    db.ensureConnected()._sock.shutdown(socket.SHUT_WR)  # sending fails, so the statement is known not to have run
+    db.queryMany("INSERT INTO `test` (`name`) VALUES (%s);", [("a", ), ("b", )]).close()
+    assert db.query("SELECT `name` FROM `test`;").fetchall() == [{"name": "a"}, {"name": "b"}]
+    assert mysqlserver.accepted == 2
+
+
+@pytest.fixture
+def attr(mysqlbot):
+    mysqlbot.loadmodule("AttributeStorage")
+    return mysqlbot.moduleInstances["AttributeStorage"]
+
+
+def test_attributes(attr):
+    assert attr.getKey("Chatter", "foo") is None
+    attr.setKey("Chatter", "Foo", "bar")
+    assert attr.getKey("chatter", "foo") == "bar"
+    attr.setKey("chatter", "foo", "baz")
+    assert attr.get("chatter", "FOO") == "baz"
+    attr.set("chatter", "foo", None)
+    assert attr.getKey("chatter", "foo") is None
+
+
+def test_attributes_keys(attr):
+    attr.setKeys("chatter", {"a": "1", "b": "2"})
+    assert attr.getKeys("chatter", ["a", "B", "c"]) == {"a": "1", "b": "2", "c": None}
+    assert attr.getItem("chatter") == {"a": "1", "b": "2"}
+    attr.setKeys("chatter", {"a": None, "b": "3"})
+    assert attr.getKeys("chatter", ["a", "b"]) == {"a": None, "b": "3"}
+
+
+def test_attributes_lost_connection(attr):
+    attr.setKeys("chatter", {"foo": "bar", "bar": "1"})
+    attr.db.connection.ensureConnected()._sock.shutdown(socket.SHUT_WR)
+    attr.setKeys("chatter", {"foo": "baz", "bar": "2"})  # ids are cached, so the upsert is the first query sent
+    assert attr.getKeys("chatter", ["foo", "bar"]) == {"foo": "baz", "bar": "2"}
+
+
+def test_attributes_ids_cached(mysqlbot, attr):
+    attr.setKey("chatter", "foo", "bar")
+    attr.db.connection.query = MagicMock(side_effect=attr.db.connection.query)
+    assert attr.getKeys("chatter", ["foo", "bar"]) == {"foo": "bar", "bar": None}
+    attr.db.connection.query.assert_called_once()
+    # ids are loaded from the database after a reload
+    mysqlbot.unloadmodule("AttributeStorage")
+    mysqlbot.loadmodule("AttributeStorage")
+    assert mysqlbot.moduleInstances["AttributeStorage"].attributeIds == {"foo": 1}
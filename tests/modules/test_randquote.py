@@ -0,0 +1,115 @@
+import pytest
+from contextlib import closing
+from time import time
+from pyircbot.irccore import IRCEvent, UserPrefix
+from tests.lib import *  # NOQA - fixtures
+
+
+def _quotebot(fakebot, limit):
+    fakebot.botconfig["module_configs"]["RandQuote"] = {"limit": limit}
+    fakebot.loadmodule("RandQuote")
+    return fakebot
+
+
+@pytest.fixture
+def quotebot(fakebot):
+    """
+    Provide a bot loaded with the RandQuote module. Clear the database.
+    """
+    fakebot.loadmodule("SQLite")
+    with closing(fakebot.moduleInstances["SQLite"].opendb("randquote.db")) as db:
+        db.query("DROP TABLE IF EXISTS `chat`;")
+        db.query("PRAGMA user_version=0")
+    return _quotebot(fakebot, 3)
+
+
+def _rows(bot):
+    c = bot.moduleInstances["RandQuote"].db.query("SELECT `id`, `seq`, `message` FROM `chat` ORDER BY `seq`")
+    rows = [tuple(row) for row in c.fetchall()]
+    c.close()
+    return rows
+
+
+def test_randquote_empty(quotebot):
+    quotebot.moduleInstances["RandQuote"].fetchquotes(None, None)
+    quotebot.act_PRIVMSG.assert_not_called()
+
+
+def test_randquote(quotebot):
+    quotebot.feed_line("hello world")
+    quotebot.feed_line(".rq")
+    quotebot.act_PRIVMSG.assert_called_once()
+    assert quotebot.act_PRIVMSG.mock_calls[0][1][1] in ("<chatter> hello world", "<chatter> .rq")
+
+
+def test_ring_buffer(quotebot):
+    for i in range(5):
+        quotebot.feed_line("msg{}".format(i))
+    assert _rows(quotebot) == [(2, 2, "msg2"), (0, 3, "msg3"), (1, 4, "msg4")]
+
+
+def test_resume_after_reload(quotebot):
+    for i in range(4):
+        quotebot.feed_line("msg{}".format(i))
+    quotebot.unloadmodule("RandQuote")
+    _quotebot(quotebot, 3)
+    quotebot.feed_line("msg4")
+    assert _rows(quotebot) == [(2, 2, "msg2"), (0, 3, "msg3"), (1, 4, "msg4")]
+
+
+def test_limit_change(quotebot):
+    for i in range(5):
+        quotebot.feed_line("msg{}".format(i))
+    quotebot.unloadmodule("RandQuote")
+    _quotebot(quotebot, 2)
+    assert _rows(quotebot) == [(0, 0, "msg3"), (1, 1, "msg4")]
+    quotebot.unloadmodule("RandQuote")
+    _quotebot(quotebot, 10)
+    quotebot.feed_line("msg5")
+    assert _rows(quotebot) == [(0, 0, "msg3"), (1, 1, "msg4"), (2, 2, "msg5")]
+
+
+def test_upgrade_old_table(quotebot):
+    quotebot.unloadmodule("RandQuote")
+    with closing(quotebot.moduleInstances["SQLite"].opendb("randquote.db")) as db:
+        db.query("DROP TABLE `chat`;")
+        db.query("""CREATE TABLE `chat` (`id` INTEGER PRIMARY KEY, `date` INTEGER, `sender` varchar(64),
+                    `message` varchar(2048));""")
+        for i in range(5):
+            db.query("INSERT INTO `chat` (`date`, `sender`, `message`) VALUES (?, ?, ?)",
+                     (i, "chatter", "msg{}".format(i)))
+        db.query("PRAGMA user_version=0")
+    _quotebot(quotebot, 3)
+    assert _rows(quotebot) == [(0, 0, "msg2"), (1, 1, "msg3"), (2, 2, "msg4")]
+
+
+@pytest.mark.slow
+def test_bench_randquote(quotebot):
+    messages = 5000
+    results = {}
+    for limit in (1000, 100000, 1000000):
+        quotebot.unloadmodule("RandQuote")
+        with closing(quotebot.moduleInstances["SQLite"].opendb("randquote.db")) as db:
+            # fill the buffer, so every new message replaces an old one
+            db.query("DELETE FROM `chat`")
+            db.query("BEGIN")
+            db.connection.executemany("INSERT INTO `chat` (`id`, `seq`, `date`, `sender`, `message`) "
+                                      "VALUES (?, ?, 0, 'chatter', 'hello world')", ((i, i) for i in range(limit)))
+            db.query("COMMIT")
+            db.query("PRAGMA user_version={}".format(limit))
+        _quotebot(quotebot, limit)
+        module = quotebot.moduleInstances["RandQuote"]
+        start = time()
+        for i in range(messages):
+            quotebot.feed_line("hello world")
+        module.db.flush()
+        logged = (time() - start) / messages
+        msg = IRCEvent("PRIVMSG", ["#test"], UserPrefix("chatter", "root", "cia.gov"), ".rq")
+        start = time()
+        for i in range(messages):
+            module.fetchquotes(msg, None)
+        picked = (time() - start) / messages
+        results[limit] = logged + picked
+        print("\nlimit {}: {:.1f}us per message, {:.1f}us per random pick".format(limit, logged * 1000000,
+                                                                                  picked * 1000000))
+    assert results[1000000] < results[1000] * 5
@@ -39,3 +39,77 @@ def test_remind_at(rbot):
     rbot.act_PRIVMSG.assert_not_called()
     sleep(2)
     rbot.act_PRIVMSG.assert_called_once_with('#test', 'chatter: Reminder: frig off')
+
+
+def test_remind_idle(rbot):
+    remind = rbot.moduleInstances["Remind"]
+    sleep(0.1)
+    assert remind.heap == []
+    assert remind.timer is None
+
+
+def test_remind_batch_from_db(rbot):
+    rbot.unloadmodule("Remind")
+    past = datetime.datetime.now() - datetime.timedelta(seconds=5)
+    future = datetime.datetime.now() + datetime.timedelta(days=5)
+    with closing(rbot.moduleInstances["SQLite"].opendb("remind.db")) as db:
+        for i in range(3):
+            db.query("INSERT INTO `reminders` (`sender`, `senderch`, `when`, `message`) VALUES (?, ?, ?, ?)",
+                     ("chatter", "#test", past, "thing{}".format(i))).close()
+        db.query("INSERT INTO `reminders` (`sender`, `senderch`, `when`, `message`) VALUES (?, ?, ?, ?)",
+                 ("chatter", "#test", future, "later")).close()
+    rbot.loadmodule("Remind")
+    sleep(0.2)
+    rbot.act_PRIVMSG.assert_called_once_with('#test', 'chatter: Reminder: thing0, thing1, thing2')
+    remind = rbot.moduleInstances["Remind"]
+    assert [entry[2]["message"] for entry in remind.heap] == ["later"]
+    assert remind.timer is not None
+    c = remind.db.query("SELECT `message` FROM `reminders`")
+    assert [row["message"] for row in c.fetchall()] == ["later"]
+    c.close()
+
+
+def test_remind_deliver_fails(rbot):
+    remind = rbot.moduleInstances["Remind"]
+    rbot.feed_line(".in 1s first")
+    rbot.feed_line(".in 2s second")
+    rbot.act_PRIVMSG.side_effect = [Exception("not connected"), None]
+    sleep(2.5)
+    rbot.act_PRIVMSG.assert_called_with('#test', 'chatter: Reminder: second')
+    assert remind.heap == []
+
+
+def test_remind_sooner_rearms(rbot):
+    rbot.feed_line(".in 1h later")
+    rbot.feed_line(".in 1s sooner")
+    rbot.act_PRIVMSG.reset_mock()
+    sleep(1.5)
+    rbot.act_PRIVMSG.assert_called_once_with('#test', 'chatter: Reminder: sooner')
+
+
+def test_remind_without_loop(rbot, monkeypatch):
+    rbot.unloadmodule("Remind")
+    monkeypatch.delattr(rbot, "loop")  # like clipub's bot
+    rbot.loadmodule("Remind")
+    rbot.feed_line(".in 1s soon")
+    rbot.act_PRIVMSG.reset_mock()
+    sleep(1.5)
+    rbot.act_PRIVMSG.assert_called_once_with('#test', 'chatter: Reminder: soon')
+    rbot.unloadmodule("Remind")
+
+
+def test_remind_unload_waits(rbot):
+    remind = rbot.moduleInstances["Remind"]
+    rbot.feed_line(".in 1h due")
+    rbot.act_PRIVMSG.reset_mock()
+
+    def due():
+        sleep(0.2)  # still running when the module is unloaded
+        _, rid, reminder = remind.heap[0]
+        remind.heap[0] = (datetime.datetime.now(), rid, reminder)
+        remind.monitor()
+    rbot.loop.call_soon_threadsafe(due)
+    rbot.unloadmodule("Remind")
+    rbot.act_PRIVMSG.assert_called_once_with('#test', 'chatter: Reminder: due')
+    with closing(rbot.moduleInstances["SQLite"].opendb("remind.db")) as db:
+        assert db.query("SELECT COUNT(*) AS `cnt` FROM `reminders`").fetchone()["cnt"] == 0
@@ -0,0 +1,74 @@
+import json
+import os
+import pytest
+from contextlib import closing
+from tests.lib import *  # NOQA - fixtures
+
+
+@pytest.fixture
+def scoresbot(fakebot):
+    """
+    Provide a bot loaded with the Scores module. Clear the database.
+    """
+    fakebot.loadmodule("SQLite")
+    with closing(fakebot.moduleInstances["SQLite"].opendb("scores.db")) as db:
+        db.query("DROP TABLE IF EXISTS `scores`;")
+    fakebot.loadmodule("Scores")
+    return fakebot
+
+
+@pytest.fixture
+def board(scoresbot):
+    return scoresbot.moduleInstances["Scores"].board("test")
+
+
+def test_add(board):
+    assert board.get("alice") == 0
+    assert board.add("alice") == 1
+    assert board.add("alice", 2) == 3
+    assert board.get("alice") == 3
+    assert board.update("bob", {"kills": 1, "weight": 2.5}) == {"kills": 1, "weight": 2.5}
+    assert board.stats("bob") == {"kills": 1, "weight": 2.5}
+    assert len(board) == 2
+
+
+def test_top(board):
+    for player, score in [("alice", 3), ("bob", 5), ("carol", 1), ("dave", 4)]:
+        board.add(player, score)
+    assert board.top(3) == [("bob", 5), ("dave", 4), ("alice", 3)]
+    board.add("carol", 9)
+    board.add("bob", -5)
+    assert board.top(2) == [("carol", 10), ("dave", 4)]
+    assert board.top(10)[-1] == ("bob", 0)
+    assert board.top(3, stat="nope") == []
+
+
+def test_reload(scoresbot, board):
+    board.add("alice", 3)
+    board.update("bob", {"weight": 2.5})
+    scoresbot.unloadmodule("Scores")
+    scoresbot.loadmodule("Scores")
+    board = scoresbot.moduleInstances["Scores"].board("test")
+    assert board.get("alice") == 3
+    assert board.get("bob", "weight") == 2.5
+    assert board.top(1) == [("alice", 3)]
+
+
+def test_scramble_migration(scoresbot):
+    datadir = scoresbot.getDataPath("Scramble")
+    with open(os.path.join(datadir, "words.txt"), "w") as f:
+        f.write("apple\n")
+    with open(os.path.join(datadir, "scores.json"), "w") as f:
+        json.dump({"Alice": 3, "bob": 5}, f)
+    scoresbot.botconfig["module_configs"]["Scramble"] = {"hintDelay": 15, "delayNext": 5, "maxHints": 5,
+                                                         "abortAfterNoGuesses": 5}
+    scoresbot.loadmodule("Scramble")
+    scramble = scoresbot.moduleInstances["Scramble"]
+    with closing(scoresbot.moduleInstances["SQLite"].opendb("scores.db")) as db:
+        assert db.query("SELECT COUNT(*) AS `n` FROM `scores`;").fetchone()["n"] == 2  # written before the rename
+    assert scramble.getScore("alice") == 3
+    assert scramble.getScore("BOB", 1) == 6
+    assert not os.path.exists(os.path.join(datadir, "scores.json"))
+    assert os.path.exists(os.path.join(datadir, "scores.json.migrated"))
+    scoresbot.feed_line(".scramble top")
+    scoresbot.act_PRIVMSG.assert_called_once_with("#test", "Top 2: bob: 6, alice: 3")
@@ -0,0 +1,32 @@
+import os
+from pyircbot.modules.Scramble import WordList
+
+
+def test_wordlist(tmpdir):
+    path = os.path.join(str(tmpdir), "words.txt")
+    with open(path, "w") as f:
+        f.write("Apple\n\nbanana split\ncherry")
+    words = WordList(path)
+    try:
+        assert len(words) == 3
+        picked = set(words.random() for _ in range(200))
+        assert picked == {"apple", "banana split", "cherry"}
+    finally:
+        words.close()
+
+
+def test_wordlist_reload(tmpdir):
+    path = os.path.join(str(tmpdir), "words.txt")
+    with open(path, "w") as f:
+        f.write("")
+    words = WordList(path)
+    try:
+        assert len(words) == 0
+        assert words.random() == ""
+        with open(path, "w") as f:
+            f.write("durian\n")
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1000000))
+        assert words.random() == "durian"
+        assert len(words) == 1
+    finally:
+        words.close()
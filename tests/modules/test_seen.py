@@ -1,6 +1,5 @@
 import pytest
 from contextlib import closing
-from unittest.mock import call
 from tests.lib import *  # NOQA - fixtures
 import sqlite3
 
@@ -39,3 +38,22 @@ def test_notseen(seenbot):
     seenbot.feed_line(".seen notme")
     seenbot.act_PRIVMSG.assert_called_once_with('#test', "Sorry, I haven't seen notme!")
 
+
+def test_seen_events(seenbot):
+    seenbot.feed_line("#test", cmd="JOIN", args=[], sender=("joiner", "root", "cia.gov"))
+    seenbot.feed_line("bye", cmd="QUIT", args=[], sender=("quitter", "root", "cia.gov"))
+    seenbot.feed_line("newnick", cmd="NICK", args=[], sender=("oldnick", "root", "cia.gov"))
+    for nick in ["joiner", "quitter", "oldnick", "NewNick"]:
+        seenbot.feed_line(".seen {}".format(nick))
+        assert seenbot.act_PRIVMSG.mock_calls[-1][1][1].startswith("I last saw {} on ".format(nick))
+
+
+def test_seen_flush(seenbot):
+    seen = seenbot.moduleInstances["Seen"]
+    seenbot.feed_line("blah")
+    seenbot.feed_line("blah", sender=("other", "root", "cia.gov"))
+    with closing(sqlite3.connect(seen.getFilePath('database.sql3'))) as db:
+        assert db.execute("SELECT COUNT(*) FROM `seen`").fetchone()[0] == 0
+        seen.flush()
+        assert seen.dirty == {}
+        assert sorted(db.execute("SELECT `nick` FROM `seen`").fetchall()) == [("chatter", ), ("other", )]
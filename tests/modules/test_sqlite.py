@@ -0,0 +1,215 @@
+import pytest
+from contextlib import closing
+from threading import Thread
+import sqlite3
+from time import sleep, time
+from tests.lib import *  # NOQA - fixtures
+
+
+@pytest.fixture
+def db(fakebot):
+    """
+    Provide a database opened through the SQLite module, with an empty table
+    """
+    fakebot.loadmodule("SQLite")
+    with closing(fakebot.moduleInstances["SQLite"].opendb("test.db")) as db:
+        db.query("DROP TABLE IF EXISTS `items`;")
+        db.query("CREATE TABLE `items` (`id` INTEGER PRIMARY KEY, `name` varchar(64), `num` INTEGER);")
+        yield db
+
+
+def _in_thread(func):
+    result = []
+    t = Thread(target=lambda: result.append(func()))
+    t.start()
+    t.join()
+    return result[0]
+
+
+def test_pragmas(db):
+    assert db.query("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert db.query("PRAGMA synchronous").fetchone()[0] == 1  # normal
+    assert _in_thread(lambda: db.query("PRAGMA synchronous").fetchone()[0]) == 1
+
+
+def test_rows_by_name(db):
+    db.query("INSERT INTO `items` (`name`, `num`) VALUES (?, ?)", ("foo", 1)).close()
+    row = db.query("SELECT * FROM `items`").fetchone()
+    assert row["id"] == 1
+    assert row["name"] == "foo"
+    assert row.get("num") == 1
+    assert row.get("nope", 42) == 42
+    assert dict(row) == {"id": 1, "name": "foo", "num": 1}
+    assert dict(row.items()) == dict(row)
+
+
+def test_connection_per_thread(db):
+    assert db.connection is db.connection
+    assert _in_thread(lambda: db.connection) is not db.connection
+
+
+def test_threads_see_writes(db):
+    _in_thread(lambda: db.query("INSERT INTO `items` (`name`, `num`) VALUES (?, ?)", ("foo", 1)).close())
+    assert db.query("SELECT COUNT(*) as `num` FROM `items`").fetchone()["num"] == 1
+
+
+def test_close_all(db):
+    conns = [_in_thread(lambda: db.connection) for i in range(3)]
+    # exited threads' connections are closed as new ones are opened
+    assert len(db._connections) <= 2
+    db.close()
+    assert db._connections == []
+    for conn in conns:
+        with pytest.raises(Exception):
+            conn.execute("SELECT 1")
+
+
+def _readers_writers(db, readers, writers, ops):
+    errors = []
+
+    def write():
+        try:
+            for i in range(ops):
+                db.query("INSERT INTO `items` (`name`, `num`) VALUES (?, ?)", ("foo", i)).close()
+        except Exception as e:
+            errors.append(e)
+
+    def read():
+        try:
+            for i in range(ops):
+                with closing(db.query("SELECT * FROM `items` WHERE `num`=?", (i, ))) as c:
+                    c.fetchall()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [Thread(target=write) for i in range(writers)] + [Thread(target=read) for i in range(readers)]
+    start = time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time() - start, errors
+
+
+def test_concurrent_readers_writers(db):
+    duration, errors = _readers_writers(db, readers=4, writers=2, ops=50)
+    assert errors == []
+    assert db.query("SELECT COUNT(*) as `num` FROM `items`").fetchone()["num"] == 100
+
+
+@pytest.mark.slow
+def test_bench_readers_writers(db):
+    db.query("CREATE INDEX `items_num` ON `items` (`num`)").close()
+    readers, writers, ops = 8, 2, 2000
+    duration, errors = _readers_writers(db, readers, writers, ops)
+    assert errors == []
+    total = (readers + writers) * ops
+    print("\n{} readers, {} writers: {} queries in {:.2f}s, {:.0f} queries/s".format(
+          readers, writers, total, duration, total / duration))
+    assert duration < 60
+
+
+def _committed(db):
+    """Count rows as seen by an outside connection, which can't see queued writes"""
+    with closing(sqlite3.connect(db.path)) as conn:
+        return conn.execute("SELECT COUNT(*) FROM `items`").fetchone()[0]
+
+
+def test_write_flush(db):
+    db.write_delay = 60
+    db.write("INSERT INTO `items` (`name`, `num`) VALUES (?, ?)", ("foo", 1))
+    assert _committed(db) == 0
+    db.flush()
+    assert _committed(db) == 1
+
+
+def test_write_read_back(db):
+    db.write_delay = 60
+    db.write("INSERT INTO `items` (`name`, `num`) VALUES (?, ?)", ("foo", 1))
+    assert db.query("SELECT * FROM `items`").fetchone()["name"] == "foo"
+    assert _committed(db) == 1
+    db.write("INSERT INTO `items` (`name`, `num`) VALUES (?, ?)", ("bar", 2))
+    assert _in_thread(lambda: db.query("SELECT COUNT(*) as `num` FROM `items`").fetchone()["num"]) == 2
+
+
+def test_write_read_in_transaction(db):
+    db.write_delay = 60
+    db.query("BEGIN")
+    db.query("SELECT * FROM `items`").close()
+    db.write("INSERT INTO `items` (`name`, `num`) VALUES (?, ?)", ("foo", 1))
+    start = time()
+    assert db.query("SELECT * FROM `items`").fetchone() is None  # isn't held up by its own transaction
+    assert time() - start < 1
+    db.query("COMMIT")
+    assert db.query("SELECT * FROM `items`").fetchone()["name"] == "foo"
+
+
+def test_write_callbacks(db):
+    results = []
+    db.write("INSERT INTO `items` (`name`, `num`) VALUES (?, ?)", ("foo", 1),
+             onerror=results.append, oncommit=lambda: results.append("foo"))
+    db.write("INSERT INTO `nope` (`name`) VALUES (?)", ("foo", ),
+             onerror=lambda e: results.append(type(e)), oncommit=lambda: results.append("nope"))
+    db.flush()
+    assert results == ["foo", sqlite3.OperationalError]
+
+
+def test_write_outside_transaction(db):
+    db.query("BEGIN")
+    db.query("SELECT * FROM `items`").close()
+    db.write("INSERT INTO `nope` (`name`) VALUES (?)", ("foo", ))
+    db.flush()  # the failed batch is rolled back on the writer's own connection
+    assert db.connection.in_transaction
+    db.query("COMMIT")
+
+
+def test_write_behind(db):
+    db.write_delay = 0.1
+    for i in range(10):
+        db.write("INSERT INTO `items` (`name`, `num`) VALUES (?, ?)", ("foo", i))
+    assert _committed(db) == 0
+    sleep(0.5)
+    assert _committed(db) == 10
+
+
+def test_write_batch_rows(db):
+    db.write_delay = 60
+    db.write_batch_rows = 5
+    for i in range(5):
+        db.write("INSERT INTO `items` (`name`, `num`) VALUES (?, ?)", ("foo", i))
+    sleep(0.5)
+    assert _committed(db) == 5
+
+
+def test_write_close_flushes(db):
+    db.write_delay = 60
+    db.write("INSERT INTO `items` (`name`, `num`) VALUES (?, ?)", ("foo", 1))
+    db.close()
+    assert _committed(db) == 1
+
+
+def test_write_bad_query(db):
+    db.write("INSERT INTO `items` (`name`, `num`) VALUES (?, ?)", ("foo", 1))
+    db.write("INSERT INTO `nope` (`name`) VALUES (?)", ("foo", ))
+    db.write("INSERT INTO `items` (`name`, `num`) VALUES (?, ?)", ("foo", 2))
+    db.flush()
+    assert _committed(db) == 2
+
+
+@pytest.mark.slow
+def test_bench_write_behind(db):
+    db.config["synchronous"] = "full"  # the writer thread's connection is opened with this
+    db.query("PRAGMA synchronous=FULL").close()
+    count = 2000
+    start = time()
+    for i in range(count):
+        db.query("INSERT INTO `items` (`name`, `num`) VALUES (?, ?)", ("foo", i)).close()
+    direct = time() - start
+    start = time()
+    for i in range(count):
+        db.write("INSERT INTO `items` (`name`, `num`) VALUES (?, ?)", ("foo", i))
+    db.flush()
+    queued = time() - start
+    print("\n{} inserts: {:.3f}s autocommitted, {:.3f}s queued".format(count, direct, queued))
+    assert _committed(db) == count * 2
+    assert queued < direct
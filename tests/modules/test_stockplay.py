@@ -0,0 +1,360 @@
+import json
+import sys
+import pytest
+from contextlib import closing
+from decimal import Decimal
+from threading import Thread
+from time import sleep, time
+from unittest.mock import MagicMock
+from urllib.parse import urlparse, parse_qs
+from pyircbot.modules.StockPlay import Trade, Quota
+from tests.lib import *  # NOQA - fixtures
+
+
+@pytest.fixture
+def quoteserver(httpd):
+    """
+    Provide a local stand-in for the quote api. Set ``server.prices`` to symbol -> price string, symbols not listed are
+    invalid. Requests are counted per symbol in ``server.requests``.
+    """
+    def handle(request):
+        symbol = parse_qs(urlparse(request.path).query)["symbol"][0]
+        httpd.requests[symbol] = httpd.requests.get(symbol, 0) + 1
+        sleep(httpd.delay)
+        quote = {}
+        if symbol in httpd.prices:
+            quote = {"01. symbol": symbol, "05. price": httpd.prices[symbol], "06. volume": "100",
+                     "09. change": "0.0000", "10. change percent": "0.0000%"}
+        request.reply(json.dumps({"Global Quote": quote}), "application/json")
+
+    httpd.handle = handle
+    httpd.prices = {}
+    httpd.requests = {}
+    httpd.delay = 0
+    return httpd
+
+
+@pytest.fixture
+def stockbot(fakebot, quoteserver):
+    """
+    Provide a bot loaded with the StockPlay module, fetching quotes from a local quote server. Clear the database.
+    """
+    fakebot.botconfig["module_configs"]["StockPlay"] = {
+        "startbalance": 10000,
+        "tradedelay": 0,
+        "apikey": "",
+        "api_url": quoteserver.url + "/query",
+        "tcachesecs": 300,
+        "rcachesecs": 14400,
+        "bginterval": 300,
+        "midnight_offset": 0}
+    fakebot.loadmodule("SQLite")
+    with closing(fakebot.moduleInstances["SQLite"].opendb("stockplay.db")) as db:
+        for table in ["balances", "holdings", "trades", "prices", "balance_history", "leaderboard"]:
+            db.query("DROP TABLE IF EXISTS `stockplay_{}`;".format(table))
+    fakebot.loadmodule("HTTP")
+    fakebot.loadmodule("StockPlay")
+    return fakebot
+
+
+@pytest.fixture
+def stocks(stockbot):
+    return stockbot.moduleInstances["StockPlay"]
+
+
+def _price(stocks, symbol, price):
+    stocks._set_cache_priceinfo(symbol, {"symbol": symbol, "price": price})
+
+
+def _trade(stocks, nick, buy, symbol, amount, price):
+    _price(stocks, symbol, price)
+    stocks.check_nick(nick)
+    stocks.do_trade(Trade(nick, buy, symbol, amount, "#test"))
+
+
+def test_trade(stockbot, stocks):
+    _trade(stocks, "chatter", True, "AMD", 10, "20.00")
+    stockbot.act_PRIVMSG.assert_called_once_with("#test", "chatter: bought 10 AMD for $200.00. cash: $9,800.00")
+    assert stocks.get_position("chatter", "AMD") == (10, 20000)
+    assert stocks.get_bal("chatter") == 980000
+    with closing(stocks.sql.getCursor()) as c:
+        assert [tuple(row) for row in c.execute("SELECT nick, type, symbol, count, price FROM stockplay_trades")] == \
+            [("chatter", "buy", "AMD", 10, 20000)]
+
+
+def test_trade_refused(stockbot, stocks):
+    _trade(stocks, "chatter", False, "AMD", 1, "20.00")
+    stockbot.act_PRIVMSG.assert_called_once_with("#test", "chatter: you don't have that many.")
+    assert stocks.get_position("chatter", "AMD") == (0, 0)
+
+
+def test_avgbuy(stocks):
+    _trade(stocks, "chatter", True, "AMD", 10, "10.00")
+    _trade(stocks, "chatter", True, "AMD", 10, "20.00")
+    assert stocks.calc_user_avgbuy("chatter", "AMD") == Decimal("15")
+    # selling takes the proceeds off what was spent
+    _trade(stocks, "chatter", False, "AMD", 5, "30.00")
+    assert stocks.calc_user_avgbuy("chatter", "AMD") == Decimal("10")
+    # selling out starts over
+    _trade(stocks, "chatter", False, "AMD", 15, "30.00")
+    _trade(stocks, "chatter", True, "AMD", 4, "25.00")
+    assert stocks.calc_user_avgbuy("chatter", "AMD") == Decimal("25")
+    assert stocks.build_report("chatter")["holdings"] == [("AMD", 4, Decimal("25.00"), Decimal("25"), Decimal("0"))]
+
+
+def test_backfill(stockbot, stocks):
+    _trade(stocks, "chatter", True, "AMD", 10, "10.00")
+    _trade(stocks, "chatter", True, "AMD", 10, "20.00")
+    _trade(stocks, "chatter", False, "AMD", 5, "30.00")
+    _trade(stocks, "chatter", True, "INTC", 3, "50.00")
+    _trade(stocks, "chatter", False, "INTC", 3, "50.00")
+    _trade(stocks, "chatter", True, "INTC", 2, "40.00")
+    _trade(stocks, "other", True, "AMD", 1, "40.00")
+    positions = {(nick, symbol): stocks.get_position(nick, symbol)
+                 for nick in ("chatter", "other") for symbol in ("AMD", "INTC")}
+    stockbot.unloadmodule("StockPlay")
+    with closing(stockbot.moduleInstances["SQLite"].opendb("stockplay.db")) as db:
+        db.query("ALTER TABLE stockplay_holdings DROP COLUMN spent")
+    stockbot.loadmodule("StockPlay")
+    stocks = stockbot.moduleInstances["StockPlay"]
+    assert {key: stocks.get_position(*key) for key in positions} == positions
+    assert positions[("chatter", "AMD")] == (15, 15000)
+    assert positions[("chatter", "INTC")] == (2, 8000)
+
+
+def test_fetch(stockbot, stocks, quoteserver):
+    quoteserver.prices["AMD"] = "23.0500"
+    stocks.check_nick("chatter")
+    stocks.do_trade(Trade("chatter", True, "AMD", 2, "#test"))
+    stockbot.act_PRIVMSG.assert_called_once_with("#test", "chatter: bought 2 AMD for $46.10. cash: $9,953.90")
+    assert stocks.get_price("AMD", 300) == Decimal("23.0500")
+    assert stocks.prices["AMD"][1]["volume"] == Decimal("100")
+    assert quoteserver.requests == {"AMD": 1}
+
+
+def test_fetch_invalid(stockbot, stocks, quoteserver):
+    stocks.check_nick("chatter")
+    stocks.do_trade(Trade("chatter", True, "NOPE", 2, "#test"))
+    stockbot.act_PRIVMSG.assert_called_once_with("#test", "chatter: invalid symbol 'NOPE'")
+    assert "NOPE" not in stocks.prices
+
+
+def test_prices_loaded(stockbot, stocks):
+    _price(stocks, "AMD", "20.00")
+    stockbot.unloadmodule("StockPlay")
+    stockbot.loadmodule("StockPlay")
+    assert stockbot.moduleInstances["StockPlay"].prices["AMD"][1]["price"] == Decimal("20.00")
+
+
+def test_fetch_shared(stocks, quoteserver):
+    quoteserver.prices["AMD"] = "23.0500"
+    quoteserver.delay = 0.2
+    results = []
+    threads = [Thread(target=lambda: results.append(stocks.get_price("AMD", 1))) for i in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [Decimal("23.0500")] * 5
+    assert quoteserver.requests == {"AMD": 1}
+
+
+def test_quota(stockbot, stocks, quoteserver):
+    stocks.quota = Quota(per_minute=2, per_day=500)
+    quoteserver.prices.update({"AMD": "1.00", "INTC": "2.00", "EA": "3.00"})
+    assert stocks.fetch_shared("AMD")
+    # the bot imports modules by name, so the exception comes from its copy of the module
+    with pytest.raises(sys.modules[stocks.__module__].QuotaExceeded):
+        stocks.fetch_shared("INTC", background=True)  # the last request is reserved for trades
+    stocks.check_nick("chatter")
+    stocks.do_trade(Trade("chatter", True, "INTC", 1, "#test"))
+    stocks.do_trade(Trade("chatter", True, "EA", 1, "#test"))
+    assert stockbot.act_PRIVMSG.mock_calls[-1][1] == ("#test", "chatter: invalid symbol or api failure, trade aborted!")
+    assert quoteserver.requests == {"AMD": 1, "INTC": 1}
+
+
+def test_quota_stale_quote(stockbot, stocks, quoteserver):
+    _trade(stocks, "chatter", True, "AMD", 10, "10.00")
+    stocks.prices["AMD"] = (time() - 86400, stocks.prices["AMD"][1])
+    stocks.quota = Quota(per_minute=1, per_day=500)
+    stocks.quota.acquire()
+    quoteserver.prices["AMD"] = "20.00"
+    assert stocks.build_report("chatter")["holding_value"] == Decimal("100.00")  # the old quote
+    stockbot.act_PRIVMSG.reset_mock()
+    stocks.do_trade(Trade("chatter", True, "AMD", 1, "#test"))  # but trades need a fresh one
+    stockbot.act_PRIVMSG.assert_called_once_with("#test", "chatter: invalid symbol or api failure, trade aborted!")
+    with stocks.transaction() as c:
+        c.execute("INSERT INTO stockplay_holdings VALUES ('chatter', 'EA', 1, 100)")
+    stockbot.act_PRIVMSG.reset_mock()
+    stocks.do_report("chatter", "chatter", "#test", False)  # EA has never been quoted
+    stockbot.act_PRIVMSG.assert_called_once_with("#test", "chatter: api quota used up, try again later.")
+    assert quoteserver.requests == {}
+
+
+def test_quota_windows():
+    quota = Quota(per_minute=2, per_day=3)
+    assert quota.acquire() and quota.acquire()
+    assert not quota.acquire()
+    quota.calls = type(quota.calls)([time() - 120, time() - 120])  # a couple of minutes pass
+    assert quota.acquire()
+    assert not quota.acquire()
+    quota.calls = type(quota.calls)([time() - 86401] * 3)  # a day passes
+    assert quota.acquire(reserve=1)
+
+
+def test_pick_refresh(stocks):
+    assert stocks.pick_refresh() is None
+    _trade(stocks, "chatter", True, "AMD", 10, "10.00")
+    _trade(stocks, "chatter", True, "INTC", 10, "20.00")
+    assert stocks.pick_refresh() is None  # all fresh
+    now = time()
+    stocks.prices["AMD"] = (now - 1000, stocks.prices["AMD"][1])
+    stocks.prices["INTC"] = (now - 1000, stocks.prices["INTC"][1])
+    assert stocks.pick_refresh() == "INTC"  # more value held
+    stocks.prices["AMD"] = (now - 3000, stocks.prices["AMD"][1])
+    assert stocks.pick_refresh() == "AMD"  # staler
+    with stocks.transaction() as c:
+        c.execute("INSERT INTO stockplay_holdings VALUES ('chatter', 'EA', 1, 100)")
+    assert stocks.pick_refresh() == "EA"  # never quoted
+
+
+def _history(stocks):
+    with closing(stocks.sql.getCursor()) as c:
+        return {row["nick"]: row["cents"] for row in c.execute("SELECT * FROM stockplay_balance_history")}
+
+
+def test_nightly_balances(stocks):
+    _trade(stocks, "chatter", True, "AMD", 10, "10.00")
+    _trade(stocks, "other", True, "AMD", 1, "10.00")
+    _trade(stocks, "other", True, "INTC", 3, "20.0050")
+    stocks.check_nick("poor")
+    _price(stocks, "AMD", "12.00")
+    stocks.build_report = MagicMock(side_effect=Exception("should be set based"))
+    with stocks.transaction() as c:
+        c.execute("DELETE FROM stockplay_balance_history")
+    stocks.record_nightly_balances()
+    history = _history(stocks)
+    assert history["chatter"] == 1000000 - 10000 + 12000
+    assert history["other"] == 1000000 - 1000 - 6002 + 1200 + 6001
+    assert history["poor"] == 1000000
+    # already recorded today
+    _price(stocks, "AMD", "1.00")
+    stocks.record_nightly_balances()
+    assert _history(stocks) == history
+
+
+def test_nightly_balances_unquotable(stocks, quoteserver):
+    _trade(stocks, "chatter", True, "AMD", 10, "10.00")
+    stocks.check_nick("other")
+    with stocks.transaction() as c:
+        c.execute("DELETE FROM stockplay_balance_history")
+        c.execute("INSERT INTO stockplay_holdings VALUES ('other', 'ZNGA', 5, 5000)")
+    stocks.quota = Quota(per_minute=1, per_day=500)
+    quoteserver.prices["ZNGA"] = "3.00"
+    stocks.record_nightly_balances()
+    assert "other" not in _history(stocks)  # left for later rather than recorded without ZNGA
+    assert "chatter" in _history(stocks)
+    stocks.quota = Quota(per_minute=5, per_day=500)
+    stocks.record_nightly_balances()
+    assert _history(stocks)["other"] == 1000000 + 1500
+
+
+def test_value_unquotable(stocks, quoteserver):
+    _trade(stocks, "chatter", True, "AMD", 10, "10.00")
+    with stocks.transaction() as c:
+        c.execute("INSERT INTO stockplay_holdings VALUES ('chatter', 'GONE', 5, 5000)")  # delisted since
+        c.execute("INSERT INTO stockplay_holdings VALUES ('chatter', 'ZNGA', 5, 5000)")
+    stocks.quota = Quota(per_minute=2, per_day=500)
+    quoteserver.prices["ZNGA"] = "3.00"
+    assert stocks.value_players()["chatter"] == 1000000  # GONE is invalid, ZNGA is over the reserved quota
+    assert quoteserver.requests == {"GONE": 1}
+
+
+def test_leaderboard(stockbot, stocks):
+    _trade(stocks, "chatter", True, "AMD", 10, "10.00")
+    stocks.check_nick("other")
+    stocks.check_nick("third")
+    with stocks.transaction() as c:
+        c.execute("DELETE FROM stockplay_balance_history")
+        c.execute("INSERT INTO stockplay_balance_history VALUES ('chatter', '2000-01-01', 1000000)")
+        c.execute("INSERT INTO stockplay_balance_history VALUES ('other', '2000-01-01', 1000000)")
+    _price(stocks, "AMD", "20.00")
+    stocks.update_leaderboard()
+    assert [tuple(row) for row in stocks.get_leaderboard(10)] == [(1, "chatter", 1010000, 1000000),
+                                                                  (2, "other", 1000000, 1000000),
+                                                                  (3, "third", 1000000, None)]
+    stockbot.act_PRIVMSG.reset_mock()
+    stockbot.feed_line(".top 2")
+    assert [c[1] for c in stockbot.act_PRIVMSG.mock_calls] == [
+        ("#test", "1. chatter $10,100.00 \x0303+100.00 (1.00%)⬆\x0f"),
+        ("#test", "2. other   $10,000.00   \x0303+0.00 (0.00%)⬆\x0f")]
+
+
+def test_leaderboard_updates_changed(stockbot, stocks):
+    _trade(stocks, "chatter", True, "AMD", 10, "10.00")
+    _trade(stocks, "other", True, "INTC", 10, "10.00")
+    stocks.check_nick("third")
+    stocks.update_leaderboard()
+    stocks.value_players = MagicMock(side_effect=stocks.value_players)
+    stocks.update_leaderboard()
+    stocks.value_players.assert_not_called()  # nothing changed
+    _price(stocks, "AMD", "20.00")
+    _trade(stocks, "third", True, "EA", 1, "10.00")
+    stocks.update_leaderboard()
+    stocks.value_players.assert_called_once_with(nicks={"chatter", "third"})
+    assert [tuple(row)[1:3] for row in stocks.get_leaderboard(10)] == [("chatter", 1010000),
+                                                                       ("other", 1000000),
+                                                                       ("third", 1000000)]
+
+
+def test_leaderboard_empty(stockbot):
+    stockbot.feed_line(".top")
+    stockbot.act_PRIVMSG.assert_called_once_with("#test", "chatter: nobody is playing yet")
+
+
+@pytest.mark.slow
+def test_bench_nightly(stocks):
+    players = 5000
+    symbols = ["SYM{}".format(chr(ord("A") + i)) for i in range(20)]
+    for symbol in symbols:
+        _price(stocks, symbol, "10.00")
+    with stocks.transaction() as c:
+        c.executemany("INSERT INTO stockplay_balances VALUES (?, 100000)",
+                      (("p{}".format(i), ) for i in range(players)))
+        c.executemany("INSERT INTO stockplay_holdings VALUES (?, ?, 10, 10000)",
+                      (("p{}".format(i), symbols[(i + j) % 20]) for i in range(players) for j in range(5)))
+        c.execute("DELETE FROM stockplay_balance_history")
+    start = time()
+    stocks.record_nightly_balances()
+    recorded = time() - start
+    start = time()
+    stocks.update_leaderboard()
+    ranked = time() - start
+    print("\n{} players: {:.0f}ms nightly balances, {:.0f}ms leaderboard".format(players, recorded * 1000,
+                                                                                 ranked * 1000))
+    assert len(_history(stocks)) >= players
+    assert recorded < 2 and ranked < 2
+
+
+@pytest.mark.slow
+def test_bench_report(stocks):
+    results = {}
+    symbols = ["SYM{}".format(chr(ord("A") + i)) for i in range(20)]
+    for symbol in symbols:
+        _price(stocks, symbol, "10.00")
+    for trades in (100, 100000):
+        with stocks.transaction() as c:
+            c.execute("DELETE FROM stockplay_holdings")
+            c.execute("DELETE FROM stockplay_trades")
+            c.execute("DELETE FROM stockplay_balances")
+            c.execute("INSERT INTO stockplay_balances VALUES ('chatter', 100)")
+            for symbol in symbols:
+                c.execute("INSERT INTO stockplay_holdings VALUES ('chatter', ?, 10, 10000)", (symbol, ))
+            c.executemany("INSERT INTO stockplay_trades VALUES ('chatter', ?, ?, ?, 10, 10000)",
+                          ((i, "buy" if i % 2 else "sell", symbols[i % 20]) for i in range(trades)))
+        start = time()
+        for i in range(100):
+            stocks.build_report("chatter")
+        results[trades] = (time() - start) / 100
+        print("\n{} trades: {:.1f}ms per report".format(trades, results[trades] * 1000))
+    assert results[100000] < results[100] * 3
@@ -1,5 +1,6 @@
 import pytest
 from contextlib import closing
+from unittest.mock import MagicMock
 from tests.lib import *  # NOQA - fixtures
 
 
@@ -40,3 +41,65 @@ def test_max(tellbot):
     tellbot.feed_line(".tell foobar asdf")
     tellbot.act_PRIVMSG.assert_not_called()
 
+
+def test_tell_delivered_once(tellbot):
+    tellbot.feed_line(".tell fudge foo")
+    tellbot.feed_line(".tell Fudge bar")
+    tellbot.act_PRIVMSG.reset_mock()
+    tellbot.feed_line(".", sender=("FUDGE", "user", "host"))
+    assert tellbot.act_PRIVMSG.call_count == 2
+    tellbot.act_PRIVMSG.reset_mock()
+    tellbot.feed_line(".", sender=("fudge", "user", "host"))
+    tellbot.act_PRIVMSG.assert_not_called()
+    assert tellbot.moduleInstances["Tell"].db.query("SELECT COUNT(*) AS `cnt` FROM `tells`").fetchone()["cnt"] == 0
+
+
+def test_tell_again_after_delivery(tellbot):
+    tellbot.moduleInstances["Tell"].db.write_delay = 60
+    tellbot.feed_line(".tell fudge foo")
+    tellbot.feed_line(".", sender=("fudge", "user", "host"))
+    tellbot.feed_line(".tell fudge bar")
+    tellbot.act_PRIVMSG.reset_mock()
+    tellbot.feed_line(".", sender=("fudge", "user", "host"))
+    tellbot.act_PRIVMSG.assert_called_once_with("#test", "fudge: chatter said 0 minutes ago: bar")
+
+
+def test_tell_skips_db(tellbot):
+    tell = tellbot.moduleInstances["Tell"]
+    tellbot.feed_line(".tell fudge foo")
+    tell.db.query = MagicMock(side_effect=tell.db.query)
+    tellbot.feed_line("hello")
+    tell.db.query.assert_not_called()
+    tellbot.feed_line("hello", sender=("fudge", "user", "host"))
+    assert tell.db.query.call_count == 2  # the tells are read and deleted
+
+
+def test_tell_pending_loaded(tellbot):
+    tellbot.feed_line(".tell fudge foo")
+    tellbot.unloadmodule("Tell")
+    tellbot.loadmodule("Tell")
+    assert tellbot.moduleInstances["Tell"].pending == {"fudge"}
+    tellbot.act_PRIVMSG.reset_mock()
+    tellbot.feed_line(".", sender=("fudge", "user", "host"))
+    tellbot.act_PRIVMSG.assert_called_once_with("#test", "fudge: chatter said 0 minutes ago: foo")
+
+
+def test_tell_non_ascii(tellbot):
+    tellbot.feed_line(".tell Ärger foo")
+    tellbot.act_PRIVMSG.reset_mock()
+    tellbot.feed_line(".", sender=("äRGER", "user", "host"))
+    tellbot.act_PRIVMSG.assert_called_once_with("#test", "äRGER: chatter said 0 minutes ago: foo")
+
+
+def test_tell_recip_key_added(tellbot):
+    tellbot.unloadmodule("Tell")
+    with closing(tellbot.moduleInstances["SQLite"].opendb("tell.db")) as db:
+        db.query("DROP TABLE `tells`;")
+        db.query("CREATE TABLE `tells` (`id` INTEGER PRIMARY KEY, `sender` varchar(64), `channel` varchar(64), "
+                 "`when` INTEGER, `recip` varchar(64), `message` varchar(2048));")
+        db.query("INSERT INTO `tells` (`sender`, `channel`, `when`, `recip`, `message`) VALUES (?, ?, ?, ?, ?)",
+                 ("chatter", "#test", 2000000000, "Ärger", "foo"))
+    tellbot.loadmodule("Tell")
+    assert tellbot.moduleInstances["Tell"].pending == {"ärger"}
+    tellbot.feed_line(".", sender=("ÄRGER", "user", "host"))
+    assert tellbot.act_PRIVMSG.call_count == 1
@@ -0,0 +1,87 @@
+import pytest
+from contextlib import closing
+from threading import Thread
+from time import sleep
+from pyircbot.modules.Weather import normalize_location
+from tests.lib import *  # NOQA - fixtures
+
+
+def _forecast(city):
+    day = {"high": {"fahrenheit": "60", "celsius": "15"}, "low": {"fahrenheit": "40", "celsius": "5"},
+           "icon": "clear", "date": {"weekday_short": "Mon"}, "conditions": "Clear"}
+    return {"response": {},
+            "forecast": {"simpleforecast": {"forecastday": [day] * 6}},
+            "current_observation": {"display_location": {"city": city, "state": "NY"},
+                                    "wind_mph": "0", "wind_kph": "0", "wind_gust_mph": "0", "temp_f": "50",
+                                    "temp_c": "10", "wind_string": "Calm", "wind_degrees": "90"}}
+
+
+@pytest.fixture
+def weather(fakebot, monkeypatch):
+    """
+    Provide the Weather module, with a fake api counting fetches per location in ``weather.fetches``. Clear the
+    database.
+    """
+    fakebot.botconfig["module_configs"]["Weather"] = {"apikey": "test", "defaultUnit": "c", "cache_ttl": 0.2,
+                                                      "stale_ttl": 0.6}
+    fakebot.loadmodule("SQLite")
+    with closing(fakebot.moduleInstances["SQLite"].opendb("attributes.db")) as db:
+        for table in ["attribute", "items", "values"]:
+            db.query("DROP TABLE IF EXISTS `{}`;".format(table))
+    fakebot.loadmodule("AttributeStorageLite")
+    fakebot.loadmodule("NickUser")
+    fakebot.loadmodule("HTTP")
+    fakebot.loadmodule("Weather")
+    weather = fakebot.moduleInstances["Weather"]
+    weather.fetches = {}
+
+    def fetch(location):
+        weather.fetches[location] = weather.fetches.get(location, 0) + 1
+        sleep(0.1)
+        return _forecast("{} {}".format(location, weather.fetches[location]))
+    monkeypatch.setattr(weather, "fetchForecast", fetch)
+    return weather
+
+
+def _city(weather, location):
+    return weather.getForecast(location)["current_observation"]["display_location"]["city"]
+
+
+def test_normalize_location():
+    assert normalize_location("Rochester, NY") == "rochester,ny"
+    assert normalize_location("  rochester ,ny ") == "rochester,ny"
+    assert normalize_location("New  York") == "new york"
+
+
+def test_cached(weather):
+    assert _city(weather, "Rochester, NY") == "Rochester, NY 1"
+    assert _city(weather, "rochester,ny") == "Rochester, NY 1"
+    assert weather.fetches == {"Rochester, NY": 1}
+
+
+def test_coalesced(weather):
+    threads = [Thread(target=weather.getForecast, args=("14623", )) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert weather.fetches == {"14623": 1}
+
+
+def test_stale_while_revalidate(weather):
+    assert _city(weather, "14623") == "14623 1"
+    sleep(0.3)
+    assert _city(weather, "14623") == "14623 1"  # stale, refreshed in the background
+    sleep(0.2)
+    assert _city(weather, "14623") == "14623 2"
+    sleep(0.7)
+    assert _city(weather, "14623") == "14623 3"  # too old to use
+
+
+def test_weather_prefs(weather):
+    weather.attr.setKey("chatter", "weather-zip", "14623")
+    weather.attr.setKey("chatter", "weather-unit", "f")
+    weather.bot.feed_line(".w")
+    weather.bot.act_PRIVMSG.assert_called_once()
+    assert "14623 1, NY:" in weather.bot.act_PRIVMSG.call_args[0][1]
+    assert "50°F" in weather.bot.act_PRIVMSG.call_args[0][1]
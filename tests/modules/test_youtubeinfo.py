@@ -0,0 +1,76 @@
+import json
+import pytest
+from threading import Thread
+from time import sleep
+from urllib.parse import urlparse, parse_qs
+from tests.lib import *  # NOQA - fixtures
+
+
+@pytest.fixture
+def videoapi(httpd):
+    """
+    Provide a local stand-in for the youtube videos api. Ids in ``server.videos`` exist. The ids asked for in each call
+    are kept in ``server.calls``.
+    """
+    def handle(request):
+        ids = parse_qs(urlparse(request.path).query)["id"][0].split(",")
+        httpd.calls.append(ids)
+        items = [{"id": vid_id, "snippet": {"title": httpd.videos[vid_id]}} for vid_id in ids
+                 if vid_id in httpd.videos]
+        request.reply(json.dumps({"pageInfo": {"totalResults": len(items)}, "items": items}), "application/json")
+
+    httpd.handle = handle
+    httpd.videos = {}
+    httpd.calls = []
+    return httpd
+
+
+@pytest.fixture
+def info(fakebot, videoapi):
+    fakebot.botconfig["module_configs"]["YoutubeInfo"] = {
+        "api_key": "test",
+        "api_url": videoapi.url + "/videos",
+        "batch_window": 0.2}
+    fakebot.loadmodule("HTTP")
+    fakebot.loadmodule("YoutubeInfo")
+    return fakebot.moduleInstances["YoutubeInfo"]
+
+
+def _lookup_all(info, vid_ids):
+    results = {}
+
+    def lookup(vid_id):
+        results[vid_id] = info.video(vid_id)
+    threads = [Thread(target=lookup, args=(vid_id, )) for vid_id in vid_ids]
+    for t in threads:
+        t.start()
+        sleep(0.01)
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_batched(info, videoapi):
+    videoapi.videos = {"a": "video a", "b": "video b"}
+    results = _lookup_all(info, ["a", "b", "nope", "a"])
+    assert results["a"]["snippet"]["title"] == "video a"
+    assert results["b"]["snippet"]["title"] == "video b"
+    assert results["nope"] is None
+    assert videoapi.calls == [["a", "b", "nope"]]
+
+
+def test_cached(info, videoapi):
+    videoapi.videos = {"a": "video a"}
+    assert info.video("a")["snippet"]["title"] == "video a"
+    assert info.video("a")["snippet"]["title"] == "video a"
+    assert info.video("nope") is None
+    assert info.video("nope") is None
+    assert videoapi.calls == [["a"], ["nope"]]
+
+
+def test_batch_size(info, videoapi):
+    vid_ids = ["v{}".format(i) for i in range(120)]
+    videoapi.videos = {vid_id: vid_id for vid_id in vid_ids}
+    results = info.videos(vid_ids)
+    assert [results[vid_id]["snippet"]["title"] for vid_id in vid_ids] == vid_ids
+    assert [len(call) for call in videoapi.calls] == [50, 50, 20]
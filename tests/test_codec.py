@@ -0,0 +1,51 @@
+import pytest
+from pyircbot import codec
+from pyircbot.irccore import UserPrefix
+from time import time
+
+
+MESSAGE = [["#test"], "chatter", "hello world ☃", {"prefix": UserPrefix("chatter", "root", "cia.gov")}]
+
+
+@pytest.mark.parametrize("name", sorted(codec.codecs))
+def test_roundtrip(name):
+    c = codec.get(name)
+    encoded = c.dumps(MESSAGE)
+    assert isinstance(encoded, bytes if c.binary else str)
+    assert c.loads(encoded) == [["#test"], "chatter", "hello world ☃",
+                                {"prefix": ["chatter", "root", "cia.gov"]}]
+
+
+@pytest.mark.parametrize("name", sorted(codec.codecs))
+def test_errors(name):
+    c = codec.get(name)
+    with pytest.raises(ValueError):
+        c.loads(b"\xc1" if c.binary else "{")
+    with pytest.raises(TypeError):
+        c.dumps(object())
+
+
+def test_json_same_output():
+    outputs = set(codec.get(name).dumps(MESSAGE + [{"url": "http://a/b", "n": 2 ** 70}]) for name in codec.codecs
+                  if not codec.get(name).binary)
+    assert outputs == {'[["#test"],"chatter","hello world ☃",{"prefix":["chatter","root","cia.gov"]},'
+                       '{"url":"http://a/b","n":1180591620717411303424}]'}
+
+
+def test_json_fallbacks():
+    assert codec.get("json") is codec.JSON
+    assert codec.JSON.loads(codec.JSON.dumps({1: 2 ** 70})) == {"1": 2 ** 70}
+    with pytest.raises(ValueError):
+        codec.get("idontexist")
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("name", sorted(codec.codecs))
+def test_bench_codec(name):
+    c = codec.get(name)
+    rounds = 20000
+    start = time()
+    for _ in range(rounds):
+        c.loads(c.dumps(MESSAGE))
+    elapsed = time() - start
+    print("{}: {:.0f} round trips/s".format(name, rounds / elapsed))
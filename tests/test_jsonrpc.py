@@ -1,9 +1,12 @@
 import os
 import pytest
+import select
+import socket
+import struct
 from pyircbot import jsonrpc
-from threading import Thread
+from threading import Thread, Event
 from random import randint
-from time import sleep
+from time import sleep, time
 
 
 # Sample server methods
@@ -52,6 +55,27 @@ def j2testserver():
     server._Server__transport.close()
 
 
+@pytest.fixture
+def threadedserver():
+    port = randint(40000, 60000)
+    server = jsonrpc.Server(jsonrpc.JsonRpc20(),
+                            jsonrpc.TransportTcpIp(addr=("127.0.0.1", port), threads=8, max_connections=16,
+                                                   max_request=65536, conn_timeout=0.5))
+    release = Event()
+
+    def block():
+        release.wait(5)
+        return "released"
+
+    server.register_function(sample)
+    server.register_function(block)
+    Thread(target=server.serve, daemon=True).start()
+    sleep(0.2)
+    yield (server, port, release)
+    release.set()
+    server._Server__transport.close()
+
+
 # Basic functionality
 def test_1_basic(j1testserver):
     str(jsonrpc.RPCFault(-32700, "foo", "bar"))
@@ -218,3 +242,381 @@ def test_logging(tmpdir):
     logger2 = jsonrpc.log_filedate(os.path.join(tmpdir, "test2.log"))
     logger2(msg)
     assert os.path.exists(logpath)
+
+
+# Concurrent server
+def test_threaded_slow_call_does_not_block(threadedserver):
+    server, port, release = threadedserver
+    blocked = Thread(target=lambda: client(port).block(), daemon=True)
+    blocked.start()
+    sleep(0.1)
+    start = time()
+    assert client(port).sample("foobar") == "foobar"
+    assert time() - start < 1.0
+    assert blocked.is_alive()
+    release.set()
+    blocked.join(2)
+
+
+def test_threaded_large_request(threadedserver):
+    server, port, release = threadedserver
+    payload = "x" * 20000  # several times the transport's read size
+    assert client(port).sample(payload) == payload
+
+
+def test_threaded_oversized_request(threadedserver):
+    server, port, release = threadedserver
+    with pytest.raises(jsonrpc.RPCInvalidRPC):
+        client(port).sample("x" * 100000)
+
+
+def test_threaded_stuck_client(threadedserver):
+    server, port, release = threadedserver
+    stuck = socket.create_connection(("127.0.0.1", port))
+    stuck.sendall(b'{"jsonrpc": "2.0", ')
+    try:
+        assert client(port).sample("foobar") == "foobar"
+        sleep(1)
+        assert stuck.recv(1024) == b""  # dropped after conn_timeout
+    finally:
+        stuck.close()
+
+
+def test_threaded_slow_client(threadedserver):
+    server, port, release = threadedserver
+    slow = socket.create_connection(("127.0.0.1", port))
+    start = time()
+    try:
+        for byte in b'{"jsonrpc": "2.0", "method": "sample", "params": ["foobar"], "id": 0}':
+            slow.sendall(bytes([byte]))  # each byte well within conn_timeout of the last
+            sleep(0.1)
+            if select.select([slow], [], [], 0)[0]:
+                break
+    except OSError:
+        pass
+    finally:
+        slow.close()
+    assert time() - start < 2  # dropped conn_timeout after the request started, not answered
+
+
+def test_threaded_load(threadedserver):
+    server, port, release = threadedserver
+    results = {}
+
+    def worker(num):
+        results[num] = jsonrpc.ServerProxy(jsonrpc.JsonRpc20(),
+                                           jsonrpc.TransportTcpIp(addr=("127.0.0.1", port), timeout=10.0)).sample(num)
+
+    threads = [Thread(target=worker, args=(i, )) for i in range(100)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(20)
+    assert results == {i: i for i in range(100)}
+
+
+# Persistent connections
+def test_persistent_connection(threadedserver):
+    server, port, release = threadedserver
+    transport = jsonrpc.TransportTcpIp(addr=("127.0.0.1", port), timeout=2.0)
+    proxy = jsonrpc.ServerProxy(jsonrpc.JsonRpc20(), transport)
+    assert proxy.sample(1) == 1
+    sock = transport.s
+    assert sock is not None
+    assert proxy.sample(2) == 2
+    assert transport.s is sock
+
+
+def test_reconnect_after_idle(threadedserver):
+    server, port, release = threadedserver
+    transport = jsonrpc.TransportTcpIp(addr=("127.0.0.1", port), timeout=2.0)
+    proxy = jsonrpc.ServerProxy(jsonrpc.JsonRpc20(), transport)
+    assert proxy.sample(1) == 1
+    sleep(1)  # server drops the idle connection after conn_timeout
+    assert proxy.sample(2) == 2
+
+
+def test_no_resend_after_partial_reply():
+    listen = socket.socket()
+    listen.bind(("127.0.0.1", 0))
+    listen.listen(1)
+    received = []
+
+    def serve():
+        conn = listen.accept()[0]
+        reader = conn.makefile("rb")
+        received.append(reader.readline())
+        conn.sendall(jsonrpc.JsonRpc20().dumps_response("one", 1).encode("UTF-8") + b"\n")
+        received.append(reader.readline())
+        conn.sendall(b'{"jsonrpc": "2.0", ')  # part of the reply, then the connection is reset
+        sleep(0.1)
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        reader.close()
+        conn.close()
+        listen.settimeout(1)
+        try:
+            received.append(listen.accept()[0].makefile("rb").readline())
+        except socket.timeout:
+            pass
+
+    server = Thread(target=serve, daemon=True)
+    server.start()
+    transport = jsonrpc.TransportTcpIp(addr=listen.getsockname(), timeout=2.0)
+    proxy = jsonrpc.ServerProxy(jsonrpc.JsonRpc20(), transport)
+    try:
+        assert proxy.sample(1) == "one"
+        with pytest.raises(jsonrpc.RPCTransportError):
+            proxy.sample(2)
+        server.join(2)
+        assert len(received) == 2  # not sent again
+    finally:
+        listen.close()
+
+
+def test_unframed_client(threadedserver):
+    server, port, release = threadedserver
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.sendall(b'{"jsonrpc": "2.0", "method": "sample", "params": ["foo"], "id": 0}')
+    sock.shutdown(socket.SHUT_WR)
+    data = b""
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    sock.close()
+    assert jsonrpc.JsonRpc20().loads_response(data.decode("UTF-8"))[0] == "foo"
+
+
+def test_unframed_client_waiting(threadedserver):
+    server, port, release = threadedserver
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.settimeout(2)
+    request = b'{"jsonrpc": "2.0", "method": "sample", "params": ["foo"], "id": 0}'
+    sock.sendall(request[:20])
+    sleep(0.1)
+    sock.sendall(request[20:])
+    data = sock.recv(4096)
+    sock.close()
+    assert jsonrpc.JsonRpc20().loads_response(data.decode("UTF-8"))[0] == "foo"
+
+
+def test_pipelined_requests(threadedserver):
+    server, port, release = threadedserver
+    j = jsonrpc.JsonRpc20()
+    sock = socket.create_connection(("127.0.0.1", port))
+    requests = [j.dumps_request("sample", ["a"], id=1), j.dumps_request("sample", ["b"], id=2)]
+    sock.sendall("{}\n{}\n".format(*requests).encode("UTF-8"))
+    data = b""
+    while data.count(b"\n") < 2:
+        data += sock.recv(4096)
+    sock.close()
+    assert [j.loads_response(line) for line in data.decode("UTF-8").splitlines()] == [("a", 1), ("b", 2)]
+
+
+def test_transport_pool(threadedserver):
+    server, port, release = threadedserver
+    created = []
+
+    def factory():
+        created.append(jsonrpc.TransportTcpIp(addr=("127.0.0.1", port), timeout=2.0))
+        return created[-1]
+
+    pool = jsonrpc.TransportPool(factory, size=2)
+    proxy = jsonrpc.ServerProxy(jsonrpc.JsonRpc20(), pool)
+    for i in range(10):
+        assert proxy.sample(i) == i
+    assert len(created) == 1
+
+    results = []
+    threads = [Thread(target=lambda i=i: results.append(proxy.sample(i))) for i in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert sorted(results) == list(range(10))
+    assert len(pool.idle) <= 2
+    pool.close()
+    assert not pool.idle
+
+
+@pytest.mark.slow
+def test_bench_call_latency(threadedserver):
+    server, port, release = threadedserver
+    proxy = jsonrpc.ServerProxy(jsonrpc.JsonRpc20(),
+                                jsonrpc.TransportTcpIp(addr=("127.0.0.1", port), timeout=2.0))
+    proxy.sample(0)
+    calls = 2000
+    start = time()
+    for i in range(calls):
+        proxy.sample(i)
+    latency = (time() - start) / calls
+    print("{} calls, {:.3f}ms per call".format(calls, latency * 1000))
+    assert latency < 0.005
+
+
+# Batches
+def test_2_batch_request():
+    j = jsonrpc.JsonRpc20()
+    with pytest.raises(jsonrpc.RPCParseError):
+        j.loads_batch("[")
+    with pytest.raises(jsonrpc.RPCInvalidRPC):  # empty batch
+        j.loads_batch("[]")
+    with pytest.raises(jsonrpc.RPCInvalidRPC):  # not an array
+        j.loads_batch('{"jsonrpc": "2.0", "method": "foo"}')
+    reqs = j.loads_batch(j.dumps_batch([j.dumps_request("foo", [1], id=1),
+                                        j.dumps_notification("bar", {"a": 1}),
+                                        "1"]))
+    assert reqs[0] == ("foo", [1], 1)
+    assert reqs[1] == ("bar", {"a": 1})
+    assert isinstance(reqs[2], jsonrpc.RPCInvalidRPC)
+
+
+def test_2_batch_response():
+    j = jsonrpc.JsonRpc20()
+    resps = j.loads_response_batch(j.dumps_batch([j.dumps_response("foo", id=0),
+                                                  j.dumps_error(jsonrpc.RPCMethodNotFound(), id=1)]))
+    assert resps[0] == ("foo", 0)
+    assert isinstance(resps[1][0], jsonrpc.RPCMethodNotFound)
+    assert resps[1][1] == 1
+    with pytest.raises(jsonrpc.RPCInvalidRPC):  # whole batch rejected
+        j.loads_response_batch(j.dumps_error(jsonrpc.RPCInvalidRPC()))
+
+
+def test_2_batch_handle():
+    j = jsonrpc.JsonRpc20()
+    server = jsonrpc.Server(j, jsonrpc.TransportTcpIp(addr=("127.0.0.1", -1)))
+    server.register_function(sample)
+    resps = j.loads_response_batch(server.handle(j.dumps_batch([j.dumps_request("sample", ["a"], id=0),
+                                                                j.dumps_notification("sample", ["b"]),
+                                                                j.dumps_request("nope", id=1),
+                                                                '{"foo": 1}'])))
+    assert len(resps) == 3
+    assert resps[0] == ("a", 0)
+    assert isinstance(resps[1][0], jsonrpc.RPCMethodNotFound)
+    assert isinstance(resps[2][0], jsonrpc.RPCInvalidRPC)
+    assert server.handle(j.dumps_batch([j.dumps_notification("sample", ["b"])])) is None
+    with pytest.raises(jsonrpc.RPCInvalidRPC):
+        j.loads_response(server.handle("[]"))
+
+
+def test_2_multicall(j2testserver):
+    server, port = j2testserver
+    proxy = client(port)
+    with proxy.multicall() as batch:
+        batch.sample("foo")
+        batch.obj.sample(value="bar")
+        batch.idontexist()
+    assert len(batch) == 3
+    assert batch[0] == "foo"
+    assert batch[1] == "bar"
+    with pytest.raises(jsonrpc.RPCMethodNotFound):
+        batch[2]
+    with pytest.raises(jsonrpc.RPCMethodNotFound):
+        list(batch)
+    assert list(proxy.multicall()()) == []
+
+
+def test_1_multicall():
+    with pytest.raises(ValueError):
+        client(-1, v=1).multicall()
+
+
+def test_2_batch_parallel():
+    port = randint(40000, 60000)
+    server = jsonrpc.Server(jsonrpc.JsonRpc20(), jsonrpc.TransportTcpIp(addr=("127.0.0.1", port)), batch_threads=10)
+
+    def slow(value):
+        sleep(0.2)
+        return value
+
+    server.register_function(slow)
+    Thread(target=server.serve, daemon=True).start()
+    sleep(0.2)
+    try:
+        start = time()
+        batch = client(port).multicall()
+        for i in range(10):
+            batch.slow(i)
+        assert list(batch()) == list(range(10))
+        assert time() - start < 1.0
+    finally:
+        server._Server__transport.close()
+
+
+# Streams
+def ticks():
+    yield "started"
+    while True:
+        sleep(0.05)
+        yield ("tick", [])
+
+
+def _open_stream(port):
+    transport = jsonrpc.TransportTcpIp(addr=("127.0.0.1", port), timeout=2.0)
+    transport.send(jsonrpc.JsonRpc20().dumps_request("ticks", id=1))
+    return transport
+
+
+def test_2_batch_stream():
+    j = jsonrpc.JsonRpc20()
+    server = jsonrpc.Server(j, jsonrpc.TransportTcpIp(addr=("127.0.0.1", -1)))
+    server.register_function(ticks)
+    server.register_function(sample)
+    resps = j.loads_response_batch(server.handle(j.dumps_batch([j.dumps_request("ticks", id=0),
+                                                                j.dumps_request("sample", ["a"], id=1)])))
+    assert isinstance(resps[0][0], jsonrpc.RPCInvalidRPC)
+    assert resps[1] == ("a", 1)
+    assert server.streams == 0
+
+
+def test_2_stream_dropped():
+    j = jsonrpc.JsonRpc20()
+    server = jsonrpc.Server(j, jsonrpc.TransportTcpIp(addr=("127.0.0.1", -1)), max_streams=1)
+    server.register_function(ticks)
+    server.handle(j.dumps_request("ticks", id=0)).close()  # dropped before it's started
+    assert server.streams == 0
+    stream = server.handle(j.dumps_request("ticks", id=1))
+    assert j.loads_response(next(stream)) == ("started", 1)
+    assert server.streams == 1
+    refused = server.handle(j.dumps_request("ticks", id=2))
+    with pytest.raises(jsonrpc.RPCServerBusy):
+        j.loads_response(next(refused))
+    refused.close()
+    stream.close()
+    assert server.streams == 0
+
+
+@pytest.mark.parametrize("threads", [1, 2])
+def test_streams_use_own_threads(threads):
+    port = randint(40000, 60000)
+    server = jsonrpc.Server(jsonrpc.JsonRpc20(), jsonrpc.TransportTcpIp(addr=("127.0.0.1", port), threads=threads),
+                            max_streams=2)
+    server.register_function(ticks)
+    server.register_function(sample)
+    Thread(target=server.serve, daemon=True).start()
+    sleep(0.2)
+    j = jsonrpc.JsonRpc20()
+    streams = [_open_stream(port) for _ in range(2)]
+    try:
+        for transport in streams:
+            assert j.loads_response(transport.recv()) == ("started", 1)
+            assert j.loads_request(transport.recv())[0] == "tick"
+        start = time()
+        assert client(port).sample("foobar") == "foobar"  # the workers are free
+        assert time() - start < 1.0
+        busy = _open_stream(port)
+        with pytest.raises(jsonrpc.RPCServerBusy):
+            j.loads_response(busy.recv())
+        busy.close()
+        streams.pop().close()
+        for _ in range(100):  # the server notices the disconnect on its next write
+            if server.streams < 2:
+                break
+            sleep(0.05)
+        streams.append(_open_stream(port))
+        assert j.loads_response(streams[-1].recv()) == ("started", 1)
+    finally:
+        for transport in streams:
+            transport.close()
+        server._Server__transport.close()
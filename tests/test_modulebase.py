@@ -0,0 +1,48 @@
+from threading import Event
+from time import sleep, time
+from pyircbot.modulebase import Poller
+
+
+def test_poller():
+    values = iter([1, 1, 2, ValueError("down"), 3])
+    changes = []
+
+    def fetch():
+        value = next(values)
+        if isinstance(value, Exception):
+            raise value
+        return value
+    poller = Poller(fetch, 0.05, on_change=lambda old, new: changes.append((old, new)))
+    poller.start()
+    try:
+        assert poller.get(timeout=5) == 1
+        sleep(0.3)
+        assert poller.get() == 3
+        assert changes == [(1, 2), (2, 3)]
+    finally:
+        poller.stop()
+
+
+def test_poller_not_ready():
+    blocked = Event()
+    poller = Poller(lambda: blocked.wait(), 60)
+    poller.start()
+    try:
+        assert poller.get(timeout=0.1) is None
+    finally:
+        blocked.set()
+        poller.stop()
+
+
+def test_poller_first_poll_fails():
+    def fetch():
+        raise ValueError("down")
+    poller = Poller(fetch, 60)
+    poller.start()
+    try:
+        assert poller.get(timeout=5) is None
+        start = time()
+        assert poller.get() is None
+        assert time() - start < 0.1
+    finally:
+        poller.stop()
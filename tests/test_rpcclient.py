@@ -1,8 +1,10 @@
 from tests.lib import *  # NOQA - fixtures
 
 from unittest.mock import MagicMock, call
-from pyircbot.rpc import BotRPC
-from pyircbot.rpcclient import connect
+from pyircbot.rpc import BotRPC, EventSubscription
+from pyircbot.rpcclient import connect, subscribe
+from pyircbot.irccore import IRCEvent, UserPrefix
+from threading import Thread
 from random import randint
 from time import sleep
 
@@ -85,3 +87,79 @@ def test_rpc_internal(monkeypatch):
     # ["eval", "foo"],
     # ["exec", "foo"],
     # ["quit", "foo"]]
+
+
+def test_rpc_batch_threads():
+    m = MagicMock()
+    m.botconfig = {"bot": {"rpcbind": "127.0.0.1", "rpcport": randint(40000, 65000)}}
+    assert BotRPC(m).server.batch_pool is None
+    m.botconfig = {"bot": {"rpcbind": "127.0.0.1", "rpcport": randint(40000, 65000), "rpcbatchthreads": 2}}
+    assert BotRPC(m).server.batch_pool._max_workers == 2
+
+
+def test_rpc_max_streams():
+    m = MagicMock()
+    m.botconfig = {"bot": {"rpcbind": "127.0.0.1", "rpcport": randint(40000, 65000)}}
+    assert BotRPC(m).server.max_streams == 16
+    m.botconfig = {"bot": {"rpcbind": "127.0.0.1", "rpcport": randint(40000, 65000), "rpcmaxstreams": 2}}
+    assert BotRPC(m).server.max_streams == 2
+
+
+def test_event_subscription():
+    sub = EventSubscription(commands=["privmsg"], channels=["#Test"], regex="^hello", buffer_size=2)
+    prefix = UserPrefix("chatter", "root", "cia.gov")
+    assert not sub.match(IRCEvent("JOIN", ["#test"], prefix, None))
+    assert not sub.match(IRCEvent("PRIVMSG", ["#other"], prefix, "hello"))
+    assert not sub.match(IRCEvent("PRIVMSG", ["#test"], prefix, "bye"))
+    assert sub.match(IRCEvent("PRIVMSG", ["#test"], prefix, "hello world"))
+    assert not EventSubscription().match(IRCEvent("_RECV", ["#test"], prefix, "hello"))
+
+    for i in range(5):
+        sub.offer(IRCEvent("PRIVMSG", ["#test"], prefix, "hello {}".format(i)))
+    assert sub.dropped == 3
+    events = sub.get(0)
+    assert [e["trailing"] for e in events] == ["hello 3", "hello 4"]
+    assert sub.get(0.01) == []
+
+
+def test_rpc_stream_events():
+    port = randint(40000, 65000)
+    m = MagicMock()
+    m.botconfig = {"bot": {"rpcbind": "127.0.0.1", "rpcport": port}}
+    m.loop.call_soon_threadsafe = lambda func, *args: func(*args)
+    server = BotRPC(m)
+    sleep(0.05)
+    assert not m.irc.addHook.called
+
+    received = []
+
+    def consume():
+        for event in subscribe("127.0.0.1", port, commands=["PRIVMSG"], heartbeat=0.1):
+            received.append(event)
+            if len(received) == 2:
+                break
+
+    consumer = Thread(target=consume, daemon=True)
+    consumer.start()
+    for _ in range(100):
+        if server.subscribers:
+            break
+        sleep(0.01)
+    m.irc.addHook.assert_called_once_with("_ALL", server._irchook_stream)
+
+    prefix = UserPrefix("chatter", "root", "cia.gov")
+    server._irchook_stream(IRCEvent("JOIN", ["#test"], prefix, None))
+    server._irchook_stream(IRCEvent("PRIVMSG", ["#test"], prefix, "one"))
+    sleep(0.3)  # a heartbeat goes by
+    server._irchook_stream(IRCEvent("PRIVMSG", ["#test"], prefix, "two"))
+    consumer.join(2)
+    expected = [("PRIVMSG", "one", 0), ("PRIVMSG", "two", 0)]
+    assert [(e["command"], e["trailing"], e["dropped"]) for e in received] == expected
+    assert received[0]["prefix"] == ["chatter", "root", "cia.gov"]
+
+    for _ in range(100):  # the server notices the disconnect on its next write
+        if not server.subscribers:
+            break
+        sleep(0.05)
+    assert not server.subscribers
+    m.irc.removeHook.assert_called_once_with("_ALL", server._irchook_stream)